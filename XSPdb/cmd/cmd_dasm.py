@@ -1,6 +1,6 @@
 #coding=utf-8
 
-from XSPdb.cmd.util import dasm_bytes, error, info, message
+from XSPdb.cmd.util import dasm_bytes, error, info, message, set_dasm_backend, get_dasm_backend, DASM_BACKENDS
 
 class CmdDASM:
 
@@ -42,6 +42,9 @@ class CmdDASM:
         Returns:
             list((address, hex, mnemonic, str)): Disassembly results
         """
+        asm_data = self.api_dasm_index_range(address, length)
+        if asm_data is not None:
+            return asm_data
         end_address = address + length
         if self.api_is_flash_address(address) and \
            not self.api_is_flash_address(end_address):
@@ -82,7 +85,7 @@ class CmdDASM:
         Returns:
             list((address, hex, mnemonic, str)): Disassembly results
         """
-        return self.api_read_data_as_asm(address, length, self.df.pmem_read)
+        return self.api_read_data_as_asm(address, length, None)
 
     def api_dasm_from_bytes(self, bytes, start_address=0):
         """Convert binary data to assembly instructions
@@ -102,7 +105,7 @@ class CmdDASM:
         Args:
             address (int): Target memory address
             length (int): Target memory length
-            read_func (function): Function to read uint64
+            read_func (function): Function to read uint64, None to read physical memory in bulk
 
         Returns:
             list((address, hex, mnemonic, str)): Disassembly results
@@ -110,21 +113,22 @@ class CmdDASM:
         dasm_list = []
         try:
             sta_address = address - address % 2                      # Starting memory address must be 2-byte aligned
-            end_address = sta_address + (2 + length//2 + length % 2) # Ending memory address must be 2-byte aligned; read at least 2 bytes
+            end_address = sta_address + max(2, length + length % 2)   # Ending memory address must be 2-byte aligned; read at least 2 bytes
             assert sta_address >=0 , "address need >=0 and not miss align"
             assert length >=0, "length need >=0 "
-
-            pmem_sta_address = sta_address - sta_address % 8         # Physical memory reads 8 bytes at a time; must be 8-byte aligned
-            pmem_end_address = end_address - end_address % 8         # Physical memory reads 8 bytes at a time; must be 8-byte aligned
-            count = 1 + pmem_end_address - pmem_sta_address
-            buffer = bytearray()
-            for index in range(count):
-                padd = pmem_sta_address + 8*index
-                buffer += read_func(padd).to_bytes(8, byteorder='little', signed=False)
-            # Calculate offset
-            offset = sta_address - pmem_sta_address
-            for instr in dasm_bytes(buffer[offset:], sta_address):
-                    dasm_list.append(instr)
+            read_size = end_address - sta_address + 2                 # 2 more bytes for the 32-bit instruction across the end
+            if self.mrw_write_pending:
+                self.api_mem_write_flush()
+            buffer = None
+            if read_func is None:
+                buffer = self.api_read_bytes_bulk(sta_address, read_size)
+                read_func = self.df.pmem_read
+            if buffer is None:
+                buffer = self.api_read_bytes_with_func(sta_address, read_size, read_func)
+            for instr in dasm_bytes(buffer, sta_address):
+                if instr[0] >= end_address:
+                    break
+                dasm_list.append(instr)
         except Exception as e:
             import traceback
             error(f"disasm fail: {str(e)} {traceback.print_exc()}")
@@ -146,8 +150,18 @@ class CmdDASM:
         try:
             address = int(args[0], 0)
             length = int(args[1])
-            for l in self.api_all_data_to_asm(address, length):
-                message("0x%x: %s\t%s\t%s" % (l[0], l[1], l[2], l[3]))
+            location = None
+            asm_data = self.api_all_data_to_asm(address, length)
+            labels = self.api_asm_labels(asm_data)
+            for l in asm_data:
+                entry, target = labels.get(l[0], (None, None))
+                if entry is not None:
+                    message(f"{entry}:")
+                line = self.api_address_to_line(l[0])
+                if line is not None and line != location:
+                    message(f"{line}:")
+                location = line
+                message("0x%x: %s\t%s\t%s%s" % (l[0], l[1], l[2], l[3], "" if target is None else " " + target))
         except Exception as e:
             error(f"convert {args[0]} or {args[1]} to number fail: {str(e)}")
 
@@ -223,3 +237,35 @@ class CmdDASM:
             arg (None): No arguments
         """
         self.info_cache_asm.clear()
+
+    def api_set_dasm_backend(self, name):
+        """Select the disassembler backend
+
+        Args:
+            name (string): spike-dasm, capstone or builtin
+        Returns:
+            bool: True if the backend is selected
+        """
+        if not set_dasm_backend(name):
+            return False
+        self.info_cache_asm.clear()
+        if self.dasm_index_file:
+            self.api_dasm_index_on_load(self.dasm_index_file)
+        info(f"disassembler backend: {name}")
+        return True
+
+    def do_xset_dasm_backend(self, arg):
+        """Select the disassembler backend (spike-dasm, capstone or builtin)
+
+        Args:
+            name (string): Backend name, show the current backend if empty
+        """
+        name = arg.strip()
+        if not name:
+            message(f"current disassembler backend: {get_dasm_backend()} (supported: {', '.join(DASM_BACKENDS)})")
+            message("usage: xset_dasm_backend <spike-dasm|capstone|builtin>")
+            return
+        self.api_set_dasm_backend(name)
+
+    def complete_xset_dasm_backend(self, text, line, begidx, endidx):
+        return [b for b in DASM_BACKENDS if b.startswith(text)]
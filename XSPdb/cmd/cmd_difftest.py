@@ -9,6 +9,7 @@ class CmdDiffTest:
         assert hasattr(self, "difftest_stat"), "difftest_stat not found"
         self.condition_watch_commit_pc = {}    
         self.condition_instrunct_istep = {}
+        self.condition_instr_count = {}
         self.difftest_ref_so = self.xsp.CString()
         self.difftest_ref_is_inited = False
         self.difftest_diff_checker = {}
@@ -67,20 +68,20 @@ class CmdDiffTest:
         """Initialize the difftest diff"""
         if not self.api_init_ref():
             return False
-        checker = self.difftest_diff_checker.get("checker")
-        if not checker:
-            checker = self.xsp.ComUseCondCheck(self.dut.xclock)
-            tmp_dat = self.xsp.ComUseDataArray(4)
-            checker.SetCondition("diff_test_do_diff_check", tmp_dat.BaseAddr(), tmp_dat.BaseAddr(),
-                                 self.xsp.ComUseCondCmp_NE, 4, 0, 0, 0,
-                                 checker.AsPtrXFunc(self.df.GetFuncAddressOfDifftestStepAndCheck()),
-                                 0)
-            self.difftest_diff_checker["checker"] = checker
         key = "diff_test_do_diff_check"
-        self.dut.xclock.RemoveStepRisCbByDesc(key)
+        self.cond_registry.remove(key)
         self.difftest_diff_is_run = False
         if turn_on:
-            self.dut.xclock.StepRis(checker.GetCb(), checker.CSelf(), key)
+            tmp_dat = self.difftest_diff_checker.get("tmp_dat")
+            if tmp_dat is None:
+                tmp_dat = self.xsp.ComUseDataArray(4)
+                self.difftest_diff_checker["tmp_dat"] = tmp_dat
+            checker = self.cond_registry.get_checker()
+            self.cond_registry.add(key, "difftest", tmp_dat.BaseAddr(), tmp_dat.BaseAddr(),
+                                   self.xsp.ComUseCondCmp_NE, 4, 0, 0, 0,
+                                   checker.AsPtrXFunc(self.df.GetFuncAddressOfDifftestStepAndCheck()),
+                                   0, keep=(tmp_dat,))
+            self.difftest_diff_checker["checker"] = checker
             self.difftest_diff_is_run = True
             info("turn on difftest diff")
         else:
@@ -193,6 +194,14 @@ class CmdDiffTest:
                 break
         return pclist
 
+    def api_commit_valid_pcs(self):
+        """Get the PCs of the valid commit slots, in commit order
+
+        Returns:
+            list: List of PCs
+        """
+        return [pc for pc, valid in self.api_commit_pc_list() if valid]
+
     def do_xpc(self, a):
         """Print the current Commit PCs and instructions
 
@@ -304,8 +313,11 @@ class CmdDiffTest:
 
     def api_break_is_instruction_commit(self):
         """check break  is instruction commit or not"""
-        checker = self.condition_instrunct_istep.get("checker")
-        return self.comuse_checker_is_break(checker)
+        return self.cond_registry.group_hit("stepi_check")
+
+    def api_break_is_instr_count(self):
+        """check break is instruction count reached or not"""
+        return self.cond_registry.group_hit("xirun")
 
     def api_break_is_watch_commit_pc(self):
         """check break  is watch commit pc or not"""
@@ -337,16 +349,25 @@ class CmdDiffTest:
             v = self.api_step_dut(10000)
             if self.api_dut_is_step_exit():
                 break
-            if self.interrupt:
+            if self.interrupt or self.cycle_event_stopped:
                 break
             elif self.dut.xclock.IsDisable():
                 self.api_istep_update_commit_pc()
+                if self.funcstat_running or self.ftrace is not None:
+                    valid_pcs = self.api_commit_valid_pcs()
+                    if self.funcstat_running:
+                        self.api_funcstat_commit(valid_pcs)
+                    if self.ftrace is not None:
+                        self.api_ftrace_commit(valid_pcs)
                 pc = max(self.api_get_istep_last_commit_pc() + [-1])
                 self.data_last_symbol_block = self.api_echo_pc_symbol_block_change(pc,
                                                                                    self.data_last_symbol_block,
                                                                                    self.data_last_symbol_pc)
                 self.data_last_symbol_pc = pc
             elif v == 10000:
+                if self.funcstat_running:
+                    # commits landing on unchanged PCs (e.g. a tight loop) do not stop the step
+                    self.api_funcstat_commit([])
                 warn("step %d cycles complete, but no instruction commit find" % v)
                 step_taken -= 1 # ignore record
             step_taken += 1
@@ -357,15 +378,11 @@ class CmdDiffTest:
     def api_xistep_break_on(self):
         """Set the instruction step break condition"""
         if not self.condition_instrunct_istep:
-            checker = self.xsp.ComUseCondCheck(self.dut.xclock)
-            self.condition_instrunct_istep["checker"] = checker
             pc_old_list = [self.xsp.ComUseDataArray(8) for i in range(8)]
             pc_lst_list = [self.xsp.ComUseDataArray(self.difftest_stat.get_commit(i).get_pc_address(), 8) for i in range(8)]
-            # sync pc and add checker
+            # sync pc
             for i, opc in enumerate(pc_old_list):
-                lpc = pc_lst_list[i]
-                opc.SyncFrom(lpc.BaseAddr(), 8)
-                checker.SetCondition("stepi_check_pc_%d" % i, lpc.BaseAddr(), opc.BaseAddr(), self.xsp.ComUseCondCmp_NE, 8)
+                opc.SyncFrom(pc_lst_list[i].BaseAddr(), 8)
             self.condition_instrunct_istep["pc_old_list"] = pc_old_list
             self.condition_instrunct_istep["pc_lst_list"] = pc_lst_list
             def _update_old_pc():
@@ -373,18 +390,88 @@ class CmdDiffTest:
                     lpc = pc_lst_list[i]
                     opc.SyncFrom(lpc.BaseAddr(), 8)
             self.condition_instrunct_istep["pc_sync_list"] = _update_old_pc
-        cb_key = "stepi_check"
-        checker = self.condition_instrunct_istep["checker"]
-        if cb_key in self.dut.xclock.ListSteRisCbDesc():
+        if self.cond_registry.has_group("stepi_check"):
             return
-        self.dut.xclock.StepRis(checker.GetCb(), checker.CSelf(), cb_key)
+        pc_old_list = self.condition_instrunct_istep["pc_old_list"]
+        pc_lst_list = self.condition_instrunct_istep["pc_lst_list"]
+        for i, opc in enumerate(pc_old_list):
+            lpc = pc_lst_list[i]
+            self.cond_registry.add("stepi_check_pc_%d" % i, "stepi_check", lpc.BaseAddr(), opc.BaseAddr(), self.xsp.ComUseCondCmp_NE, 8)
 
     def api_xistep_break_off(self):
         """Remove the instruction step break condition"""
-        cb_key = "stepi_check"
-        if cb_key in self.dut.xclock.ListSteRisCbDesc():
-            self.dut.xclock.RemoveStepRisCbByDesc(cb_key)
-        assert cb_key not in self.dut.xclock.ListSteRisCbDesc()
+        self.cond_registry.remove_group("stepi_check")
+
+    def api_xirun_is_native(self):
+        """Check if the committed instruction counter of the DUT can be watched natively"""
+        return hasattr(self.difftest_stat.trap, "get_instrCnt_address")
+
+    def api_commit_hooks_on(self):
+        """Check if anything needs to see every commit (symbol block trace, ftrace, funcstat)"""
+        return self.flag_trace_pc_symbol_block_change or self.ftrace is not None or self.funcstat_running
+
+    def api_xirun_break_on(self, target):
+        """Break when the committed instruction counter of the DUT reaches target
+
+        Args:
+            target (int): Target value of trap.instrCnt
+        """
+        if not self.condition_instr_count:
+            self.condition_instr_count["instr_cnt"] = self.xsp.ComUseDataArray(self.difftest_stat.trap.get_instrCnt_address(), 8)
+            self.condition_instr_count["instr_target"] = self.xsp.ComUseDataArray(8)
+        instr_cnt = self.condition_instr_count["instr_cnt"]
+        instr_target = self.condition_instr_count["instr_target"]
+        instr_target.FromBytes(target.to_bytes(8, byteorder='little', signed=False))
+        if "xirun_instr_count" in self.cond_registry:
+            return
+        self.cond_registry.add("xirun_instr_count", "xirun", instr_cnt.BaseAddr(), instr_target.BaseAddr(), self.xsp.ComUseCondCmp_GE, 8)
+
+    def api_xirun_break_off(self):
+        """Remove the instruction count break condition"""
+        self.cond_registry.remove("xirun_instr_count")
+
+    def api_xirun(self, instr_count, max_cycle=0xFFFFFFFFFFFFFFFF):
+        """Run until instr_count instructions commit
+
+        The committed instruction counter of the DUT (trap.instrCnt) is compared with the target
+        in a clock callback, Python only wakes up every step batch, not per commit. Several
+        instructions may commit in the last cycle, so the run can pass the target by up to the
+        commit width. Without the counter address (old difftest-python) it falls back to api_xistep.
+
+        Args:
+            instr_count (int): Number of instructions
+            max_cycle (int): Max cycles to run
+        Returns:
+            int: Number of instructions committed
+        """
+        if not self.api_xirun_is_native():
+            return self.api_xistep(instr_count)
+        if instr_count <= 0:
+            return 0
+        trap = self.difftest_stat.trap
+        instr_start = trap.instrCnt
+        self.api_xirun_break_on(instr_start + instr_count)
+        try:
+            self.api_step_dut(max_cycle)
+        finally:
+            self.api_xirun_break_off()
+        return trap.instrCnt - instr_start
+
+    def do_xirun(self, arg):
+        """Run until N instructions commit (counted natively, no stop per commit)
+
+        Args:
+            instr_count (int): Number of instructions
+        """
+        try:
+            instr_count = int(arg.strip(), 0)
+        except Exception as e:
+            error(f"convert {arg} to number fail: {str(e)}\nusage: xirun <instr_count>")
+            return
+        if not self.api_xirun_is_native():
+            warn("trap.get_instrCnt_address not found, step by instructions (please build the latest difftest-python)")
+        c = self.api_xirun(instr_count)
+        info(f"{c} instructions committed")
 
     def do_xistep_break(self, arg):
         """Set the instruction step break condition
@@ -0,0 +1,283 @@
+#coding=utf-8
+
+import os
+import bisect
+import hashlib
+import pickle
+import multiprocessing
+from array import array
+from XSPdb.cmd.util import info, error, message, warn, dasm_bytes, get_dasm_backend, init_dasm_worker, get_cache_dir
+from XSPdb.cmd.util import spike_dasm_path
+from XSPdb.cmd.xelf import ElfFile, is_elf_file
+
+DASM_INDEX_VERSION = 1
+
+
+def dasm_index_chunk(task):
+    """Disassemble one chunk of an image (runs in the worker processes)
+
+    Args:
+        task (data, address): Chunk data and its address
+    Returns:
+        list((address, hex, mnemonic, str)): Disassembly results
+    """
+    data, address = task
+    return dasm_bytes(data, address)
+
+
+class CmdDasmIndex:
+    """Static disassembly index of the loaded image
+
+    A linear sweep over the executable sections (the whole file for raw bin images), built once
+    per image and backend in parallel chunks, and persisted in the cache dir keyed by the content hash.
+    """
+
+    def __init__(self):
+        assert hasattr(self, "dut"), "this class must be used in XSPdb, canot be used alone"
+        self.dasm_index_auto = False
+        self.dasm_index_chunk_size = 256*1024
+        self.dasm_index_overlap = 64
+        self.dasm_index_max_size = 64*1024*1024
+        self.dasm_index_workers = os.cpu_count() or 1
+        self.dasm_index_clear()
+
+    def dasm_index_clear(self):
+        self.dasm_index_file = None
+        self.dasm_index_ranges = []
+        self.dasm_index_addr = array('Q')
+        self.dasm_index_asm = []
+        self.dasm_index_gen = 0
+
+    def api_dasm_index_clear(self):
+        """Drop the static disassembly index"""
+        self.dasm_index_clear()
+
+    def api_dasm_index_regions(self, image_file):
+        """Get the regions to index in an image
+
+        Args:
+            image_file (string): ELF or raw bin file (a raw bin is loaded at mem base)
+        Returns:
+            list((address, bytes)): Load address and data of each region
+        """
+        if is_elf_file(image_file):
+            elf = ElfFile(image_file)
+            return sorted((elf.vaddr_to_paddr(sec.addr), elf.read_section(sec)) for sec in elf.exec_sections())
+        size = os.path.getsize(image_file)
+        if size > self.dasm_index_max_size:
+            warn(f"{image_file} is larger than {self.dasm_index_max_size} bytes, only the head is indexed")
+        with open(image_file, "rb") as f:
+            return [(self.mem_base, f.read(self.dasm_index_max_size))]
+
+    def api_dasm_index_key(self, image_file):
+        """Get the cache key of an image: hash of the content, the load base and the disassembler backend"""
+        h = hashlib.sha1()
+        with open(image_file, "rb") as f:
+            for data in iter(lambda: f.read(4*1024*1024), b""):
+                h.update(data)
+        h.update(f"{DASM_INDEX_VERSION}:{self.mem_base}:{self.dasm_index_max_size}:{get_dasm_backend()}".encode())
+        return h.hexdigest()
+
+    def api_dasm_index_sweep(self, address, data):
+        """Disassemble a region in parallel chunks, and stitch the chunks at a common instruction boundary
+
+        Args:
+            address (int): Region address
+            data (bytes): Region data
+        Returns:
+            list((address, hex, mnemonic, str)): Disassembly results
+        """
+        csz = self.dasm_index_chunk_size
+        ovl = self.dasm_index_overlap
+        backend = get_dasm_backend()
+        # Every chunk runs ovl bytes into the next one, so the decoding of both can be synchronized
+        tasks = [(data[i:i+csz+ovl], address + i) for i in range(0, len(data), csz)]
+        chunks = None
+        # spike-dasm already runs in its own co-process, its pipes cannot be shared with workers
+        if len(tasks) > 1 and self.dasm_index_workers > 1 and backend != "spike-dasm":
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+                # Not forked: a forked worker would inherit the threads and locks of the parent
+                with ProcessPoolExecutor(max_workers=min(self.dasm_index_workers, len(tasks)),
+                                         mp_context=multiprocessing.get_context("forkserver"),
+                                         initializer=init_dasm_worker,
+                                         initargs=(backend, spike_dasm_path)) as pool:
+                    chunks = list(pool.map(dasm_index_chunk, tasks))
+            except Exception as e:
+                warn(f"parallel disassembly fail ({str(e)}), use one process")
+        if chunks is None:
+            chunks = [dasm_index_chunk(t) for t in tasks]
+        result = []
+        for i, chunk in enumerate(chunks):
+            if not result:
+                result = chunk
+                continue
+            boundary = address + i*csz
+            # Instructions of the previous chunk decoded in the overlap
+            prev = {x[0]: n for n, x in enumerate(result[-(ovl//2 + 2):]) if x[0] >= boundary}
+            sync = next((n for n, x in enumerate(chunk) if x[0] in prev), None)
+            if sync is None:
+                # No common boundary in the overlap, decode again from the previous chunk's alignment
+                sta = min(prev) if prev else result[-1][0] + len(result[-1][1])//2
+                chunk = dasm_index_chunk((data[sta - address:boundary - address + csz + ovl], sta))
+                sync = 0
+            sync_addr = chunk[sync][0]
+            while result and result[-1][0] >= sync_addr:
+                result.pop()
+            result += chunk[sync:]
+        # Cut the overlap of the last chunk and the instructions running past the end
+        end = address + len(data)
+        while result and result[-1][0] + len(result[-1][1])//2 > end:
+            result.pop()
+        return result
+
+    def api_dasm_index_build(self, image_file, use_cache=True):
+        """Build (or load from the cache dir) the static disassembly index of an image
+
+        Args:
+            image_file (string): ELF or raw bin file
+            use_cache (bool): Load/save the index from/to the cache dir
+        Returns:
+            int: Number of indexed instructions, None if fail
+        """
+        if not image_file or not os.path.isfile(image_file):
+            error(f"image file {image_file} not found")
+            return None
+        self.dasm_index_clear()
+        key = self.api_dasm_index_key(image_file)
+        cache_dir = get_cache_dir("dasm_index") if use_cache else None
+        cache_file = os.path.join(cache_dir, key + ".pkl") if cache_dir else None
+        index = None
+        if cache_file and os.path.isfile(cache_file):
+            try:
+                with open(cache_file, "rb") as f:
+                    index = pickle.load(f)
+                if index.get("version") != DASM_INDEX_VERSION:
+                    index = None
+            except Exception as e:
+                warn(f"ignore broken dasm index {cache_file}: {str(e)}")
+                index = None
+        if index is None:
+            ranges, asm = [], []
+            for address, data in self.api_dasm_index_regions(image_file):
+                if not data or (ranges and address < ranges[-1][1]):
+                    continue
+                asm += self.api_dasm_index_sweep(address, data)
+                ranges.append((address, address + len(data)))
+            index = {"version": DASM_INDEX_VERSION, "ranges": ranges, "asm": asm}
+            if cache_file:
+                try:
+                    with open(cache_file + ".tmp", "wb") as f:
+                        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(cache_file + ".tmp", cache_file)
+                except OSError as e:
+                    warn(f"save dasm index to {cache_file} fail: {str(e)}")
+        self.dasm_index_file = image_file
+        self.dasm_index_ranges = index["ranges"]
+        self.dasm_index_asm = index["asm"]
+        self.dasm_index_addr = array('Q', (x[0] for x in self.dasm_index_asm))
+        self.dasm_index_gen = self.mem_gen
+        info(f"dasm index of {image_file}: {len(self.dasm_index_asm)} instructions in {len(self.dasm_index_ranges)} regions")
+        return len(self.dasm_index_asm)
+
+    def api_dasm_index_on_load(self, image_file):
+        """Called after an image is loaded: drop the index of the old image, build the new one if auto is on"""
+        self.dasm_index_clear()
+        if self.dasm_index_auto:
+            self.api_dasm_index_build(image_file)
+
+    def api_dasm_index_valid(self, start, end):
+        """Check if [start, end) is in one indexed region and not written since the index was built"""
+        i = bisect.bisect_right(self.dasm_index_ranges, (start, float("inf"))) - 1
+        if i < 0 or end > self.dasm_index_ranges[i][1]:
+            return False
+        page_size = self.api_mem_page_size()
+        for page in range(start - (start - self.mem_base) % page_size, end + 2, page_size):
+            if self.api_mem_page_gen(page) > self.dasm_index_gen:
+                return False
+        return True
+
+    def api_dasm_index_lookup(self, address):
+        """Find the indexed instruction containing an address
+
+        Args:
+            address (int): Address
+        Returns:
+            int: Position in the index, -1 if not found
+        """
+        i = bisect.bisect_right(self.dasm_index_addr, address) - 1
+        if i < 0 or address >= self.dasm_index_addr[i] + len(self.dasm_index_asm[i][1])//2:
+            return -1
+        return i
+
+    def api_dasm_index_range(self, address, length):
+        """Get the indexed disassembly of [address, address + length)
+
+        Args:
+            address (int): Start address
+            length (int): Length
+        Returns:
+            list((address, hex, mnemonic, str)): Disassembly results, None if not (validly) indexed
+        """
+        if not self.dasm_index_asm or not self.api_dasm_index_valid(address, address + max(length, 2)):
+            return None
+        sta = bisect.bisect_left(self.dasm_index_addr, address - address % 2)
+        end = bisect.bisect_left(self.dasm_index_addr, address + max(length, 2), sta)
+        return self.dasm_index_asm[sta:end]
+
+    def api_dasm_index_window(self, address, lines):
+        """Get the indexed instructions around an address
+
+        Args:
+            address (int): Center address
+            lines (int): Number of instructions before and after the address
+        Returns:
+            list((address, hex, mnemonic, str)): Disassembly results, None if not (validly) indexed
+        """
+        r = bisect.bisect_right(self.dasm_index_ranges, (address, float("inf"))) - 1
+        if not self.dasm_index_asm or r < 0 or address >= self.dasm_index_ranges[r][1]:
+            return None
+        # Keep the window in the region holding the address
+        lo = bisect.bisect_left(self.dasm_index_addr, self.dasm_index_ranges[r][0])
+        hi = bisect.bisect_left(self.dasm_index_addr, self.dasm_index_ranges[r][1])
+        mid = bisect.bisect_left(self.dasm_index_addr, address, lo, hi)
+        sta, end = max(lo, mid - lines), min(hi, mid + lines)
+        if sta >= end:
+            return None
+        last = self.dasm_index_asm[end - 1]
+        if not self.api_dasm_index_valid(self.dasm_index_addr[sta], last[0] + len(last[1])//2):
+            return None
+        return self.dasm_index_asm[sta:end]
+
+    def do_xdasm_index(self, arg):
+        """Manage the static disassembly index of the loaded image
+
+        Args:
+            on/off (string): Build the index on every xload or not
+            build (string): Build the index of the loaded image (or a given ELF/bin file) now
+            clear (string): Drop the index
+        """
+        args = arg.strip().split()
+        if not args:
+            message(f"auto build on xload: {'on' if self.dasm_index_auto else 'off'}")
+            if self.dasm_index_file:
+                message(f"index of {self.dasm_index_file}: {len(self.dasm_index_asm)} instructions")
+                for sta, end in self.dasm_index_ranges:
+                    message(f"  0x{sta:x} - 0x{end:x}")
+            message("usage: xdasm_index [on|off|build [file]|clear]")
+            return
+        if args[0] in ("on", "off"):
+            self.dasm_index_auto = args[0] == "on"
+            if self.dasm_index_auto and not self.dasm_index_file and self.exec_bin_file:
+                self.api_dasm_index_build(self.exec_bin_file)
+        elif args[0] == "build":
+            self.api_dasm_index_build(args[1] if len(args) > 1 else self.exec_bin_file)
+        elif args[0] == "clear":
+            self.api_dasm_index_clear()
+        else:
+            error(f"unknown option: {args[0]}")
+
+    def complete_xdasm_index(self, text, line, begidx, endidx):
+        if line.split()[1:2] == ["build"]:
+            return self.api_complite_localfile(text)
+        return [x for x in ["on", "off", "build", "clear"] if x.startswith(text)]
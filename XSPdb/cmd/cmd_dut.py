@@ -1,8 +1,10 @@
 #coding=utf-8
 
 import os
+import signal
 import time
 from XSPdb.cmd.util import info, error, message, warn, get_completions
+from XSPdb.cmd.xsched import CycleScheduler
 
 class CmdDut:
     
@@ -10,6 +12,15 @@ class CmdDut:
         assert hasattr(self, "dut"), "this class must be used in XSPdb, canot be used alone"
         self.interrupt = False
         self.xdut_signal_breaks = {}
+        self.run_timeout = False
+        self.run_chunk_cycles = 100000
+        self.step_batch_cycle = 200
+        self.step_batch_fixed = 0
+        self.step_batch_range = (10, 1 << 20)
+        self.step_latency_target = 0.05
+        self.cycle_events = CycleScheduler()
+        self.cycle_event_stopped = False
+        self.api_step_stats_reset()
         self.api_dut_reset()
 
     def api_xbreak(self, signal_name, condition, value, callback=None, callback_once=False):
@@ -23,15 +34,8 @@ class CmdDut:
                 cb(self, checker, k, clk, sig.value, target.value)
             callback_once (bool): Whether to call the callback function only once and remove the breakpoint
         """
-        checker = self.xdut_signal_breaks.get("checker")
-        checker_key = "xdut_signal_break"
-        if not checker:
-            checker = self.xsp.ComUseCondCheck(self.dut.xclock)
-            self.dut.xclock.RemoveStepRisCbByDesc(checker_key)
-            self.dut.xclock.StepRis(checker.GetCb(), checker.CSelf(), checker_key)
-            self.xdut_signal_breaks["checker"] = checker
         xbreak_key = "xbreak-%s-%s-%s"%(signal_name, condition, value)
-        if xbreak_key in checker.ListCondition():
+        if xbreak_key in self.cond_registry:
             error(f"signal {xbreak_key} already set")
             return
         sig = self.dut.GetInternalSignal(signal_name)
@@ -59,7 +63,8 @@ class CmdDut:
         if cmp is None:
             error(f"condition '{condition}' not supported")
             return
-        checker.SetCondition(xbreak_key, sig, val, cmp)
+        self.cond_registry.add(xbreak_key, "xbreak", sig, val, cmp, keep=(sig, val))
+        self.xdut_signal_breaks["checker"] = self.cond_registry.checker
         self.xdut_signal_breaks[xbreak_key] = {"sig": sig, "val": val, "cmp": condition.lower(), "cb": callback, "cb_once": callback_once}
         return xbreak_key
 
@@ -74,18 +79,13 @@ class CmdDut:
             warn("checker not found, please set a breakpoint first")
             return
         rcount = 0
-        kcount = 0
-        for k, _ in checker.ListCondition().items():
-            kcount += 1
+        for k in self.cond_registry.keys("xbreak"):
             if k.startswith(xbreak_key):
-                checker.RemoveCondition(k)
+                self.cond_registry.remove(k)
                 del self.xdut_signal_breaks[k]
                 info(f"remove signal {k} break")
                 rcount +=1
-                kcount -= 1
-        if kcount == 0:
-            self.dut.xclock.RemoveStepRisCbByDesc("xdut_signal_break")
-            assert "xdut_signal_break" not in self.dut.xclock.ListSteRisCbDesc()
+        if not self.cond_registry.has_group("xbreak"):
             self.xdut_signal_breaks.clear()
             info("No signal to watch, remove checker")
         if rcount > 0:
@@ -111,9 +111,7 @@ class CmdDut:
         if not checker:
             warn("checker not found, please set a breakpoint first")
             return
-        checker.ClearCondition()
-        self.dut.xclock.RemoveStepRisCbByDesc("xdut_signal_break")
-        assert "xdut_signal_break" not in self.dut.xclock.ListSteRisCbDesc()
+        self.cond_registry.remove_group("xbreak")
         self.xdut_signal_breaks.clear()
         info("clear all signal breakpoints")
 
@@ -123,11 +121,10 @@ class CmdDut:
         checker = self.xdut_signal_breaks.get("checker")
         if not checker:
             return ret
-        checked = {k: v for (k, v) in checker.ListCondition().items()}
         for k, v in self.xdut_signal_breaks.items():
             if not k.startswith("xbreak-"):
                 continue
-            ret.append((k, v["sig"].value, v["cmp"], v["val"].value, checked[k]))
+            ret.append((k, v["sig"].value, v["cmp"], v["val"].value, self.cond_registry.is_hit(k)))
         ret.sort(key=lambda x: x[0])
         return ret
 
@@ -143,22 +140,18 @@ class CmdDut:
             if not callable(v["cb"]):
                 continue
             callbacks[k] = (v["cb"], v["cb_once"])
-        if not callbacks:
+        if not callbacks or not self.cond_registry.group_hit("xbreak"):
             return cb_count
-        checked = {k: v for (k, v) in checker.ListCondition().items() if v}
         for k, (cb, once) in callbacks.items():
-            if k not in checked:
+            if not self.cond_registry.is_hit(k):
                 continue
             cb(self, checker, k, self.dut.xclock.clk, self.xdut_signal_breaks[k]["sig"].value, self.xdut_signal_breaks[k]["val"].value)
             if once:
-                checker.RemoveCondition(k)
+                self.cond_registry.remove(k)
                 info(f"remove signal {k} break, because callback_once is True")
                 del self.xdut_signal_breaks[k]
             cb_count += 1
-        if not {k: v for (k, v) in checker.ListCondition().items()}:
-            checker.ClearCondition()
-            self.dut.xclock.RemoveStepRisCbByDesc("xdut_signal_break")
-            assert "xdut_signal_break" not in self.dut.xclock.ListSteRisCbDesc()
+        if not self.cond_registry.has_group("xbreak"):
             self.xdut_signal_breaks.clear()
         return cb_count
 
@@ -181,30 +174,117 @@ class CmdDut:
         names = []
         # api_xbreak_list
         names += [v[0] for v in self.api_xbreak_list() if v[4]]
+        # native exit conditions
+        if self.cond_registry.group_hit("good_trap"):
+            names.append("Good trap")
+        if self.cond_registry.group_hit("good_loop"):
+            names.append("Good loop")
         # instrunct_istep
         if self.api_break_is_instruction_commit():
             names.append("Inst commit")
+        if self.api_break_is_instr_count():
+            names.append("Inst count")
         # watch_commit_pc
         if self.api_break_is_watch_commit_pc():
             names.append("Target commit")
         return ",".join(names)
 
+    def api_cycle_event(self, cycle, callback, name=None, period=0):
+        """Call a function exactly at a cycle (xclock.clk), without a per-cycle condition
+
+        The step loops clip their steps to the next event cycle.
+
+        Args:
+            cycle (int): Cycle to call at, must be in the future
+            callback (function): cb(self, clk), returns True to stop stepping
+            name (string): Name of the event
+            period (int): Call again every period cycles, 0 for once
+        Returns:
+            int: Event id, None if the cycle has passed
+        """
+        if cycle <= self.dut.xclock.clk:
+            warn(f"cycle {cycle} has passed (current: {self.dut.xclock.clk})")
+            return None
+        if period < 0:
+            error("period need >= 0")
+            return None
+        event = self.cycle_events.add(cycle, lambda clk: callback(self, clk), name, period)
+        return event.id
+
+    def api_cycle_event_cancel(self, eid):
+        """Cancel a cycle event
+
+        Args:
+            eid (int): Event id
+        """
+        return self.cycle_events.cancel(eid)
+
+    def api_cycle_event_fire(self):
+        """Fire the cycle events due at the current cycle
+
+        Returns:
+            bool: True if an event asks to stop stepping
+        """
+        stops = self.cycle_events.fire(self.dut.xclock.clk)
+        if stops:
+            info("Cycle event (%s) at cycle: %d" % (",".join(e.name for e in stops), self.dut.xclock.clk))
+            self.cycle_event_stopped = True
+        return len(stops) > 0
+
     def api_dut_step_ready(self):
         """Prepare the DUT for stepping"""
         self.dut.xclock.Enable()
         assert not self.dut.xclock.IsDisable(), "clock is disable"
+        self.cond_registry.invalidate()
+        self.cycle_event_stopped = False
         self.interrupt = False # interrupt from outside by user
 
-    def api_step_dut(self, cycle, batch_cycle=200):
+    def api_step_stats_reset(self):
+        """Reset the statistics of api_step_dut"""
+        self.step_stats = {"batches": 0, "cycles": 0, "step_time": 0.0, "check_time": 0.0, "max_batch_time": 0.0}
+
+    def api_step_adapt_batch(self, cycle, step_time, check_time):
+        """Adapt the batch size of api_step_dut to the measured speed
+
+        The batch grows as large as the latency target allows (a Ctrl+C is seen after a
+        batch and its checks), so the checks cost as little as possible. It changes by at most
+        2x per batch to ride out noisy measurements.
+
+        Args:
+            cycle (int): Cycles of the last batch
+            step_time (float): Seconds spent in dut.Step
+            check_time (float): Seconds spent in the checks after it
+        Returns:
+            int: New batch size
+        """
+        if step_time <= 0:
+            batch = cycle*2
+        else:
+            batch = int(cycle/step_time*max(self.step_latency_target - check_time, self.step_latency_target/10))
+        batch = max(cycle//2, min(batch, cycle*2))
+        self.step_batch_cycle = max(self.step_batch_range[0], min(batch, self.step_batch_range[1]))
+        return self.step_batch_cycle
+
+    def api_step_dut(self, cycle, batch_cycle=None):
         """Step through the circuit
 
         Args:
             cycle (int): Number of cycles
-            batch_cycle (int): Number of cycles per run; after each run, check for interrupt signals
+            batch_cycle (int): Number of cycles per run; after each run, check for interrupt signals.
+                               None to adapt it to the speed of the design (see xstep_stats)
         """
         if not self.mem_inited:
             warn("mem not inited, please load bin file first")
+        if self.mrw_write_pending:
+            self.api_mem_write_flush()
+        adaptive = batch_cycle is None and self.step_batch_fixed <= 0
+        if batch_cycle is None:
+            batch_cycle = self.step_batch_fixed if self.step_batch_fixed > 0 else self.step_batch_cycle
+        profile = self.profile_running
+        max_batch = max(1, self.profile_period) if profile else cycle
         def check_break():
+            if profile:
+                self.api_profile_sample()
             if self.dut.xclock.IsDisable():
                 info("Find break point (%s), break (step %d cycles) at cycle: %d (%s)" % (
                     self.api_get_breaked_names(),
@@ -224,23 +304,108 @@ class CmdDut:
                 return True
             return False
         self.api_dut_step_ready()
-        batch, offset = cycle//batch_cycle, cycle % batch_cycle
         c_count = self.dut.xclock.clk
-        need_break = False
-        for i in range(batch):
-            if self.interrupt:
-                break
-            self.dut.Step(batch_cycle)
-            if check_break():
-                need_break = True
+        stats = self.step_stats
+        remain = cycle
+        events = self.cycle_events
+        while remain > 0 and not self.interrupt:
+            n = min(batch_cycle, remain, max_batch)
+            next_event = events.next_cycle()
+            if next_event is not None:
+                n = max(1, min(n, next_event - self.dut.xclock.clk))
+            t0 = time.perf_counter()
+            self.dut.Step(n)
+            t1 = time.perf_counter()
+            need_break = check_break()
+            if next_event is not None and self.dut.xclock.clk >= next_event:
+                need_break = self.api_cycle_event_fire() or need_break
+            t2 = time.perf_counter()
+            remain -= n
+            stats["batches"] += 1
+            stats["step_time"] += t1 - t0
+            stats["check_time"] += t2 - t1
+            stats["max_batch_time"] = max(stats["max_batch_time"], t2 - t0)
+            if need_break:
                 break
-        if not self.interrupt and not need_break:
-            self.dut.Step(offset)
-            check_break()
+            if adaptive and n == batch_cycle:
+                batch_cycle = self.api_step_adapt_batch(n, t1 - t0, t2 - t1)
+        stats["cycles"] += self.dut.xclock.clk - c_count
         if self.dut.xclock.IsDisable():
             self.call_break_callbacks()
         return self.dut.xclock.clk - c_count
 
+    def api_run_native(self, cycle, deadline=0, chunk_time=0.5):
+        """Run the circuit in large steps, the exit conditions stop the clock natively
+
+        Unlike api_step_dut, nothing is checked in Python while the clock runs: good trap,
+        trap break, good loop (if the commit addresses are exported) and the breakpoints are
+        clock-stopping conditions, the cycle budget bounds the step. Python only runs between
+        chunks, whose size is adapted to take about chunk_time seconds, to see Ctrl+C, the
+        deadline (a SIGALRM timer flag) and the difftest exit.
+
+        Args:
+            cycle (int): Max number of cycles
+            deadline (float): Wall time (time.time()) to stop at, 0 for none
+            chunk_time (float): Target wall time of one chunk in seconds
+        Returns:
+            int: Number of cycles run
+        """
+        if not self.mem_inited:
+            warn("mem not inited, please load bin file first")
+        if self.mrw_write_pending:
+            self.api_mem_write_flush()
+        self.run_timeout = False
+        old_alarm = None
+        if deadline > 0:
+            if deadline <= time.time():
+                self.run_timeout = True
+                return 0
+            def on_alarm(s, f):
+                self.run_timeout = True
+            old_alarm = signal.signal(signal.SIGALRM, on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, deadline - time.time())
+        xclock = self.dut.xclock
+        c_count = xclock.clk
+        max_chunk = self.profile_period if self.profile_running else 1 << 26
+        try:
+            # Disarmed in the finally, it must not stay for the interactive steps
+            self.api_break_on_good_loop(True)
+            self.api_dut_step_ready()
+            while not self.interrupt and not self.run_timeout:
+                remain = cycle - (xclock.clk - c_count)
+                if remain <= 0:
+                    break
+                chunk = min(self.run_chunk_cycles, max_chunk)
+                n = min(chunk, remain)
+                next_event = self.cycle_events.next_cycle()
+                if next_event is not None:
+                    n = max(1, min(n, next_event - xclock.clk))
+                t = time.time()
+                self.dut.Step(n)
+                t = time.time() - t
+                if self.profile_running:
+                    self.api_profile_sample()
+                stop = next_event is not None and xclock.clk >= next_event and self.api_cycle_event_fire()
+                if stop or xclock.IsDisable() or self.api_dut_is_step_exit():
+                    break
+                if n == chunk and t > 0:
+                    self.run_chunk_cycles = int(min(max(chunk*chunk_time/t, 1000), 1 << 26))
+            if xclock.IsDisable():
+                info("Find break point (%s), break (step %d cycles) at cycle: %d (%s)" % (
+                    self.api_get_breaked_names(), xclock.clk - c_count, xclock.clk, hex(xclock.clk)))
+        finally:
+            if old_alarm is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, old_alarm)
+            self.api_break_on_good_loop(False)
+        if not self.api_is_difftest_diff_exit(show_log=True):
+            if not self.api_is_hit_good_trap(show_log=True):
+                if not self.api_is_hit_good_loop(show_log=True):
+                    self.api_is_hit_trap_break(show_log=True)
+        if xclock.IsDisable():
+            self.call_break_callbacks()
+        return xclock.clk - c_count
+
     def api_dut_reset(self):
         """Reset the DUT"""
         for i in range(8):
@@ -265,10 +430,11 @@ class CmdDut:
             flash_file (string): Path to the bin file
         """
         assert os.path.exists(flash_file)
+        self.api_mem_write_flush()
         self.df.flash_finish()
         self.df.InitFlash(flash_file)
         self.flash_bin_file = flash_file
-        self.info_cache_asm.clear()
+        self.api_info_cache_invalidate(self.flash_base, self.flash_ends)
 
     def do_xreset(self, arg):
         """Reset DUT
@@ -345,10 +511,10 @@ class CmdDut:
 
         Args:
             cycle (int): Number of cycles
-            steps (int): Number of cycles per run; after each run, check for interrupt signals
+            steps (int): Number of cycles per run; after each run, check for interrupt signals (adaptive by default)
         """
         try:
-            steps = 200
+            steps = None
             cycle = arg.strip().split()
             if len(cycle) > 1:
                 steps = int(cycle[1])
@@ -362,6 +528,83 @@ class CmdDut:
             error(e)
             message("usage: xstep [cycle] [<steps>]")
 
+    def do_xcycle_event(self, arg):
+        """Stop at cycles (xclock.clk) exactly, without a per-cycle condition
+
+        Args:
+            list (string): List the pending cycle events (default)
+            break <cycle> [period] (string): Stop stepping at cycle (and every period cycles after it)
+            cancel <id> (string): Cancel an event
+            clear (string): Cancel all events
+        """
+        args = arg.strip().split()
+        usage = "usage: xcycle_event [list|break <cycle> [period]|cancel <id>|clear]"
+        try:
+            if not args or args[0] == "list":
+                events = self.cycle_events.list()
+                if not events:
+                    message("no cycle event")
+                for e in events:
+                    message(f"{e.id}: {e.name} at cycle {e.cycle}" + (f" every {e.period} cycles" if e.period else ""))
+            elif args[0] == "break" and len(args) > 1:
+                cycle = int(args[1], 0)
+                period = int(args[2], 0) if len(args) > 2 else 0
+                eid = self.api_cycle_event(cycle, lambda s, clk: True, f"break-{cycle}", period)
+                if eid is not None:
+                    info(f"cycle event {eid}: break at cycle {cycle}" + (f" every {period} cycles" if period else ""))
+            elif args[0] == "cancel" and len(args) > 1:
+                if not self.api_cycle_event_cancel(int(args[1], 0)):
+                    error(f"cycle event {args[1]} not found")
+            elif args[0] == "clear":
+                self.cycle_events.clear()
+            else:
+                message(usage)
+        except ValueError as e:
+            error(f"{str(e)}\n{usage}")
+
+    def complete_xcycle_event(self, text, line, begidx, endidx):
+        return [x for x in ["list", "break", "cancel", "clear"] if x.startswith(text)]
+
+    def do_xstep_stats(self, arg):
+        """Show the step batch size and the statistics of stepping
+
+        Args:
+            reset (string): Reset the statistics
+            latency <ms> (string): Set the Ctrl+C latency target of the adaptive batch
+            batch <cycles|auto> (string): Use a fixed batch size, or adapt it (auto)
+        """
+        args = arg.strip().split()
+        usage = "usage: xstep_stats [reset|latency <ms>|batch <cycles|auto>]"
+        try:
+            if not args:
+                st = self.step_stats
+                mode = "fixed" if self.step_batch_fixed > 0 else f"adaptive, latency target {self.step_latency_target*1000:.1f} ms"
+                message(f"batch: {self.step_batch_fixed or self.step_batch_cycle} cycles ({mode})")
+                message(f"batches: {st['batches']}, cycles: {st['cycles']}")
+                if st["batches"] > 0:
+                    total = st["step_time"] + st["check_time"]
+                    speed = st["cycles"]/st["step_time"] if st["step_time"] > 0 else 0
+                    message(f"step time: {st['step_time']:.3f} s ({speed:.0f} cycles/s), check time: {st['check_time']:.3f} s " +
+                            f"({100.0*st['check_time']/total if total > 0 else 0:.2f}% overhead, {st['check_time']/st['batches']*1e6:.1f} us/batch)")
+                    message(f"max batch time: {st['max_batch_time']*1000:.1f} ms")
+            elif args[0] == "reset":
+                self.api_step_stats_reset()
+            elif args[0] == "latency" and len(args) > 1:
+                latency = float(args[1])
+                if latency <= 0:
+                    error("latency need > 0")
+                    return
+                self.step_latency_target = latency/1000
+            elif args[0] == "batch" and len(args) > 1:
+                self.step_batch_fixed = 0 if args[1] == "auto" else int(args[1], 0)
+            else:
+                message(usage)
+        except ValueError as e:
+            error(f"{str(e)}\n{usage}")
+
+    def complete_xstep_stats(self, text, line, begidx, endidx):
+        return [x for x in ["reset", "latency", "batch"] if x.startswith(text)]
+
     def do_xprint(self, arg):
         """Print the value and width of an internal signal
 
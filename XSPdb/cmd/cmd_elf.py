@@ -1,80 +1,377 @@
 #coding=utf-8
 
 import os
+import re
+import hashlib
+from collections import Counter
 
-from XSPdb.cmd.util import info, error, message, warn, find_executable_in_dirs
-import subprocess
-import os
-import bisect
+from XSPdb.cmd.util import info, error, message, warn, get_cache_dir
+from XSPdb.cmd.xelf import ElfSymbolTable, STT_NAMES, SYMTAB_VERSION, read_elf_symbols, is_elf_file
+from XSPdb.cmd.xdwarf import read_line_table, LineTable, LINE_TABLE_VERSION
+from XSPdb.cmd.xcfi import read_cfi_table
+from XSPdb.cmd.xdinfo import read_debug_info
 
 class CmdEfl:
     """ELF command class for disassembling data"""
 
     def __init__(self):
-        self.elf_symbol_dict = None
+        self.elf_symbols = None
+        self.elf_symbols_gen = 0
+        self.elf_symbol_range = None
+        self.elf_symbol_names = {}
         self.elf_current_exe_bin_is_efl = None
+        self.elf_line_table = None
+        self.elf_line_table_file = None
+        self.elf_cfi_table = None
+        self.elf_cfi_table_file = None
+        self.elf_debug_info = None
+        self.elf_debug_info_file = None
+        self.elf_var_layouts = {}
+        self.elf_var_watch_list = []
         self.flag_trace_pc_symbol_block_change = False
 
-    def api_get_elf_symbol_dict(self, elf_file, search_dirs=["./ready-to-run"]):
-        """Get the symbol dictionary from an ELF file
+    def api_elf_reset(self):
+        """Drop the symbols and line table of the old image (called when a new image is loaded)"""
+        self.elf_symbols = None
+        self.elf_symbols_gen += 1
+        self.elf_symbol_range = None
+        self.elf_symbol_names = {}
+        self.elf_current_exe_bin_is_efl = None
+        self.elf_line_table = None
+        self.elf_line_table_file = None
+        self.elf_cfi_table = None
+        self.elf_cfi_table_file = None
+        self.elf_debug_info = None
+        self.elf_debug_info_file = None
+        self.elf_var_layouts = {}
+
+    def api_get_elf_symbols(self, elf_file, use_cache=True):
+        """Read the symbol table of an ELF file (cached on disk, keyed by table version, path, mtime and size)
+
+        Args:
+            elf_file (string): Path to the ELF file
+            use_cache (bool): Load/save the table from/to the cache dir
+        Returns:
+            ElfSymbolTable: Symbols sorted by address, None if fail
+        """
+        if not os.path.exists(elf_file):
+            error(f"{elf_file} not found")
+            return None
+        st = os.stat(elf_file)
+        key = "%d:%s:%d:%d" % (SYMTAB_VERSION, os.path.abspath(elf_file), st.st_mtime_ns, st.st_size)
+        cache_dir = get_cache_dir("elf_symbols") if use_cache else None
+        cache_file = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".sym") if cache_dir else None
+        if cache_file and os.path.isfile(cache_file):
+            try:
+                with open(cache_file, "rb") as f:
+                    return ElfSymbolTable.load(f)
+            except Exception as e:
+                warn(f"ignore broken symbol cache {cache_file}: {str(e)}")
+        symbol_gnored = {}
+        def keep(st_info, st_shndx):
+            # Same filter as the readelf based parser: NOTYPE/FILE symbols only in section 1 and 2
+            sym_type = STT_NAMES.get(st_info & 0xf)
+            if sym_type in ("NOTYPE", "FILE") and st_shndx not in (1, 2):
+                symbol_gnored[sym_type] = symbol_gnored.get(sym_type, 0) + 1
+                return False
+            return True
+        try:
+            table = read_elf_symbols(elf_file, keep)
+        except Exception as e:
+            error(f"Failed to read ELF file: {str(e)}")
+            return None
+        info("Find symbol: %s" % dict(Counter(table.type(i) for i in range(len(table)))))
+        if len(symbol_gnored) > 0:
+            warn("Ignored symbol: %s" % symbol_gnored)
+        if cache_file:
+            try:
+                with open(cache_file + ".tmp", "wb") as f:
+                    table.dump(f)
+                os.replace(cache_file + ".tmp", cache_file)
+            except OSError as e:
+                warn(f"save symbol cache to {cache_file} fail: {str(e)}")
+        return table
+
+    def api_get_elf_line_table(self, elf_file, use_cache=True):
+        """Decode the DWARF line table of an ELF file (cached on disk, keyed by decoder version, path, mtime and size)
 
         Args:
             elf_file (string): Path to the ELF file
-            search_dirs (list): List of directories to search for CMD readelf
+            use_cache (bool): Map/save the table from/to the cache dir
+        Returns:
+            LineTable: PC -> file:line rows sorted by address, None if fail
         """
         if not os.path.exists(elf_file):
             error(f"{elf_file} not found")
             return None
-        readelf = find_executable_in_dirs("readelf", search_dirs=search_dirs)
-        cmd = [readelf, "-sW", elf_file]
+        st = os.stat(elf_file)
+        key = "%d:%s:%d:%d" % (LINE_TABLE_VERSION, os.path.abspath(elf_file), st.st_mtime_ns, st.st_size)
+        cache_dir = get_cache_dir("elf_lines") if use_cache else None
+        cache_file = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".line") if cache_dir else None
+        if cache_file and os.path.isfile(cache_file):
+            try:
+                return LineTable.load(cache_file)
+            except Exception as e:
+                warn(f"ignore broken line table cache {cache_file}: {str(e)}")
         try:
-            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            lines = output.decode().splitlines()
-            symbol_value_dict = {}
-            symbol_name_dict = {}
-            symbol_type_dict = {}
-            symbol_gnored = {}
-            for line in lines[1:]:
-                parts = line.split()
-                if len(parts) != 8:
-                    continue
-                if parts[1].lower() == "value":
-                    continue
-                value = {"addr": int(parts[1], 16), 
-                         "size": int(parts[2], 16),
-                         "type": parts[3],
-                         "bind": parts[4],
-                         "vis": parts[5],
-                         "ndx": parts[6],
-                         "name": parts[7],
-                         }
-                if value["type"] in ("NOTYPE", "FILE"):
-                    if value["ndx"] not in ("1", "2", ".text", ".data"):
-                        if value["type"] not in symbol_gnored:
-                            symbol_gnored[value["type"]] = 1
-                        else:
-                            symbol_gnored[value["type"]] += 1
-                        continue
-                symbol_name_dict[value["name"]] = value
-                if value["type"] not in symbol_type_dict:
-                    symbol_type_dict[value["type"]] = 1
-                else:
-                    symbol_type_dict[value["type"]] += 1
-                if symbol_value_dict.get(value["addr"]) is None:
-                    symbol_value_dict[value["addr"]] = [value]
-                else:
-                    symbol_value_dict[value["addr"]].append(value)
-            info("Find symbol: %s" % symbol_type_dict)
-            if len(symbol_gnored) > 0:
-                warn("Ignored symbol: %s" % symbol_gnored)
-            return {"addr": symbol_value_dict,
-                    "name": symbol_name_dict,
-                    "sorted_addr": sorted(symbol_value_dict.keys()),
-                    "sorted_name": sorted(symbol_name_dict.keys()),
-                    }
-        except subprocess.CalledProcessError as e:
-            error(f"Failed to read ELF file: {e.output.decode()}")
+            table = read_line_table(elf_file)
+        except Exception as e:
+            error(f"Failed to decode .debug_line of {elf_file}: {str(e)}")
+            return None
+        info(f"Decoded {len(table)} line rows of {len(table.files)} source files from {elf_file}")
+        if cache_file:
+            try:
+                with open(cache_file + ".tmp", "wb") as f:
+                    table.dump(f)
+                os.replace(cache_file + ".tmp", cache_file)
+            except OSError as e:
+                warn(f"save line table cache to {cache_file} fail: {str(e)}")
+        return table
+
+    def api_update_local_elf_line_table(self):
+        """Load the line table of the loaded image, once per image (nothing is reported for non ELF images)"""
+        self.elf_line_table_file = self.exec_bin_file
+        self.elf_line_table = None
+        if self.exec_bin_file and is_elf_file(self.exec_bin_file):
+            self.elf_line_table = self.api_get_elf_line_table(self.exec_bin_file)
+        return self.elf_line_table is not None
+
+    def api_address_to_line(self, addr, exact=False):
+        """Convert address to source location
+
+        Args:
+            addr (int): Address to convert
+            exact (bool): Only return the location if a line starts at addr
+        Returns:
+            string: "file:line", None if unknown
+        """
+        if self.elf_line_table_file != self.exec_bin_file:
+            self.api_update_local_elf_line_table()
+        if not self.elf_line_table:
+            return None
+        row = self.elf_line_table.lookup(addr)
+        if row < 0 or (exact and self.elf_line_table.addr[row] != addr):
+            return None
+        return "%s:%d" % self.elf_line_table.location(row)
+
+    def api_addresses_to_lines(self, addresses):
+        """Find the line table rows of many addresses at once (e.g. to annotate a trace)
+
+        Args:
+            addresses (list/ndarray): Addresses
+        Returns:
+            ndarray/list: Row of each address (-1 if unknown), see api_line_location
+        """
+        if self.elf_line_table_file != self.exec_bin_file:
+            self.api_update_local_elf_line_table()
+        if not self.elf_line_table:
+            return [-1]*len(addresses)
+        return self.elf_line_table.lookup_many(addresses)
+
+    def api_line_location(self, row):
+        """Get (file, line) of a line table row"""
+        return self.elf_line_table.location(row)
+
+    def api_get_elf_cfi_table(self):
+        """Get the unwind rule table compiled from .eh_frame/.debug_frame of the loaded image (once per image)
+
+        Returns:
+            CFITable: Unwind rules, None if the image is not an ELF file or has no CFI
+        """
+        if self.elf_cfi_table_file == self.exec_bin_file:
+            return self.elf_cfi_table
+        self.elf_cfi_table_file = self.exec_bin_file
+        self.elf_cfi_table = None
+        if self.exec_bin_file and is_elf_file(self.exec_bin_file):
+            try:
+                table = read_cfi_table(self.exec_bin_file)
+                info(f"Compiled {len(table)} unwind rows ({len(table.rules)} rules) from {self.exec_bin_file}")
+                self.elf_cfi_table = table if len(table) > 0 else None
+            except Exception as e:
+                error(f"Failed to read the call frame information of {self.exec_bin_file}: {str(e)}")
+        return self.elf_cfi_table
+
+    def api_get_elf_debug_info(self):
+        """Get the variables and types from .debug_info of the loaded image (scanned once per image)
+
+        Returns:
+            DebugInfo: Variables and types, None if the image is not an ELF file or has no variables
+        """
+        if self.elf_debug_info_file == self.exec_bin_file:
+            return self.elf_debug_info
+        self.elf_debug_info_file = self.exec_bin_file
+        self.elf_debug_info = None
+        self.elf_var_layouts = {}
+        if self.exec_bin_file and is_elf_file(self.exec_bin_file):
+            try:
+                debug_info = read_debug_info(self.exec_bin_file)
+                info(f"Found {len(debug_info)} variables in {self.exec_bin_file}")
+                self.elf_debug_info = debug_info if len(debug_info) > 0 else None
+            except Exception as e:
+                error(f"Failed to read the debug info of {self.exec_bin_file}: {str(e)}")
+        return self.elf_debug_info
+
+    def api_var_layout(self, name):
+        """Get the physical address and the compiled type layout of a variable (resolved once)
+
+        Args:
+            name (string): Variable name
+        Returns:
+            (address, VarLayout): None if the variable is not found
+        """
+        debug_info = self.api_get_elf_debug_info()
+        if debug_info is None:
+            return None
+        var = self.elf_var_layouts.get(name)
+        if var is None:
+            found = debug_info.variable(name)
+            if found is None:
+                return None
+            addr, type_offset = found
+            var = (debug_info.elf.vaddr_to_paddr(addr), debug_info.layout(type_offset))
+            self.elf_var_layouts[name] = var
+        return var
+
+    def api_var_type(self, name):
+        """Get the type and the physical address of a variable, or of a part of it
+
+        Args:
+            name (string): Variable name, members and elements can follow, eg: cfg.ports[1].mode
+        Returns:
+            (type name, address): None if the variable is not found
+        """
+        base = re.match(r"\s*(\w+)", name)
+        var = self.api_var_layout(base.group(1)) if base else None
+        if var is None:
+            return None
+        type_offset = self.elf_debug_info.variable(base.group(1))[1]
+        type_name, offset = self.elf_debug_info.part_type(type_offset, name[base.end():])
+        return type_name, var[0] + offset
+
+    def api_read_var(self, name, node=False, quiet=False):
+        """Read a global/static variable from memory, decoded by its DWARF type
+
+        Args:
+            name (string): Variable name, members and elements can follow, eg: cfg.ports[1].mode
+            node (bool): Also return the layout and the layout node of the value (for formatting)
+            quiet (bool): Do not report a variable not found
+        Returns:
+            value: Structs are dicts, arrays are lists, char arrays are bytes, enums are names if known
+        """
+        base = re.match(r"\s*(\w+)", name)
+        var = self.api_var_layout(base.group(1)) if base else None
+        if var is None:
+            if not quiet:
+                error(f"variable {name} not found")
+            return None
+        addr, layout = var
+        data = self.api_read_bytes_from(addr, layout.read_size) if layout.read_size > 0 else b""
+        if data is None:
             return None
+        value = layout.decode(data)
+        layout_node, value = layout.select(value, name[base.end():])
+        if node:
+            return value, layout, layout_node
+        return value
+
+    def api_format_var(self, name, quiet=False):
+        """Read a variable and format it like a C initializer
+
+        Args:
+            name (string): Variable name, members and elements can follow
+            quiet (bool): Do not report a variable or member not found (e.g. for redraws)
+        Returns:
+            string: Formatted value, None if fail
+        """
+        try:
+            ret = self.api_read_var(name, node=True, quiet=quiet)
+        except (KeyError, IndexError) as e:
+            if not quiet:
+                error(f"{name}: {e.args[0]}")
+            return None
+        if ret is None:
+            return None
+        value, layout, layout_node = ret
+        return layout.format(value, layout_node)
+
+    def do_xprint_var(self, arg):
+        """Print a global/static variable decoded by its DWARF type
+
+        Args:
+            name (string): Variable name, members and elements can follow, eg: cfg.ports[1].mode
+        """
+        name = arg.strip()
+        if not name:
+            message("usage: xprint_var <name>")
+            return
+        text = self.api_format_var(name)
+        if text is None:
+            return
+        type_name, addr = self.api_var_type(name)
+        message(f"{name} ({type_name} @ 0x{addr:x}) = {text}")
+
+    def complete_xprint_var(self, text, line, begidx, endidx):
+        debug_info = self.api_get_elf_debug_info()
+        if debug_info is None:
+            return []
+        return [x for x in debug_info.variables if x.startswith(text)]
+
+    def do_xwatch_var(self, arg):
+        """Watch global/static variables in the TUI (refreshed on every update)
+
+        Args:
+            name (string): Variable name, members and elements can follow (list the watched variables if empty)
+        """
+        name = arg.strip()
+        if not name:
+            message("watched variables: " + ", ".join(self.elf_var_watch_list))
+            message("usage: xwatch_var <name>")
+            return
+        if self.api_format_var(name) is None:
+            return
+        if name not in self.elf_var_watch_list:
+            self.elf_var_watch_list.append(name)
+        info(f"watch variable {name}")
+
+    def complete_xwatch_var(self, text, line, begidx, endidx):
+        return self.complete_xprint_var(text, line, begidx, endidx)
+
+    def do_xunwatch_var(self, arg):
+        """Stop watching a variable
+
+        Args:
+            name (string): Watched variable name
+        """
+        name = arg.strip()
+        if name not in self.elf_var_watch_list:
+            error(f"variable {name} is not watched")
+            return
+        self.elf_var_watch_list.remove(name)
+
+    def complete_xunwatch_var(self, text, line, begidx, endidx):
+        return [x for x in self.elf_var_watch_list if x.startswith(text)]
+
+    def api_get_elf_symbol_dict(self, elf_file, search_dirs=["./ready-to-run"]):
+        """Get the symbol dictionary from an ELF file
+
+        Args:
+            elf_file (string): Path to the ELF file
+            search_dirs (list): Not used (symbols are read without readelf), kept for compatibility
+        """
+        table = self.api_get_elf_symbols(elf_file)
+        if table is None:
+            return None
+        symbol_value_dict = {}
+        symbol_name_dict = {}
+        for i in range(len(table)):
+            value = table.entry(i)
+            symbol_name_dict[value["name"]] = value
+            symbol_value_dict.setdefault(value["addr"], []).append(value)
+        return {"addr": symbol_value_dict,
+                "name": symbol_name_dict,
+                "sorted_addr": sorted(symbol_value_dict.keys()),
+                "sorted_name": sorted(symbol_name_dict.keys()),
+                }
 
     def api_is_efl_file(self, file_path):
         """Check if the file is an ELF file
@@ -106,9 +403,13 @@ class CmdEfl:
         if not self.elf_current_exe_bin_is_efl:
             error(f"{self.exec_bin_file} is not an ELF file")
             return False
-        self.elf_symbol_dict = self.api_get_elf_symbol_dict(self.exec_bin_file)
-        count = len(self.elf_symbol_dict.get("addr", {}))
-        info(f"Loaded {count} symbols from {self.exec_bin_file}")
+        self.elf_symbols = self.api_get_elf_symbols(self.exec_bin_file)
+        self.elf_symbols_gen += 1
+        self.elf_symbol_range = None
+        self.elf_symbol_names = {}
+        if self.elf_symbols is None:
+            return False
+        info(f"Loaded {len(self.elf_symbols.uaddr)} symbols from {self.exec_bin_file}")
         return True
 
     def api_echo_pc_symbol_block_change(self, current_pc, last_block_addr, last_pc):
@@ -119,25 +420,22 @@ class CmdEfl:
             return block_addr
         if self.elf_current_exe_bin_is_efl is False:
             return block_addr
-        if self.elf_symbol_dict is None:
+        if self.elf_symbols is None and self.elf_current_exe_bin_is_efl is None:
+            # a new image was loaded
+            self.api_update_local_elf_symbol_dict()
+        if self.elf_symbols is None:
             return block_addr
-        symbol_index = bisect.bisect_left(self.elf_symbol_dict["sorted_addr"], current_pc) - 1
+        symbol_index = self.api_symbol_interval(current_pc)
         if symbol_index < 0:
             return block_addr
-        if symbol_index >= len(self.elf_symbol_dict["sorted_addr"]):
-            return block_addr
-        symbol_addr = self.elf_symbol_dict["sorted_addr"][symbol_index]
+        symbol_name, symbol_addr, _ = self.api_symbol_interval_info(symbol_index)
         if symbol_addr == last_block_addr:
             return block_addr
         # block address changed
-        symbol = self.elf_symbol_dict.get("addr", {}).get(symbol_addr)
-        if not symbol:
-            return block_addr
-        symbol_name = ','.join([s['name'] for s in symbol])
-        symbol_pre = self.elf_symbol_dict.get("addr", {}).get(last_block_addr)
         symbol_pre_name = "None"
-        if symbol_pre:
-            symbol_pre_name = ','.join([s['name'] for s in symbol_pre])
+        symbol_pre = self.elf_symbols.lookup(last_block_addr)
+        if symbol_pre >= 0:
+            symbol_pre_name = self.api_symbol_interval_info(symbol_pre)[0]
         delta_last = last_pc-last_block_addr
         delta_curr = current_pc-symbol_addr
         message(f"PC block changed({hex(last_pc)} = > {hex(current_pc)}, " +
@@ -188,20 +486,100 @@ class CmdEfl:
         """
         if self.elf_current_exe_bin_is_efl is False:
             return None
-        if self.elf_symbol_dict is None:
+        if self.elf_symbols is None:
             self.api_update_local_elf_symbol_dict()
-        if self.elf_symbol_dict is None:
+        if self.elf_symbols is None:
             return None
-        symbol_index = bisect.bisect_left(self.elf_symbol_dict["sorted_addr"], addr) - 1
+        symbol_index = self.api_symbol_interval(addr)
         if symbol_index < 0:
             return None
-        if symbol_index >= len(self.elf_symbol_dict["sorted_addr"]):
+        symbol_name, symbol_addr, _ = self.api_symbol_interval_info(symbol_index)
+        return f"({symbol_name}: {hex(symbol_addr)}) + {hex(addr - symbol_addr)}"
+
+    def api_elf_symbols_loaded(self):
+        """Load the symbols of the loaded image if not yet, nothing is reported for non ELF images
+
+        Returns:
+            bool: True if the symbols are available
+        """
+        if self.elf_symbols is None and self.elf_current_exe_bin_is_efl is None:
+            if self.exec_bin_file and is_elf_file(self.exec_bin_file):
+                self.api_update_local_elf_symbol_dict()
+            else:
+                self.elf_current_exe_bin_is_efl = False
+        return self.elf_symbols is not None
+
+    def api_symbol_label(self, addr):
+        """Get the label of an address: <name> at the start of a symbol, <name+0x1c> inside it
+
+        Args:
+            addr (int): Address
+        Returns:
+            string: Label, None if the address is not in any symbol
+        """
+        if not self.api_elf_symbols_loaded():
+            return None
+        index = self.api_symbol_interval(addr)
+        if index < 0:
             return None
-        symbol_addr = self.elf_symbol_dict["sorted_addr"][symbol_index]
-        symbol = self.elf_symbol_dict.get("addr", {}).get(symbol_addr)
-        if symbol:
-            return f"({','.join([s['name'] for s in symbol])}: {hex(symbol_addr)}) + {hex(addr - symbol_addr)}"
-        return None
+        names, start, _ = self.api_symbol_interval_info(index)
+        name = names.split(",")[0]
+        return f"<{name}>" if addr == start else f"<{name}+0x{addr - start:x}>"
+
+    def api_symbol_interval(self, addr):
+        """Find the symbol interval containing an address
+
+        The interval of a symbol is [addr, addr + size), zero sized symbols (labels) reach the
+        next symbol. The last hit interval is remembered, so the lookups of PCs in the same
+        function do not search again.
+
+        Args:
+            addr (int): Address
+        Returns:
+            int: Interval index, -1 if the address is not in any symbol
+        """
+        last = self.elf_symbol_range
+        if last is not None and last[0] <= addr < last[1]:
+            return last[2]
+        if self.elf_current_exe_bin_is_efl is False:
+            return -1
+        if self.elf_symbols is None:
+            self.api_update_local_elf_symbol_dict()
+        if self.elf_symbols is None:
+            return -1
+        index = self.elf_symbols.lookup(addr)
+        if index >= 0:
+            start, end = self.elf_symbols.interval(index)
+            self.elf_symbol_range = (start, end, index)
+        return index
+
+    def api_symbol_interval_info(self, index):
+        """Get the symbol names (joined by ',') and the range of a symbol interval
+
+        Args:
+            index (int): Interval index
+        Returns:
+            (names, start, end)
+        """
+        name = self.elf_symbol_names.get(index)
+        if name is None:
+            name = ','.join(self.elf_symbols.interval_names(index))
+            self.elf_symbol_names[index] = name
+        return (name,) + self.elf_symbols.interval(index)
+
+    def api_addresses_to_symbols(self, addresses):
+        """Find the symbol intervals of many addresses at once (e.g. to annotate a trace)
+
+        Args:
+            addresses (list/ndarray): Addresses
+        Returns:
+            ndarray/list: Interval index of each address (-1 if not in any symbol), see api_symbol_interval_info
+        """
+        if self.elf_symbols is None and self.elf_current_exe_bin_is_efl is not False:
+            self.api_update_local_elf_symbol_dict()
+        if self.elf_symbols is None:
+            return [-1]*len(addresses)
+        return self.elf_symbols.lookup_many(addresses)
 
     def api_symbol_to_address(self, symbol):
         """Convert symbol name to address
@@ -211,11 +589,11 @@ class CmdEfl:
         """
         if self.elf_current_exe_bin_is_efl is False:
             return None
-        if self.elf_symbol_dict is None:
+        if self.elf_symbols is None:
             self.api_update_local_elf_symbol_dict()
-        if self.elf_symbol_dict is None:
+        if self.elf_symbols is None:
             return None
-        addr = self.elf_symbol_dict.get("name", {}).get(symbol)
-        if addr:
-            return addr["addr"]
+        index = self.elf_symbols.find(symbol)
+        if index >= 0:
+            return self.elf_symbols.addr[index]
         return None
@@ -3,23 +3,226 @@
 import os
 
 from XSPdb.cmd.util import info, error, message, warn
-import os
+from XSPdb.cmd.ximage import nonzero_runs, SparseImageWriter, XSPZImageWriter, is_xspz_file, unpack_xspz_file
+from XSPdb.cmd.xelf import ElfFile, is_elf_file, PT_LOAD
 
 class CmdFiles:
-    
-    def api_dut_bin_load(self, bin_file):
+
+    def __init__(self):
+        self.files_export_chunk = 4*1024*1024
+
+    def api_dut_bin_load_delta(self, bin_file):
+        """Reload a bin file into memory, only the pages differing from the current memory are written
+
+        The result is the same as a full load: memory after the end of the file is zeroed.
+
+        Args:
+            bin_file (string): Path to the bin file
+        Returns:
+            int: Number of changed bytes, None if delta load is not supported
+        """
+        file_size = os.path.getsize(bin_file)
+        if not self.mem_inited or file_size > self.mem_size:
+            return None
+        view = self.api_pmem_view(self.mem_base, self.mem_size)
+        if view is None:
+            return None
+        self.api_mem_write_flush()
+        page_size = self.api_mem_page_size()
+        changed = []
+        def _changed(sta, end):
+            if changed and changed[-1][1] == sta:
+                changed[-1][1] = end
+            else:
+                changed.append([sta, end])
+        offset = 0
+        with open(bin_file, "rb") as f:
+            while offset < file_size:
+                data = f.read(self.files_export_chunk)
+                if not data:
+                    break
+                for i in range(0, len(data), page_size):
+                    new_page = data[i:i+page_size]
+                    sta = offset + i
+                    if view[sta:sta+len(new_page)].tobytes() != new_page:
+                        view[sta:sta+len(new_page)] = new_page
+                        _changed(sta, sta + len(new_page))
+                offset += len(data)
+        # Clear the data left after the end of the file (old image, bss, stack ...)
+        for index in range(offset, self.mem_size, self.files_export_chunk):
+            chunk = view[index:min(self.mem_size, index + self.files_export_chunk)]
+            for sta, end in nonzero_runs(chunk, page_size):
+                view[index+sta:index+end] = bytes(end - sta)
+                _changed(index + sta, index + end)
+        changed_size = 0
+        for sta, end in changed:
+            self.api_mem_mark_dirty(self.mem_base + sta, self.mem_base + end)
+            self.api_info_cache_invalidate(self.mem_base + sta, self.mem_base + end)
+            changed_size += end - sta
+        self.exec_bin_file = bin_file
+        info(f"delta load {bin_file}: {changed_size} bytes in {len(changed)} ranges changed")
+        return changed_size
+
+    def api_dut_bin_load(self, bin_file, delta=False):
         """Load a bin file into memory
 
         Args:
             bin_file (string): Path to the bin file
+            delta (bool): Only write the pages differing from the current memory
         """
         assert os.path.exists(bin_file), "file %s not found" % bin_file
+        if delta:
+            if self.api_dut_bin_load_delta(bin_file) is not None:
+                self.api_elf_reset()
+                self.api_dasm_index_on_load(bin_file)
+                return
+            warn("delta load is not supported (memory not inited or no bulk memory access), use full load")
+        # queued writes were issued before the load, apply them first so the load wins
+        self.api_mem_write_flush()
         self.exec_bin_file = bin_file
         if self.mem_inited:
             self.df.overwrite_ram(bin_file, self.mem_size)
         else:
             self.api_init_mem()
-        self.info_cache_asm.clear()
+        self.api_info_cache_invalidate(self.mem_base, self.mem_base + self.mem_size)
+        self.api_elf_reset()
+        self.api_dasm_index_on_load(bin_file)
+
+    def api_dut_elf_segments(self, elf):
+        """Get the PT_LOAD segments of an ELF file to load, checked against the memory and Flash ranges
+
+        Args:
+            elf (ElfFile): Parsed ELF file
+        Returns:
+            list(ElfSegment): Segments to load, sorted by physical address, None if a segment is out of range
+        """
+        segments = sorted((seg for seg in elf.segments if seg.type == PT_LOAD and seg.memsz > 0),
+                          key=lambda seg: seg.paddr)
+        for seg in segments:
+            end = seg.paddr + seg.memsz
+            if self.api_is_flash_address(seg.paddr):
+                if end - self.flash_base > 0x7FFFFFFF:
+                    error(f"segment 0x{seg.paddr:x} - 0x{end:x} is out of the Flash range")
+                    return None
+            elif seg.paddr < self.mem_base or end > self.mem_base + self.mem_size:
+                error(f"segment 0x{seg.paddr:x} - 0x{end:x} is out of the memory range "
+                      f"0x{self.mem_base:x} - 0x{self.mem_base + self.mem_size:x}")
+                return None
+        return segments
+
+    def api_dut_elf_load(self, elf_file):
+        """Load the PT_LOAD segments of an ELF file into memory/Flash, and start at its entry
+
+        Only the segments are written (the file data in chunks, then zeros up to the memory size
+        of the segment for .bss), the rest of the memory is left as is.
+
+        Args:
+            elf_file (string): Path to the ELF file
+        Returns:
+            int: Number of written bytes, None if fail
+        """
+        assert os.path.exists(elf_file), "file %s not found" % elf_file
+        if not is_elf_file(elf_file):
+            error(f"{elf_file} is not an ELF file")
+            return None
+        elf = ElfFile(elf_file)
+        segments = self.api_dut_elf_segments(elf)
+        if segments is None:
+            return None
+        if not self.mem_inited:
+            # start from zeroed memory, the ELF file itself is not a raw image
+            self.exec_bin_file = ""
+            self.api_init_mem()
+        self.exec_bin_file = elf_file
+        self.api_mem_write_flush()
+        chunk = self.files_export_chunk
+        zeros = bytes(min(chunk, max([seg.memsz - seg.filesz for seg in segments] + [0])))
+        size = 0
+        with open(elf_file, "rb") as f:
+            for seg in segments:
+                filesz = min(seg.filesz, seg.memsz)
+                f.seek(seg.offset)
+                for index in range(0, filesz, chunk):
+                    data = f.read(min(chunk, filesz - index))
+                    if not data or not self.api_write_bytes_direct(seg.paddr + index, data):
+                        error(f"write segment 0x{seg.paddr:x} of {elf_file} fail")
+                        return None
+                for index in range(filesz, seg.memsz, chunk):
+                    if not self.api_write_bytes_direct(seg.paddr + index, zeros[:min(chunk, seg.memsz - index)]):
+                        error(f"zero-fill segment 0x{seg.paddr:x} of {elf_file} fail")
+                        return None
+                info(f"load segment 0x{seg.paddr:x} - 0x{seg.paddr + seg.memsz:x} (file 0x{filesz:x} bytes)")
+                size += seg.memsz
+        self.api_update_pmem_base_and_first_inst_addr(None, elf.vaddr_to_paddr(elf.entry))
+        self.api_elf_reset()
+        self.api_dasm_index_on_load(elf_file)
+        info(f"load {elf_file}: {size} bytes in {len(segments)} segments, entry 0x{elf.entry:x}")
+        return size
+
+    def api_read_flash_until_mret(self, max_dwords=1024*10):
+        """Read Flash data until the dword after the first mret (the end of xspdb flash init code)
+
+        Args:
+            max_dwords (int): Max dwords to read
+        Returns:
+            bytearray: Flash data (max_dwords*8 bytes if mret not found)
+        """
+        mret = (0x30200073).to_bytes(4, byteorder='little', signed=False)
+        chunk_dwords = 512
+        bin_data = bytearray()
+        mret_pos = -1
+        while len(bin_data) < max_dwords*8:
+            search_from = len(bin_data)
+            bin_data += self.api_read_bytes_with_func(len(bin_data), min(chunk_dwords, max_dwords - len(bin_data)//8)*8,
+                                                      self.df.FlashRead)
+            while mret_pos < 0:
+                pos = bin_data.find(mret, search_from)
+                if pos < 0:
+                    break
+                if pos % 4 == 0:
+                    mret_pos = pos
+                search_from = pos + 1
+            # keep the dword after the one containing mret
+            if mret_pos >= 0 and (mret_pos//8 + 2)*8 <= len(bin_data):
+                return bin_data[:(mret_pos//8 + 2)*8]
+        return bin_data
+
+    def api_export_mem_to(self, writer, address, size, file_offset=0):
+        """Stream memory data into an image writer, all-zero pages are skipped as holes
+
+        Args:
+            writer (SparseImageWriter/XSPZImageWriter): Image writer
+            address (int): Start address of memory
+            size (int): Size of data to export
+            file_offset (int): Offset in the image of the start address
+        Returns:
+            bool: True if success
+        """
+        self.api_mem_write_flush()
+        page_size = self.api_mem_page_size()
+        for index in range(0, size, self.files_export_chunk):
+            chunk_size = min(self.files_export_chunk, size - index)
+            data = None
+            if not self.api_is_flash_address(address + index):
+                data = self.api_pmem_view(address + index, chunk_size)
+            if data is None:
+                data = self.api_read_bytes_from(address + index, chunk_size)
+                if data is None:
+                    return False
+            for sta, end in nonzero_runs(data, page_size):
+                writer.write(file_offset + index + sta, data[sta:end])
+        return True
+
+    def api_open_image_writer(self, bin_file, compress=False):
+        """Open an image writer
+
+        Args:
+            bin_file (string): Path to the export file
+            compress (bool): Write an indexed compressed container (.xspz) instead of a sparse raw file
+        """
+        if compress:
+            return XSPZImageWriter(bin_file)
+        return SparseImageWriter(bin_file)
 
     def api_export_flash(self, bin_file, force_size=-1):
         """Export Flash data
@@ -27,47 +230,47 @@ class CmdFiles:
         Args:
             bin_file (string): Path to the export file
         """
+        self.api_mem_write_flush()
         if force_size < 0:
             if not self.api_check_if_xspdb_init_bin_loaded():
                 return
-        # search mret
-        mret = 0x30200073
-        last_data = 0
-        bin_data = bytearray()
-        bin_size = force_size if force_size > 0 else 1024*10
-        for i in range(bin_size):
-            data = self.df.FlashRead(i*8)
-            bin_data += data.to_bytes(8, byteorder='little', signed=False)
-            if (last_data >> 32 == mret or last_data & 0xffffffff == mret) and force_size < 0:
-                break
-            last_data = data
+            bin_data = self.api_read_flash_until_mret()
+        else:
+            bin_size = force_size if force_size > 0 else 1024*10
+            bin_data = self.api_read_bytes_with_func(0, bin_size*8, self.df.FlashRead)
         with open(bin_file, "wb") as f:
             f.write(bin_data)
         info(f"export {len(bin_data)} bytes to flash file: {bin_file}")
 
-    def api_export_ram(self, end_address, bin_file):
+    def api_export_ram(self, end_address, bin_file, compress=False):
         """Export memory data
 
         Args:
             end_address (int): End address of memory
             bin_file (string): Path to the export file
+            compress (bool): Write an indexed compressed container (.xspz) instead of a sparse raw file
         """
         if not self.mem_inited:
             error("mem not loaded")
             return
         end_index = 8 + end_address - end_address % 8
-        with open(bin_file, "wb") as f:
-            for index in range(self.mem_base, end_index, 8):
-                f.write(self.df.pmem_read(index).to_bytes(8, byteorder='little', signed=False))
-        info(f"export {end_index - self.mem_base} bytes to ram file: {bin_file}")
+        image_size = end_index - self.mem_base
+        writer = self.api_open_image_writer(bin_file, compress)
+        try:
+            if not self.api_export_mem_to(writer, self.mem_base, image_size):
+                error(f"read memory fail, export {bin_file} is incomplete")
+        finally:
+            writer.close(image_size)
+        info(f"export {image_size} bytes ({writer.data_size} bytes non-zero) to ram file: {bin_file}")
 
-    def api_export_unified_bin(self, ram_start, ram_end, bin_file):
+    def api_export_unified_bin(self, ram_start, ram_end, bin_file, compress=False):
         """Export a unified bin file
 
         Args:
             ram_start (int): Start address of memory
             ram_end (int): End address of memory
             bin_file (string): Path to the export file
+            compress (bool): Write an indexed compressed container (.xspz) instead of a sparse raw file
         """
         if not self.mem_inited:
             error("mem not loaded")
@@ -75,17 +278,8 @@ class CmdFiles:
         if not self.api_check_if_xspdb_init_bin_loaded():
             return False
         # read flash data
-        mret = 0x30200073
-        last_data = 0
-        last_indx = 0
-        bin_data = bytearray()
-        for i in range(1024*10):
-            data = self.df.FlashRead(i*8)
-            bin_data += data.to_bytes(8, byteorder='little', signed=False)
-            last_indx = i + 1
-            if last_data >> 32 == mret or last_data & 0xffffffff == mret:
-                break
-            last_data = data
+        bin_data = self.api_read_flash_until_mret()
+        last_indx = len(bin_data)//8
         # check conflict
         # mem base
         mem_base = self.mem_base
@@ -97,11 +291,30 @@ class CmdFiles:
         ram_end = ram_end - ram_end % 8
         end_index = (ram_end - mem_base)//8 + 1
         # read ram data
-        with open(bin_file, "wb") as f:
-            f.write(bin_data)
-            for index in range(last_indx, end_index):
-                f.write(self.df.pmem_read(index*8 + mem_base).to_bytes(8, byteorder='little', signed=False))
-        info(f"export {8*(end_index - last_indx) + len(bin_data)} bytes to unified bin file: {bin_file}")
+        writer = self.api_open_image_writer(bin_file, compress)
+        try:
+            writer.write(0, bin_data)
+            ret = self.api_export_mem_to(writer, last_indx*8 + mem_base, (end_index - last_indx)*8, last_indx*8)
+        finally:
+            writer.close(end_index*8)
+        if not ret:
+            error(f"read memory fail, export {bin_file} is incomplete")
+            return False
+        info(f"export {8*(end_index - last_indx) + len(bin_data)} bytes ({writer.data_size} bytes non-zero) to unified bin file: {bin_file}")
+        return True
+
+    def api_unpack_image(self, src_file, dst_file):
+        """Unpack an indexed compressed image (.xspz) to a raw bin file
+
+        Args:
+            src_file (string): Path to the .xspz file
+            dst_file (string): Path to the raw bin file
+        """
+        if not is_xspz_file(src_file):
+            error(f"{src_file} is not a xspz image")
+            return False
+        image_size = unpack_xspz_file(src_file, dst_file)
+        info(f"unpack {image_size} bytes to {dst_file}")
         return True
 
     def api_convert_reg_file(self, file_name):
@@ -171,12 +384,15 @@ class CmdFiles:
             end_address (int): End address of memory
             file_path (string): Path to the export file
             start_address (int): Start address of memory
+            zip (string): Export indexed compressed images (.xspz) instead of sparse raw files
         """
         mem_base = self.mem_base
         start_address = mem_base
         params = arg.strip().split()
+        compress = "zip" in params
+        params = [p for p in params if p != "zip"]
         if len(params) < 2:
-            message("usage: xexport_bin <end_address> <file> [start_address]")
+            message("usage: xexport_bin <end_address> <file> [start_address] [zip]")
             return
         file_path = params[1]
         if os.path.isdir(file_path):
@@ -188,12 +404,13 @@ class CmdFiles:
             if len(params) > 2:
                 start_address = int(params[2], 0)
             end_address = int(params[0], 0)
+            suffix = ".xspz" if compress else ".bin"
             if start_address != mem_base:
-               if self.api_export_unified_bin(start_address, end_address, file_path+"_all.bin") is not None:
+               if self.api_export_unified_bin(start_address, end_address, file_path+"_all"+suffix, compress) is not None:
                    return
-               warn(f"export unified bin to {file_path}_all.bin fail, try to export flash and ram individually")
+               warn(f"export unified bin to {file_path}_all{suffix} fail, try to export flash and ram individually")
             self.api_export_flash(file_path + "_flash.bin")
-            self.api_export_ram(end_address, file_path + "_ram.bin")
+            self.api_export_ram(end_address, file_path + "_ram" + suffix, compress)
         except Exception as e:
             error(f"convert {arg} to number fail: {str(e)}")
 
@@ -229,19 +446,39 @@ class CmdFiles:
         Args:
             addr (int): Export address
             arg (string): Path to the export file
+            zip (string): Export an indexed compressed image (.xspz) instead of a sparse raw file
         """
         args = arg.strip().split()
         if len(args) < 2:
-            message("usage: xexport_mem <address> <file>")
+            message("usage: xexport_mem <address> <file> [zip]")
             return
         try:
-            self.api_export_ram(int(args[0], 0), args[1])
+            self.api_export_ram(int(args[0], 0), args[1], "zip" in args[2:])
         except Exception as e:
             error(f"convert {args[0]} to number fail: {str(e)}")
 
     def complete_xexport_ram(self, text, line, begidx, endidx):
         return self.api_complite_localfile(text)
 
+    def do_xunpack_bin(self, arg):
+        """Unpack an indexed compressed image (.xspz) to a raw bin file
+
+        Args:
+            src (string): Path to the .xspz file
+            dst (string): Path to the raw bin file
+        """
+        args = arg.strip().split()
+        if len(args) < 2:
+            message("usage: xunpack_bin <xspz_file> <bin_file>")
+            return
+        try:
+            self.api_unpack_image(args[0], args[1])
+        except Exception as e:
+            error(f"unpack {args[0]} fail: {str(e)}")
+
+    def complete_xunpack_bin(self, text, line, begidx, endidx):
+        return self.api_complite_localfile(text)
+
     def complete_xflash(self, text, line, begidx, endidx):
         return self.api_complite_localfile(text)
 
@@ -250,14 +487,38 @@ class CmdFiles:
 
         Args:
             arg (string): Path to the binary file
+            delta (string): Only write the pages differing from the current memory
         """
-        if not arg:
-            message("usage: xload <bin_file>")
+        bin_file = arg.strip()
+        delta = False
+        parts = bin_file.rsplit(None, 1)
+        if len(parts) == 2 and parts[1] == "delta" and not os.path.exists(bin_file):
+            bin_file, delta = parts[0], True
+        if not bin_file:
+            message("usage: xload <bin_file> [delta]")
             return
-        if not os.path.exists(arg):
-            error(f"{arg} not found")
+        if not os.path.exists(bin_file):
+            error(f"{bin_file} not found")
             return
-        self.api_dut_bin_load(arg)
+        self.api_dut_bin_load(bin_file, delta)
 
     def complete_xload(self, text, line, begidx, endidx):
         return self.api_complite_localfile(text)
+
+    def do_xload_elf(self, arg):
+        """Load the PT_LOAD segments of an ELF file into memory/Flash and set the first instruction address to its entry
+
+        Args:
+            arg (string): Path to the ELF file
+        """
+        elf_file = arg.strip()
+        if not elf_file:
+            message("usage: xload_elf <elf_file>")
+            return
+        if not os.path.exists(elf_file):
+            error(f"{elf_file} not found")
+            return
+        self.api_dut_elf_load(elf_file)
+
+    def complete_xload_elf(self, text, line, begidx, endidx):
+        return self.api_complite_localfile(text)
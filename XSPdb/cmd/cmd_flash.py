@@ -80,6 +80,8 @@ class CmdFlash:
             kdata (list(int), dict): Register values
             kname (string): Register name
         """
+        # keep the queued writes in issue order with the direct writes below
+        self.api_mem_write_flush()
         if isinstance(kdata, list):
             for i, r in enumerate(kdata):
                 if isinstance(r, str):
@@ -106,12 +108,11 @@ class CmdFlash:
             assert False, "regs type error"
 
         # delete asm data in cache
-        cache_index = self.flash_base - self.flash_base % self.info_cache_bsz
-        if cache_index in self.info_cache_asm:
-            del self.info_cache_asm[cache_index]
+        self.api_info_cache_invalidate(self.flash_base + base_offset, self.flash_base + base_offset + len(reg_index)*8)
 
     def api_dut_reset_flash(self):
         """Reset the DUT Flash"""
+        self.api_mem_write_flush()
         self.df.flash_finish()
         self.df.InitFlash("")
         self.flash_bin_file = None
@@ -0,0 +1,123 @@
+#coding=utf-8
+
+from XSPdb.cmd.util import info, error, message, warn
+from XSPdb.cmd.xtrace import FuncTracer, open_trace_writer
+
+
+class CmdFuncTrace:
+    """Function-level timeline tracer
+
+    Records enter/leave events of the ELF symbols while stepping by instructions (the same hook
+    as xtrace_pc_symbol_block_change), into a ring buffer streamed to a Chrome trace JSON or
+    folded stacks file.
+    """
+
+    def __init__(self):
+        assert hasattr(self, "dut"), "this class must be used in XSPdb, canot be used alone"
+        self.ftrace = None
+        self.ftrace_file = None
+        self.ftrace_capacity = 1 << 20
+
+    def api_ftrace_symbol_name(self, sym):
+        """Get the name of a traced symbol (interval index)"""
+        if sym < 0 or self.elf_symbols is None:
+            return "??"
+        return self.api_symbol_interval_info(sym)[0].split(",")[0]
+
+    def api_ftrace_start(self, trace_file=None, capacity=None):
+        """Start the function tracer
+
+        Args:
+            trace_file (string): Output file, *.folded/*.txt for folded stacks, Chrome trace JSON otherwise;
+                                 if None, only the last events are kept in the ring buffer (see api_ftrace_dump)
+            capacity (int): Number of events in the ring buffer
+        Returns:
+            bool: True if started
+        """
+        if self.ftrace is not None:
+            self.api_ftrace_stop()
+        if not self.api_elf_symbols_loaded():
+            error("function trace needs the symbols of an ELF image, please xload it first")
+            return False
+        writer = None
+        if trace_file:
+            try:
+                writer = open_trace_writer(trace_file, self.api_ftrace_symbol_name)
+            except OSError as e:
+                error(f"open trace file {trace_file} fail: {str(e)}")
+                return False
+        self.ftrace = FuncTracer(capacity or self.ftrace_capacity, writer)
+        self.ftrace_file = trace_file
+        info(f"function trace started{' to ' + trace_file if trace_file else ''}")
+        return True
+
+    def api_ftrace_stop(self):
+        """Stop the function tracer, leave the functions on the shadow stack and close the output file"""
+        if self.ftrace is None:
+            return
+        self.ftrace.close(self.difftest_stat.trap.cycleCnt)
+        info(f"function trace stopped, {self.ftrace.events} events" +
+             (f" written to {self.ftrace_file}" if self.ftrace_file else ""))
+        self.ftrace = None
+        self.ftrace_file = None
+
+    def api_ftrace_dump(self, trace_file):
+        """Write the events in the ring buffer to a file (the tracer keeps running)
+
+        Args:
+            trace_file (string): Output file, *.folded/*.txt for folded stacks, Chrome trace JSON otherwise
+        """
+        if self.ftrace is None:
+            error("function trace is not started")
+            return False
+        if self.ftrace.ring.dropped:
+            warn(f"{self.ftrace.ring.dropped} oldest events are dropped from the ring buffer")
+        self.ftrace.dump(open_trace_writer(trace_file, self.api_ftrace_symbol_name))
+        info(f"dump {len(self.ftrace.ring)} events to {trace_file}")
+        return True
+
+    def api_ftrace_commit(self, pcs):
+        """Feed the PCs committed in one step to the function tracer
+
+        Args:
+            pcs (list): PCs of the valid commit slots, in commit order (a call and the
+                        callee entry may commit in the same cycle)
+        """
+        cycle = self.difftest_stat.trap.cycleCnt
+        for pc in pcs:
+            if pc == self.ftrace.last_pc:
+                continue
+            sym = self.api_symbol_interval(pc)
+            at_entry = sym >= 0 and self.elf_symbol_range[0] == pc
+            self.ftrace.switch(cycle, pc, sym, at_entry)
+
+    def do_xftrace(self, arg):
+        """Function-level timeline trace of the ELF symbols (recorded while stepping by instructions)
+
+        Args:
+            start [file] (string): Start tracing, stream to file (*.json Chrome trace, *.folded folded stacks)
+            stop (string): Stop tracing and close the file
+            dump <file> (string): Write the events in the ring buffer to a file
+        """
+        args = arg.strip().split()
+        if not args:
+            if self.ftrace is None:
+                message("function trace is off")
+            else:
+                message(f"function trace is on, {self.ftrace.events} events, depth {len(self.ftrace.stack)}" +
+                        (f", file: {self.ftrace_file}" if self.ftrace_file else ""))
+            message("usage: xftrace [start [file]|stop|dump <file>]")
+            return
+        if args[0] == "start":
+            self.api_ftrace_start(args[1] if len(args) > 1 else None)
+        elif args[0] == "stop":
+            self.api_ftrace_stop()
+        elif args[0] == "dump" and len(args) > 1:
+            self.api_ftrace_dump(args[1])
+        else:
+            message("usage: xftrace [start [file]|stop|dump <file>]")
+
+    def complete_xftrace(self, text, line, begidx, endidx):
+        if len(line[:begidx].split()) > 1:
+            return self.api_complite_localfile(text)
+        return [x for x in ["start", "stop", "dump"] if x.startswith(text)]
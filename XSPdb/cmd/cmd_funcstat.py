@@ -0,0 +1,142 @@
+#coding=utf-8
+
+from XSPdb.cmd.util import info, error, message
+from XSPdb.cmd.xtrace import SymbolAccount
+
+
+class CmdFuncStat:
+    """Exact per-function cycle and instruction accounting
+
+    Every commit seen while stepping by instructions (xistep, emu.py -pc) is attributed to
+    the ELF symbol of its PC, with and without the callees (see xtrace.SymbolAccount).
+    """
+
+    def __init__(self):
+        assert hasattr(self, "dut"), "this class must be used in XSPdb, canot be used alone"
+        self.funcstat = None
+        self.funcstat_running = False
+        self.funcstat_instr_cnt = 0
+
+    def api_funcstat_start(self):
+        """Start counting the cycles and instructions per symbol
+
+        Returns:
+            bool: True if started
+        """
+        if not self.api_elf_symbols_loaded():
+            error("function statistics need the symbols of an ELF image, please xload it first")
+            return False
+        self.funcstat = SymbolAccount(len(self.elf_symbols.uaddr), self.difftest_stat.trap.cycleCnt)
+        self.funcstat_running = True
+        self.funcstat_instr_cnt = self.difftest_stat.trap.instrCnt
+        info(f"function statistics started ({len(self.elf_symbols.uaddr)} symbols)")
+        return True
+
+    def api_funcstat_stop(self):
+        """Stop counting (the counters are kept for the report)"""
+        if not self.funcstat_running:
+            return
+        self.funcstat_running = False
+        self.funcstat_instr_cnt = 0
+        self.funcstat.close()
+
+    def api_funcstat_commit(self, pcs):
+        """Account the instructions committed in one instruction step
+
+        The number of instructions is the delta of the committed instruction counter of the DUT,
+        so the commits the step did not stop at are counted too (they go to the last PC).
+
+        Args:
+            pcs (list): PCs of the valid commit slots, in commit order
+        """
+        trap = self.difftest_stat.trap
+        count = trap.instrCnt - self.funcstat_instr_cnt
+        self.funcstat_instr_cnt = trap.instrCnt
+        if not pcs:
+            if count <= 0 or self.funcstat.last_pc is None:
+                return
+            pcs = [self.funcstat.last_pc]
+        cycle = trap.cycleCnt
+        last = len(pcs) - 1
+        for i, pc in enumerate(pcs):
+            sym = self.api_symbol_interval(pc)
+            at_entry = sym >= 0 and self.elf_symbol_range[0] == pc
+            n = max(count - last, 0) if i == last else (1 if count > i else 0)
+            self.funcstat.commit(cycle, pc, sym, at_entry, n)
+
+    def api_funcstat_report(self, top=30):
+        """Get the cycles and instructions per symbol
+
+        Args:
+            top (int): Max number of symbols, 0 for all
+        Returns:
+            list((name, self_cycles, self_instrs, total_cycles, total_instrs)): Sorted by self cycles
+        """
+        if self.funcstat is None:
+            return []
+        rows = self.funcstat.report()
+        if top > 0:
+            rows = rows[:top]
+        return [(self.api_symbol_interval_info(r[0])[0] if r[0] >= 0 else "??",) + r[1:] for r in rows]
+
+    def api_funcstat_lines(self, top=30):
+        """Format the report as text lines"""
+        if self.funcstat is None:
+            return []
+        cycles = max(self.funcstat.cycle - self.funcstat.start_cycle, 1)
+        lines = [f"# cycles: {self.funcstat.cycle - self.funcstat.start_cycle}, instructions: {self.funcstat.instrs}",
+                 "%7s %12s %12s %7s %12s %12s  %s" % ("self%", "self_cycles", "self_instrs", "total%", "total_cycles", "total_instrs", "symbol")]
+        for name, sc, si, tc, ti in self.api_funcstat_report(top):
+            lines.append("%6.2f%% %12d %12d %6.2f%% %12d %12d  %s" % (100.0*sc/cycles, sc, si, 100.0*tc/cycles, tc, ti, name))
+        return lines
+
+    def api_funcstat_write_report(self, report_file, top=0):
+        """Write the report to a file
+
+        Args:
+            report_file (string): Path to the report file
+            top (int): Max number of symbols, 0 for all
+        """
+        lines = self.api_funcstat_lines(top)
+        with open(report_file, "w") as f:
+            for line in lines:
+                f.write(line + "\n")
+        info(f"write function statistics ({max(len(lines) - 2, 0)} symbols) to {report_file}")
+
+    def do_xfuncstat(self, arg):
+        """Exact cycles and instructions per ELF symbol (counted while stepping by instructions)
+
+        Args:
+            start (string): Start counting
+            stop (string): Stop counting
+            report [file] [top] (string): Show (or write to file) the counters, sorted by self cycles
+        """
+        args = arg.strip().split()
+        usage = "usage: xfuncstat [start|stop|report [file] [top]]"
+        if not args:
+            if self.funcstat is None:
+                message("function statistics is off")
+            else:
+                message(f"function statistics is {'on' if self.funcstat_running else 'stopped'}, {self.funcstat.instrs} instructions")
+            message(usage)
+        elif args[0] == "start":
+            self.api_funcstat_start()
+        elif args[0] == "stop":
+            self.api_funcstat_stop()
+        elif args[0] == "report":
+            rest = args[1:]
+            top = int(rest.pop()) if rest and rest[-1].isdigit() else 30
+            if self.funcstat is None:
+                message("function statistics is off")
+            elif rest:
+                self.api_funcstat_write_report(rest[0], 0)
+            else:
+                for line in self.api_funcstat_lines(top):
+                    message(line)
+        else:
+            message(usage)
+
+    def complete_xfuncstat(self, text, line, begidx, endidx):
+        if line[:begidx].split()[1:2] == ["report"]:
+            return self.api_complite_localfile(text)
+        return [x for x in ["start", "stop", "report"] if x.startswith(text)]
@@ -1,8 +1,128 @@
 #coding=utf-8
 
+import os
 import bisect
+import threading
 from collections import OrderedDict
-from XSPdb.cmd.util import error, info
+from XSPdb.cmd.util import error, info, message, dasm_bytes
+from XSPdb.cmd.rvdecoder import decode16, decode32
+
+# Instructions whose target can be predicted from the encoding (register jumps are not)
+_DIRECT_JUMPS = {"jal", "beq", "bne", "blt", "bge", "bltu", "bgeu", "c.j", "c.jal", "c.beqz", "c.bnez"}
+
+
+def _direct_target(address, hex_str):
+    """Get the target of a direct jump/branch instruction, None for other instructions"""
+    try:
+        word = int(hex_str, 16)
+    except ValueError:
+        return None
+    instr = decode32(word) if word & 0x3 == 0x3 else decode16(word)
+    if instr is None or instr["name"] not in _DIRECT_JUMPS:
+        return None
+    return address + instr["imm"]
+
+
+class AsmBlockCache:
+    """Size-bounded LRU cache of disassembly blocks
+
+    Every block is stored with a tag (the generations of the memory pages it was built from),
+    a block whose tag no longer matches is treated as a miss.
+    """
+
+    def __init__(self, block_size=256, max_blocks=4096):
+        self.blocks = OrderedDict()
+        self.labels = OrderedDict()
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.stales = 0
+        self.evictions = 0
+
+    def get(self, index, tag=None, default=None):
+        item = self.blocks.get(index)
+        if item is None:
+            self.misses += 1
+            return default
+        if item[0] != tag:
+            del self.blocks[index]
+            self.stales += 1
+            self.misses += 1
+            return default
+        self.blocks.move_to_end(index)
+        self.hits += 1
+        return item[1]
+
+    def has(self, index, tag=None):
+        """Check if a valid block is cached, without touching the LRU order and the counters"""
+        item = self.blocks.get(index)
+        return item is not None and item[0] == tag
+
+    def put(self, index, tag, data):
+        self.blocks[index] = (tag, data)
+        self.blocks.move_to_end(index)
+        while len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+            self.evictions += 1
+
+    def get_labels(self, index, key):
+        """Get the labels stored for a block, None if not stored with the same key"""
+        item = self.labels.get(index)
+        if item is None or item[0] != key:
+            return None
+        self.labels.move_to_end(index)
+        return item[1]
+
+    def put_labels(self, index, key, labels):
+        self.labels[index] = (key, labels)
+        self.labels.move_to_end(index)
+        while len(self.labels) > self.max_blocks:
+            self.labels.popitem(last=False)
+
+    def invalidate(self, start, end):
+        """Delete blocks overlapping [start, end)"""
+        bsz = self.block_size
+        # The block before may hold a 32-bit instruction across its end
+        first = (start - 2) - (start - 2) % bsz
+        if (end - first)//bsz > len(self.blocks):
+            for index in [k for k in self.blocks if first <= k < end]:
+                del self.blocks[index]
+        else:
+            for index in range(first, end, bsz):
+                self.blocks.pop(index, None)
+
+    def clear(self):
+        self.blocks.clear()
+        self.labels.clear()
+
+    def keys(self):
+        return self.blocks.keys()
+
+    def pop(self, index, default=None):
+        item = self.blocks.pop(index, None)
+        return default if item is None else item[1]
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def __contains__(self, index):
+        return index in self.blocks
+
+    def __getitem__(self, index):
+        return self.blocks[index][1]
+
+    def __setitem__(self, index, data):
+        self.put(index, None, data)
+
+    def __delitem__(self, index):
+        del self.blocks[index]
 
 
 class CmdInfo:
@@ -11,8 +131,17 @@ class CmdInfo:
 
     def __init__(self):
         assert hasattr(self, "dut"), "this class must be used in XSPdb, canot be used alone"
-        self.info_cache_asm = {}
         self.info_cache_bsz = 256
+        self.info_cache_asm = AsmBlockCache(self.info_cache_bsz, 4096)
+        self.info_cache_lock = threading.RLock()
+        self.info_prefetch_enable = True
+        self.info_prefetch_max_blocks = 8
+        self.info_prefetch_cond = threading.Condition()
+        self.info_prefetch_pending = None
+        self.info_prefetch_thread = None
+        self.info_prefetch_epoch = 0
+        self.info_prefetch_done = 0
+        self.info_prefetch_pc = None
         self.info_cached_cmpclist = None
         self.info_watch_list = OrderedDict()
         self.info_force_address = None
@@ -86,6 +215,297 @@ class CmdInfo:
         except ValueError:
             error(f"Invalid address: {arg}")
 
+    def api_info_cache_invalidate(self, start, end):
+        """Delete cached disassembly blocks overlapping a memory range
+
+        Args:
+            start (int): Start address of the range
+            end (int): End address of the range
+        """
+        with self.info_cache_lock:
+            self.info_cache_asm.invalidate(start, end)
+
+    def api_info_cache_tag(self, cache_index):
+        """Get the tag of a disassembly block: generations of the memory pages it covers
+
+        Args:
+            cache_index (int): Block address
+        """
+        if self.api_is_flash_address(cache_index):
+            return None
+        # 2 more bytes are read for the 32-bit instruction across the block end
+        page_size = self.api_mem_page_size()
+        first = cache_index - (cache_index - self.mem_base) % page_size
+        return tuple(self.api_mem_page_gen(page) for page in range(first, cache_index + self.info_cache_bsz + 2, page_size))
+
+    def api_info_cache_block(self, cache_index):
+        """Get the disassembly of a block from the cache, disassemble it on miss
+
+        Args:
+            cache_index (int): Block address (aligned to info_cache_bsz)
+
+        Returns:
+            list((address, hex, mnemonic, str)): Disassembly results
+        """
+        tag = self.api_info_cache_tag(cache_index)
+        with self.info_cache_lock:
+            asm_data = self.info_cache_asm.get(cache_index, tag)
+        if asm_data is None:
+            asm_data = self.api_all_data_to_asm(cache_index, self.info_cache_bsz)
+            with self.info_cache_lock:
+                self.info_cache_asm.put(cache_index, tag, asm_data)
+        return asm_data
+
+    def api_info_prefetch_predict(self, pc, cache_index, asm_data, lines=0):
+        """Predict the disassembly blocks needed next: the neighbour in the direction of
+        the commit PC trend and the blocks holding the direct jump/branch targets of the current block
+
+        Args:
+            pc (int): Current commit PC
+            cache_index (int): Address of the block holding pc
+            asm_data (list): Disassembly of the current block
+            lines (int): Height of the disassembly window, the neighbour block of a target this close to a boundary is also needed
+        Returns:
+            list(int): Block addresses, most likely first
+        """
+        bsz = self.info_cache_bsz
+        mem_end = self.mem_base + self.mem_size
+        trend = 0 if self.info_prefetch_pc is None else pc - self.info_prefetch_pc
+        blocks = []
+        def add(index):
+            if index != cache_index and index not in blocks and self.mem_base <= index < mem_end:
+                blocks.append(index)
+        if trend >= 0:
+            add(cache_index + bsz)
+        if trend <= 0:
+            add(cache_index - bsz)
+        # Jumps after pc are taken first, then the ones before it (loops)
+        index = bisect.bisect_left([x[0] for x in asm_data], pc)
+        for address, hex_str, _, _ in asm_data[index:] + asm_data[:index]:
+            if len(blocks) >= self.info_prefetch_max_blocks:
+                break
+            target = _direct_target(address, hex_str)
+            if target is None:
+                continue
+            add(target - target % bsz)
+            if target % bsz < lines:
+                add(target - target % bsz - bsz)
+            elif bsz - target % bsz < lines:
+                add(target - target % bsz + bsz)
+        return blocks[:self.info_prefetch_max_blocks]
+
+    def api_info_prefetch_request(self, blocks):
+        """Ask the prefetch thread to disassemble blocks into the cache (replaces the older request)
+
+        Args:
+            blocks (list(int)): Block addresses
+        """
+        if not self.info_prefetch_enable:
+            return
+        if self.info_prefetch_thread is None or not self.info_prefetch_thread.is_alive():
+            self.info_prefetch_thread = threading.Thread(target=self._info_prefetch_loop,
+                                                         name="xspdb-dasm-prefetch", daemon=True)
+            self.info_prefetch_thread.start()
+        with self.info_prefetch_cond:
+            self.info_prefetch_epoch += 1
+            self.info_prefetch_pending = (self.info_prefetch_epoch, blocks)
+            self.info_prefetch_cond.notify()
+
+    def _info_prefetch_loop(self):
+        while True:
+            with self.info_prefetch_cond:
+                while self.info_prefetch_pending is None:
+                    self.info_prefetch_cond.wait()
+                epoch, blocks = self.info_prefetch_pending
+                self.info_prefetch_pending = None
+            for cache_index in blocks:
+                # Stop on a newer request, and never race with queued writes of the main thread
+                if epoch != self.info_prefetch_epoch or not self.info_prefetch_enable or \
+                   self.mrw_write_pending or self.mrw_write_batch_depth > 0:
+                    break
+                self._info_prefetch_block(cache_index)
+
+    def _info_prefetch_block(self, cache_index):
+        tag = self.api_info_cache_tag(cache_index)
+        with self.info_cache_lock:
+            if self.info_cache_asm.has(cache_index, tag):
+                return
+        bsz = self.info_cache_bsz
+        try:
+            # Same result as api_read_data_as_asm, but never flushes writes or reports errors
+            buffer = self.api_read_bytes_bulk(cache_index, bsz + 2)
+            if buffer is None:
+                buffer = self.api_read_bytes_with_func(cache_index, bsz + 2, self.df.pmem_read)
+            asm_data = [x for x in dasm_bytes(buffer, cache_index) if x[0] < cache_index + bsz]
+        except Exception:
+            return
+        with self.info_cache_lock:
+            # Drop the result if the block was written meanwhile or the cache was resized
+            if tag == self.api_info_cache_tag(cache_index) and bsz == self.info_cache_bsz:
+                self.info_cache_asm.put(cache_index, tag, asm_data)
+                self.info_prefetch_done += 1
+
+    def api_set_info_cache_size(self, block_size=None, max_blocks=None):
+        """Set the disassembly cache block size and the max number of blocks (the cache is cleared)
+
+        Args:
+            block_size (int): Block size in bytes
+            max_blocks (int): Max number of cached blocks
+        """
+        if block_size is not None:
+            assert block_size >= 16 and block_size % 2 == 0, "block size need >= 16 and aligned to 2"
+            self.info_cache_bsz = block_size
+        if max_blocks is not None:
+            assert max_blocks > 0, "max blocks need > 0"
+            self.info_cache_asm.max_blocks = max_blocks
+        with self.info_cache_lock:
+            self.info_cache_asm.block_size = self.info_cache_bsz
+            self.info_cache_asm.clear()
+            self.info_cache_asm.reset_stats()
+            self.info_prefetch_done = 0
+
+    def api_info_cache_stats(self):
+        """Get the statistics of the disassembly cache
+
+        Returns:
+            dict: hits, misses, stales, evictions, blocks, max_blocks, block_size, prefetched
+        """
+        c = self.info_cache_asm
+        return {"hits": c.hits, "misses": c.misses, "stales": c.stales, "evictions": c.evictions,
+                "blocks": len(c), "max_blocks": c.max_blocks, "block_size": self.info_cache_bsz,
+                "prefetched": self.info_prefetch_done}
+
+    def do_xdasm_cache_stats(self, arg):
+        """Show the hit/miss statistics of the disassembly cache
+
+        Args:
+            reset (string): Reset the counters after showing
+        """
+        st = self.api_info_cache_stats()
+        total = st["hits"] + st["misses"]
+        rate = 100.0 * st["hits"] / total if total else 0.0
+        message(f"block size: {st['block_size']}  blocks: {st['blocks']}/{st['max_blocks']}")
+        message(f"hits: {st['hits']}  misses: {st['misses']} (stale: {st['stales']})  evictions: {st['evictions']}  hit rate: {rate:.1f}%")
+        message(f"prefetched: {st['prefetched']} ({'on' if self.info_prefetch_enable else 'off'})")
+        if arg.strip() == "reset":
+            with self.info_cache_lock:
+                self.info_cache_asm.reset_stats()
+                self.info_prefetch_done = 0
+
+    def do_xset_dasm_cache_size(self, arg):
+        """Set the disassembly cache block size and the max number of blocks
+
+        Args:
+            block_size (int): Block size in bytes
+            max_blocks (int): Max number of cached blocks
+        """
+        args = arg.strip().split()
+        if not args:
+            message("usage: xset_dasm_cache_size <block_size> [max_blocks]")
+            return
+        try:
+            self.api_set_info_cache_size(int(args[0], 0), int(args[1], 0) if len(args) > 1 else None)
+        except Exception as e:
+            error(f"set dasm cache size fail: {str(e)}")
+
+    def do_xdasm_prefetch(self, arg):
+        """Enable or disable the background prefetch of disassembly blocks
+
+        Args:
+            on/off (string): Enable or disable, show the state if empty
+        """
+        arg = arg.strip()
+        if arg in ("on", "off"):
+            self.info_prefetch_enable = arg == "on"
+        elif arg:
+            message("usage: xdasm_prefetch [on|off]")
+            return
+        info(f"dasm prefetch is {'on' if self.info_prefetch_enable else 'off'}, {self.info_prefetch_done} blocks prefetched")
+
+    def complete_xdasm_prefetch(self, text, line, begidx, endidx):
+        return [x for x in ["on", "off"] if x.startswith(text)]
+
+    def api_asm_labels(self, asm_data):
+        """Get the symbol labels of disassembled instructions
+
+        Args:
+            asm_data (list((address, hex, mnemonic, str))): Disassembly results
+        Returns:
+            dict: address -> (entry, target), entry is the label of a symbol starting at the
+            instruction, target the label of the direct jump/branch target, None if not any
+        """
+        labels = {}
+        if not self.api_elf_symbols_loaded():
+            return labels
+        for address, hex_str, _, _ in asm_data:
+            entry = None
+            index = self.api_symbol_interval(address)
+            if index >= 0 and self.api_symbol_interval_info(index)[1] == address:
+                entry = self.api_symbol_label(address)
+            target = _direct_target(address, hex_str)
+            if target is not None:
+                target = self.api_symbol_label(target)
+            if entry is not None or target is not None:
+                labels[address] = (entry, target)
+        return labels
+
+    def api_info_block_labels(self, cache_index):
+        """Get the symbol labels of a disassembly block, computed once per block and stored with it
+
+        Args:
+            cache_index (int): Block address (aligned to info_cache_bsz)
+        Returns:
+            dict: address -> (entry, target), see api_asm_labels
+        """
+        key = (self.api_info_cache_tag(cache_index), self.elf_symbols_gen)
+        with self.info_cache_lock:
+            labels = self.info_cache_asm.get_labels(cache_index, key)
+        if labels is None:
+            asm_data = self.api_dasm_index_range(cache_index, self.info_cache_bsz)
+            if asm_data is None:
+                asm_data = self.api_info_cache_block(cache_index)
+            labels = self.api_asm_labels(asm_data)
+            # Symbols may be loaded by api_asm_labels
+            key = (key[0], self.elf_symbols_gen)
+            with self.info_cache_lock:
+                self.info_cache_asm.put_labels(cache_index, key, labels)
+        return labels
+
+    def api_info_block_asm(self, pc_last, h):
+        """Get the disassembly around pc_last from the block cache
+
+        Args:
+            pc_last (int): Center address
+            h (int): Height of the disassembly window
+
+        Returns:
+            list((address, hex, mnemonic, str)): Disassembly results
+        """
+        base_addr = self.mem_base
+        # Check the cache first; if not found, generate it
+        cache_index = pc_last - pc_last % self.info_cache_bsz
+        asm_data = self.api_info_cache_block(cache_index)
+
+        # Need to check boundaries; if near a boundary, fetch adjacent cache blocks
+        cache_index_ext = base_addr
+        if pc_last % self.info_cache_bsz < h:
+            cache_index_ext = cache_index - self.info_cache_bsz
+        elif self.info_cache_bsz - pc_last % self.info_cache_bsz < h:
+            cache_index_ext = cache_index + self.info_cache_bsz
+
+        # Boundary is valid
+        if cache_index_ext > base_addr:
+            asm_data_ext = self.api_info_cache_block(cache_index_ext)
+            if cache_index_ext < cache_index:
+                asm_data = self.api_merge_asm_list_overlap_append(asm_data_ext, asm_data)
+            else:
+                asm_data = self.api_merge_asm_list_overlap_append(asm_data, asm_data_ext)
+
+        if self.info_prefetch_enable and not self.api_is_flash_address(pc_last):
+            self.api_info_prefetch_request(self.api_info_prefetch_predict(pc_last, cache_index, asm_data, h))
+            self.info_prefetch_pc = pc_last
+        return asm_data
+
     def api_asm_info(self, size):
         """Get the current memory disassembly
 
@@ -116,37 +536,32 @@ class CmdInfo:
 
         self.info_last_address = pc_last
         self.info_cached_cmpclist = pc_list.copy()
-        # Check the cache first; if not found, generate it
-        cache_index = pc_last - pc_last % self.info_cache_bsz
-        asm_data = self.info_cache_asm.get(cache_index,
-                                           self.api_all_data_to_asm(cache_index, self.info_cache_bsz))
-        self.info_cache_asm[cache_index] = asm_data
-
-        # Need to check boundaries; if near a boundary, fetch adjacent cache blocks
-        cache_index_ext = base_addr
-        if pc_last % self.info_cache_bsz < h:
-            cache_index_ext = cache_index - self.info_cache_bsz
-        elif self.info_cache_bsz - pc_last % self.info_cache_bsz < h:
-            cache_index_ext = cache_index + self.info_cache_bsz
-
-        # Boundary is valid
-        if cache_index_ext > base_addr:
-            asm_data_ext = self.info_cache_asm.get(cache_index_ext,
-                                                   self.api_all_data_to_asm(cache_index_ext, self.info_cache_bsz))
-            self.info_cache_asm[cache_index_ext] = asm_data_ext
-            if cache_index_ext < cache_index:
-                asm_data = self.api_merge_asm_list_overlap_append(asm_data_ext, asm_data)
-            else:
-                asm_data = self.api_merge_asm_list_overlap_append(asm_data, asm_data_ext)
+        # The static index is exact and needs no block merging, use it if it covers pc_last
+        asm_data = self.api_dasm_index_window(pc_last, h)
+        if asm_data is None:
+            asm_data = self.api_info_block_asm(pc_last, h)
 
         # Quickly locate the position of pc_last
         address_list = [x[0] for x in asm_data]
         pc_last_index = bisect.bisect_left(address_list, pc_last)
         start_line = max(0, pc_last_index - h//2)
         asm_lines = []
+        bsz = self.info_cache_bsz
+        labels = {}
+        for index in sorted({l[0] - l[0] % bsz for l in asm_data[start_line:start_line + h]}):
+            labels.update(self.api_info_block_labels(index))
         for l in  asm_data[start_line:start_line + h]:
             find_pc = l[0] in valid_pc_list
+            entry, target = labels.get(l[0], (None, None))
             line = "%s|0x%x: %s  %s  %s" % (">" if find_pc else " ", l[0], l[1], l[2], l[3])
+            if target is not None:
+                line += " " + target
+            comments = [] if entry is None else [entry]
+            source = self.api_address_to_line(l[0], exact=True)
+            if source is not None:
+                comments.append(os.path.basename(source))
+            if comments:
+                line += "  # " + "  ".join(comments)
             if find_pc and l[0] == pc_last:
                 line = ("norm_red", line)
             if self.info_force_address is not None:
@@ -227,6 +642,15 @@ class CmdInfo:
             for k , v in self.info_watch_list.items():
                 abs_list += [f"{k}({v.W()}): 0x{v.value:x}"]
 
+        # Watched variables
+        if self.elf_var_watch_list:
+            abs_list += ["\nWatched Variables:"]
+            for name in self.elf_var_watch_list:
+                text = self.api_format_var(name, quiet=True)
+                if text is None:
+                    text = "<not found>"
+                abs_list += [f"{name} = {text if len(text) <= 256 else text[:256] + '...'}"]
+
         if self.flash_bin_file:
             abs_list += ["\nFlash Bin:"]
             abs_list += [f"file: {self.flash_bin_file}"]
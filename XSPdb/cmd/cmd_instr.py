@@ -1,6 +1,7 @@
 #coding=utf-8
 
 from XSPdb.cmd.util import error, message
+from XSPdb.cmd.rvdecoder import decode16, decode32
 import os
 
 class CmdInstr:
@@ -16,13 +17,14 @@ class CmdInstr:
         Returns:
             Dictionary containing decoded fields:
             {
-                'type': str,   # Instruction type (CR/CI/CIW/CL/CS/CA/CB/CJ)
+                'type': str,   # Instruction type (CR/CI/CSS/CIW/CL/CS/CA/CB/CJ)
                 'opcode': int, # Primary opcode (2 bits)
                 'funct3': int, # 3-bit function code
                 'rd': int,     # Destination register (normal or compressed)
                 'rs1': int,    # Source register 1 (normal or compressed)
                 'rs2': int,    # Source register 2 (normal or compressed)
                 'imm': int,    # Immediate value (signed)
+                'name': str,   # Instruction name
                 'is_compressed': True
                 'asm': str,    # Assembly string
             }
@@ -31,66 +33,18 @@ class CmdInstr:
             instr = int.from_bytes(instr, byteorder='little', signed=False)
         # Convert to 16-bit unsigned
         instr = instr & 0xffff
+        decoded = decode16(instr) or {}
         fields = {
             'is_compressed': True,
-            'type': 'Unknown',
-            'opcode': (instr >> 13) & 0x3,  # Primary opcode (bits 15-13)
-            'funct3': (instr >> 13) & 0x7,   # For some instruction types
-            'rd': 0,
-            'rs1': 0,
-            'rs2': 0,
-            'imm': 0
+            'type': decoded.get('type', 'Unknown'),
+            'name': decoded.get('name', 'unknown'),
+            'opcode': instr & 0x3,          # Quadrant (bits 1-0)
+            'funct3': (instr >> 13) & 0x7,  # bits 15-13
+            'rd': decoded.get('rd', 0),
+            'rs1': decoded.get('rs1', 0),
+            'rs2': decoded.get('rs2', 0),
+            'imm': decoded.get('imm', 0),
         }
-        # Helper to expand compressed register numbers
-        def expand_reg(compressed_reg):
-            return 8 + (compressed_reg & 0x7)
-        # Main decoding logic
-        op = fields['opcode']
-        if op == 0x0:  # CIW format (Quadrant 0)
-            fields['type'] = 'CIW'
-            fields['rd'] = expand_reg((instr >> 2) & 0x7)  # rd'
-            fields['imm'] = ((instr >> 5) & 0x3) << 3 | (instr >> 10) << 5
-            fields['imm'] = (fields['imm'] & 0x3f) << 2  # Zero-extended
-        elif op == 0x1:  # CI/CL format
-            funct3 = (instr >> 13) & 0x7
-            if funct3 in [0, 2, 6]:  # CI format
-                fields['type'] = 'CI'
-                fields['rd'] = expand_reg((instr >> 7) & 0x7)
-                imm = ((instr >> 12) & 0x1) << 5 | (instr >> 2) & 0x1f
-                if funct3 == 0:  # C.ADDI
-                    fields['imm'] = (imm << 26) >> 26  # Sign extend 6-bit
-                else:  # C.LI etc.
-                    fields['imm'] = imm
-            elif funct3 in [1, 3, 5, 7]:  # CL format
-                fields['type'] = 'CL'
-                fields['rd'] = expand_reg((instr >> 7) & 0x7)
-                fields['rs1'] = expand_reg((instr >> 10) & 0x7)
-                imm = ((instr >> 5) & 0x3) << 6 | (instr >> 10) & 0x7
-                imm = (imm << 25) >> 25  # Sign extend
-        elif op == 0x2:  # CR/CS/CB format
-            funct4 = (instr >> 12) & 0xf
-            if funct4 == 0x8:  # CR format
-                fields['type'] = 'CR'
-                fields['rd'] = (instr >> 7) & 0x1f
-                fields['rs1'] = (instr >> 7) & 0x1f
-                fields['rs2'] = (instr >> 2) & 0x1f
-            elif funct4 in [0x9, 0xa, 0xb]:  # CS format
-                fields['type'] = 'CS'
-                fields['rs1'] = expand_reg((instr >> 10) & 0x7)
-                fields['rs2'] = expand_reg((instr >> 7) & 0x7)
-                imm = (instr >> 2) & 0x1f
-                fields['imm'] = imm
-            else:  # CB format
-                fields['type'] = 'CB'
-                fields['rs1'] = expand_reg((instr >> 10) & 0x7)
-                imm = ((instr >> 12) & 0x1) << 8 | (instr >> 2) & 0x7 | (instr >> 7) & 0x18
-                imm = (imm << 23) >> 23  # Sign extend 9-bit
-                fields['imm'] = imm
-        elif op == 0x3:  # CJ format
-            fields['type'] = 'CJ'
-            imm = ((instr >> 12) & 0x1) << 11 | (instr >> 1) & 0x7ff
-            imm = (imm << 19) >> 19  # Sign extend 12-bit
-            fields['imm'] = imm
         try:
             fields['asm'] = self.api_dasm_from_bytes(instr.to_bytes(2, byteorder="little", signed=False), 0)[0][2]
         except Exception as e:
@@ -154,7 +108,8 @@ class CmdInstr:
         Returns:
             Dictionary containing decoded instruction fields:
             {
-                'type': str,   # Instruction type (R/I/S/B/U/J)
+                'type': str,   # Instruction type (R/R4/I/S/B/U/J)
+                'name': str,   # Instruction name
                 'opcode': int, # 7-bit opcode
                 'rd': int,     # Destination register (5 bits)
                 'rs1': int,    # Source register 1 (5 bits)
@@ -176,49 +131,17 @@ class CmdInstr:
         rs2 = (instr >> 20) & 0x1f
         funct7 = (instr >> 25) & 0x7f
 
-        # Determine instruction type
-        instr_type = None
-        imm = 0
-
-        # Immediate handling for different formats
-        if opcode in [0x37, 0x17]:  # U-type (LUI/AUIPC)
-            instr_type = 'U'
-            imm = (instr & 0xfffff000)
-        elif opcode == 0x6f:        # J-type (JAL)
-            instr_type = 'J'
-            imm = ((instr >> 31) & 0x1) << 20
-            imm |= ((instr >> 21) & 0x3ff) << 1
-            imm |= ((instr >> 20) & 0x1) << 11
-            imm |= ((instr >> 12) & 0xff) << 12
-            imm = (imm << 11) >> 11  # Sign extend
-        elif opcode in [0x67, 0x03, 0x13, 0x1b]:  # I-type
-            instr_type = 'I'
-            imm = (instr >> 20) & 0xfff
-            if imm & 0x800:  # Sign extend
-                imm |= 0xfffff000
-        elif opcode == 0x63:        # B-type
-            instr_type = 'B'
-            imm = ((instr >> 31) & 0x1) << 12
-            imm |= ((instr >> 25) & 0x3f) << 5
-            imm |= ((instr >> 8) & 0xf) << 1
-            imm |= ((instr >> 7) & 0x1) << 11
-            imm = (imm << 19) >> 19  # Sign extend
-        elif opcode == 0x23:        # S-type
-            instr_type = 'S'
-            imm = ((instr >> 25) & 0x7f) << 5
-            imm |= (instr >> 7) & 0x1f
-            if imm & 0x800:  # Sign extend
-                imm |= 0xfffff000
-        elif opcode == 0x33:        # R-type
-            instr_type = 'R'
-        else:
-            instr_type = 'unknown'
+        # Instruction type and immediate from the built-in decoder tables
+        decoded = decode32(instr & 0xffffffff) or {}
+        instr_type = decoded.get('type', 'unknown')
+        imm = decoded.get('imm', 0)
         try:
             instr_asm   = self.api_dasm_from_bytes(instr.to_bytes(4, byteorder="little", signed=False), 0)[0][2]
         except Exception as e:
             instr_asm = f"unknown"
         return {
             'type': instr_type,
+            'name': decoded.get('name', 'unknown'),
             'opcode': opcode,
             'rd': rd,
             'rs1': rs1,
@@ -360,7 +283,6 @@ class CmdInstr:
         try:
             address = int(params[0], 0)
             self.api_write_bytes(address, self.api_convert_uint64_bytes(params[1]))
-            self.info_cache_asm.clear()
         except Exception as e:
             error(f"convert {params[0]} to number fail: {str(e)}")
 
@@ -0,0 +1,193 @@
+#coding=utf-8
+
+import zlib
+from array import array
+from XSPdb.cmd.util import info, error, message, warn
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CmdMemPage:
+    """Page-hash index over physical memory, used to find the pages changed between two points
+    """
+
+    def __init__(self):
+        assert hasattr(self, "dut"), "this class must be used in XSPdb, canot be used alone"
+        self.mem_page_bits = 12
+        self.mem_page_scan_chunk = 1024*1024
+        self.mem_page_hash = None
+        self.mem_page_valid = None
+        self.mem_page_gen = {}
+        self.mem_gen = 0
+        self.mem_last_token = None
+        self.mem_page_weight = None
+        if np is not None:
+            # Odd per-dword weights: sum(dword * weight) is a cheap vectorized page digest
+            self.mem_page_weight = np.random.RandomState(0x5850).randint(
+                0, 1 << 62, size=(1 << self.mem_page_bits)//8, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+    def api_mem_page_size(self):
+        """Get the page size of the page-hash index"""
+        return 1 << self.mem_page_bits
+
+    def api_mem_page_index_init(self):
+        """Allocate the page-hash index for the whole memory (pages are hashed on first scan)"""
+        page_count = (self.mem_size + self.api_mem_page_size() - 1) >> self.mem_page_bits
+        if self.mem_page_hash is not None and len(self.mem_page_hash) == page_count:
+            return
+        self.mem_page_hash = array('Q', bytes(8*page_count))
+        self.mem_page_valid = bytearray(page_count)
+
+    def api_mem_page_digest(self, data):
+        """Calculate digests of the pages in data
+
+        Args:
+            data (bytes/memoryview): Page aligned data
+        Returns:
+            array/ndarray: uint64 digest of each page
+        """
+        page_size = self.api_mem_page_size()
+        if np is not None and len(data) % page_size == 0:
+            dwords = np.frombuffer(data, dtype=np.uint64).reshape(-1, page_size//8)
+            return (dwords * self.mem_page_weight).sum(axis=1, dtype=np.uint64)
+        data = memoryview(data).cast("B")
+        return array('Q', (zlib.crc32(data[i:i+page_size]) for i in range(0, len(data), page_size)))
+
+    def api_mem_mark_dirty(self, start, end):
+        """Mark the pages in [start, end) as changed (called on writes from XSPdb)
+
+        Args:
+            start (int): Start address
+            end (int): End address
+        Returns:
+            int: New generation
+        """
+        if end <= start or self.api_is_flash_address(start):
+            return self.mem_gen
+        self.mem_gen += 1
+        first = (max(start, self.mem_base) - self.mem_base) >> self.mem_page_bits
+        last = (min(end, self.mem_base + self.mem_size) - 1 - self.mem_base) >> self.mem_page_bits
+        for page in range(first, last + 1):
+            self.mem_page_gen[page] = self.mem_gen
+        return self.mem_gen
+
+    def api_mem_page_gen(self, address):
+        """Get the generation of the page containing address (0 means never seen changed)
+
+        Args:
+            address (int): Memory address
+        """
+        return self.mem_page_gen.get((address - self.mem_base) >> self.mem_page_bits, 0)
+
+    def api_mem_page_scan(self, start=None, end=None):
+        """Rehash pages in [start, end), pages whose digest changed get a new generation
+
+        Args:
+            start (int): Start address, default is mem base
+            end (int): End address, default is mem base + mem size
+        Returns:
+            int: Current generation (a token for api_mem_dirty_pages), None if fail
+        """
+        if not self.mem_inited:
+            error("mem not inited, please load a bin file")
+            return None
+        self.api_mem_write_flush()
+        self.api_mem_page_index_init()
+        page_size = self.api_mem_page_size()
+        mem_end = self.mem_base + self.mem_size
+        start = self.mem_base if start is None else max(start, self.mem_base)
+        end = mem_end if end is None else min(end, mem_end)
+        start -= (start - self.mem_base) % page_size
+        gen = self.mem_gen + 1
+        changed = 0
+        for address in range(start, end, self.mem_page_scan_chunk):
+            size = min(self.mem_page_scan_chunk, mem_end - address, end - address + page_size - 1)
+            size -= size % page_size
+            if size <= 0:
+                break
+            data = self.api_pmem_view(address, size)
+            if data is None:
+                data = self.api_read_bytes_from(address, size)
+                if data is None:
+                    return None
+            digest = self.api_mem_page_digest(data)
+            first = (address - self.mem_base) >> self.mem_page_bits
+            count = len(digest)
+            if np is not None and not isinstance(digest, array):
+                old = np.frombuffer(self.mem_page_hash, dtype=np.uint64)[first:first+count]
+                valid = np.frombuffer(self.mem_page_valid, dtype=np.uint8)[first:first+count]
+                pages = (np.nonzero((old != digest) & (valid != 0))[0] + first).tolist()
+                old[:] = digest
+                valid[:] = 1
+            else:
+                old = self.mem_page_hash
+                valid = self.mem_page_valid
+                pages = [first + i for i in range(count) if valid[first + i] and old[first + i] != digest[i]]
+                old[first:first+count] = digest
+                valid[first:first+count] = b"\x01"*count
+            for page in pages:
+                self.mem_page_gen[page] = gen
+            changed += len(pages)
+        if changed > 0:
+            self.mem_gen = gen
+        return self.mem_gen
+
+    def api_mem_dirty_pages(self, since=None, start=None, end=None):
+        """Find the pages changed since a token
+
+        Args:
+            since (int): Token returned by a previous call (or api_mem_page_scan), default is the last call's token
+            start (int): Start address, default is mem base
+            end (int): End address, default is mem base + mem size
+        Returns:
+            (token, pages): new token and the sorted start addresses of the changed pages
+        """
+        if since is None:
+            since = self.mem_last_token
+        token = self.api_mem_page_scan(start, end)
+        if token is None:
+            return None, []
+        self.mem_last_token = token
+        if since is None:
+            info("page-hash index built, use it as the baseline")
+            return token, []
+        lo = self.mem_base if start is None else start
+        hi = self.mem_base + self.mem_size if end is None else end
+        pages = sorted(self.mem_base + (page << self.mem_page_bits) for page, gen in self.mem_page_gen.items() if gen > since)
+        return token, [p for p in pages if p + self.api_mem_page_size() > lo and p < hi]
+
+    def do_xmem_changed(self, arg):
+        """Show the memory pages changed since a token (default: since the last xmem_changed)
+
+        Args:
+            token (int): Token printed by the last xmem_changed
+            start (int): Start address
+            end (int): End address
+        """
+        args = arg.strip().split()
+        try:
+            since = int(args[0], 0) if len(args) > 0 and args[0] != "-" else None
+            start = int(args[1], 0) if len(args) > 1 else None
+            end = int(args[2], 0) if len(args) > 2 else None
+        except Exception as e:
+            error(f"convert {arg} to number fail: {str(e)}")
+            message("usage: xmem_changed [token|-] [start] [end]")
+            return
+        token, pages = self.api_mem_dirty_pages(since, start, end)
+        if token is None:
+            return
+        page_size = self.api_mem_page_size()
+        ranges = []
+        for p in pages:
+            if ranges and ranges[-1][1] == p:
+                ranges[-1][1] = p + page_size
+            else:
+                ranges.append([p, p + page_size])
+        for s, e in ranges[:64]:
+            message(f"  0x{s:x} - 0x{e:x} ({(e - s)//page_size} pages)")
+        if len(ranges) > 64:
+            warn(f"{len(ranges) - 64} more ranges not shown")
+        message(f"{len(pages)} pages changed, token: {token}")
@@ -2,14 +2,21 @@
 
 
 from XSPdb.cmd.util import error, info, message, warn
+from XSPdb.cmd.xcfi import RULE_OFFSET, RULE_VAL_OFFSET, RULE_REGISTER, RULE_UNDEFINED
 import struct
+import ctypes
 
 class CmdMRW:
     """Command class for MRW (Memory Read/Write) operations."""
 
+    def __init__(self):
+        self.mrw_bulk_warned = False
+        self.mrw_page_size = 4096
+        self.mrw_write_batch_depth = 0
+        self.mrw_write_pending = []
 
     def api_write_bytes_with_rw(self, address, bytes, dword_read, dword_write):
-        """Write memory data
+        """Write memory data dword by dword, unchanged dwords are skipped
 
         Args:
             address (int): Target memory address
@@ -24,28 +31,82 @@ class CmdMRW:
             error("mem not inited, please load a bin file")
             return False
         start_offset = address % 8
-        head = dword_read(address - start_offset).to_bytes(8,
-                              byteorder='little', signed=False)[:start_offset]
-        end_address = address + len(bytes)
-        end_offset = end_address % 8
-        tail = dword_read(end_address - end_offset).to_bytes(8,
-                              byteorder='little', signed=False)[end_offset:]
-        data_to_write = head + bytes + tail
-        assert len(data_to_write)%8 == 0
         base_address = address - start_offset
-        for i in range(len(data_to_write)//8):
-            dword_write(base_address + i*8,  int.from_bytes(data_to_write[i*8:i*8+8],
-                                                            byteorder='little', signed=False))
-        info(f"write {len(data_to_write)} bytes to address: 0x{base_address:x} ({len(bytes)} bytes)")
+        dword_count = (start_offset + len(bytes) + 7)//8
+        old_data = b"".join(dword_read(base_address + i*8).to_bytes(8, byteorder='little', signed=False)
+                            for i in range(dword_count))
+        data_to_write = old_data[:start_offset] + bytes + old_data[start_offset + len(bytes):]
+        assert len(data_to_write)%8 == 0
+        write_count = 0
+        for i in range(dword_count):
+            new_dword = data_to_write[i*8:i*8+8]
+            if new_dword == old_data[i*8:i*8+8]:
+                continue
+            dword_write(base_address + i*8, int.from_bytes(new_dword, byteorder='little', signed=False))
+            write_count += 1
+        info(f"write {len(data_to_write)} bytes to address: 0x{base_address:x} ({len(bytes)} bytes, {write_count} dwords changed)")
+        return True
+
+    def api_write_bytes_bulk(self, address, data):
+        """Write physical memory data through the host memory view, unchanged pages are skipped
+
+        Args:
+            address (int): Target memory address
+            data (bytes): Data to write
+        Returns:
+            bool: True if written, None if bulk access is not supported
+        """
+        view = self.api_pmem_view(address, len(data))
+        if view is None:
+            return None
+        data = memoryview(data).cast("B")
+        page_size = self.mrw_page_size
+        write_count = 0
+        offset = 0
+        while offset < len(data):
+            end = min(len(data), offset + page_size - (address + offset) % page_size)
+            new_page = data[offset:end].tobytes()
+            if view[offset:end].tobytes() != new_page:
+                view[offset:end] = new_page
+                write_count += end - offset
+            offset = end
+        info(f"write {len(data)} bytes to address: 0x{address:x} ({write_count} bytes changed)")
         return True
 
+    def api_write_bytes_direct(self, address, bytes):
+        """Write memory data immediately (bypass the write batch)
+
+        Args:
+            address (int): Target memory address
+            bytes (bytes): Data to write
+        """
+        if self.api_is_flash_address(address):
+            ret = self.api_write_bytes_with_rw(address - self.flash_base,
+                                               bytes, self.df.FlashRead, self.df.FlashWrite)
+        else:
+            ret = self.api_write_bytes_bulk(address, bytes)
+            if ret is None:
+                ret = self.api_write_bytes_with_rw(address,
+                                                   bytes, self.df.pmem_read, self.df.pmem_write)
+        if ret:
+            self.api_mem_mark_dirty(address, address + len(bytes))
+            # Delete asm data in cache
+            self.api_info_cache_invalidate(address, address + len(bytes))
+        return ret
+
     def api_write_bytes(self, address, bytes):
-        """Write memory data
+        """Write memory data (queued if a write batch is active)
 
         Args:
             address (int): Target memory address
             bytes (bytes): Data to write
         """
+        if len(bytes) < 1:
+            error("write data length < 1")
+            return False
+        if not self.mem_inited:
+            error("mem not inited, please load a bin file")
+            return False
         if self.api_is_flash_address(address):
             real_address = address - self.flash_base
             if real_address < 0:
@@ -54,19 +115,54 @@ class CmdMRW:
             if real_address > 0x7FFFFFFF:
                 warn(f"write address {hex(address)} is not in Flash range, bigger than {hex(self.flash_base+ 0x7FFFFFFF)} (max uint32 0x7FFFFFFF) ignored")
                 return False
-            ret = self.api_write_bytes_with_rw(real_address,
-                                                bytes, self.df.FlashRead, self.df.FlashWrite)
-        else:
-            ret = self.api_write_bytes_with_rw(address,
-                                                bytes, self.df.pmem_read, self.df.pmem_write)
-        if ret:
-            # Delete asm data in cache
-            pos_str = address - address % self.info_cache_bsz
-            pos_end = address + len(bytes)
-            pos_end = (pos_end - pos_end % self.info_cache_bsz) + self.info_cache_bsz
-            for cache_index in range(pos_str, pos_end, self.info_cache_bsz):
-                if cache_index in self.info_cache_asm:
-                    del self.info_cache_asm[cache_index]
+        elif address < self.mem_base or address + len(bytes) > self.mem_base + self.mem_size:
+            warn(f"write address {hex(address)} - {hex(address + len(bytes))} is not in memory range "
+                 f"{hex(self.mem_base)} - {hex(self.mem_base + self.mem_size)} ignored")
+            return False
+        if self.mrw_write_batch_depth > 0:
+            self.mrw_write_pending.append((address, bytearray(bytes)))
+            return True
+        return self.api_write_bytes_direct(address, bytes)
+
+    def api_mem_write_batch_begin(self):
+        """Begin a write batch, writes are queued and merged until the batch ends"""
+        self.mrw_write_batch_depth += 1
+
+    def api_mem_write_batch_end(self):
+        """End a write batch, flush the queued writes when the outermost batch ends"""
+        self.mrw_write_batch_depth = max(0, self.mrw_write_batch_depth - 1)
+        if self.mrw_write_batch_depth == 0:
+            return self.api_mem_write_flush()
+        return True
+
+    def api_mem_write_flush(self):
+        """Merge adjacent or overlapping queued writes and write them with one transfer each
+
+        Returns:
+            bool: True if all writes success
+        """
+        pending = self.mrw_write_pending
+        if not pending:
+            return True
+        self.mrw_write_pending = []
+        merged = []
+        for seq, (address, data) in sorted(enumerate(pending), key=lambda x: x[1][0]):
+            end = address + len(data)
+            if merged and address <= merged[-1][1] and \
+               self.api_is_flash_address(address) == self.api_is_flash_address(merged[-1][0]):
+                merged[-1][1] = max(merged[-1][1], end)
+                merged[-1][2].append((seq, address, data))
+            else:
+                merged.append([address, end, [(seq, address, data)]])
+        ret = True
+        for start, end, writes in merged:
+            buffer = bytearray(end - start)
+            # Apply in issue order, later writes win on overlap
+            for _, address, data in sorted(writes, key=lambda x: x[0]):
+                buffer[address - start: address - start + len(data)] = data
+            ret = bool(self.api_write_bytes_direct(start, buffer)) and ret
+        if len(merged) < len(pending):
+            info(f"merge {len(pending)} writes into {len(merged)} transfers")
         return ret
 
     def do_xmem_write(self, arg):
@@ -97,7 +193,7 @@ class CmdMRW:
             error(f"convert {args[0]} or {args[1]} to number/bytes fail: {str(e)}")
 
     def api_read_bytes_with_func(self, address, size, read_func):
-        """Read memory data
+        """Read memory data dword by dword (fallback for difftest without bulk memory access)
 
         Args:
             address (int): Memory address
@@ -106,15 +202,70 @@ class CmdMRW:
         Return:
             bytes
         """
-        read_data = bytearray()
-        read_count = size//8 + 1
         start_address = address - address % 8
         start_offset  = address - start_address
-        for index in range(read_count):
-            padd = start_address + 8*index
-            read_data += read_func(padd).to_bytes(8, byteorder='little', signed=False)
+        read_count = (start_offset + size + 7)//8
+        read_data = bytearray(b"".join(read_func(start_address + 8*index).to_bytes(8, byteorder='little', signed=False)
+                                       for index in range(read_count)))
         return read_data[start_offset: start_offset + size]
 
+    def api_pmem_host_address(self, address, size):
+        """Get the host address of a physical memory range
+
+        Args:
+            address (int): Memory address
+            size (int): Size of the range
+        Return:
+            int: host address, None if bulk access is not supported or the range is out of memory
+        """
+        if not self.mem_inited or size < 0:
+            return None
+        if not hasattr(self.df, "get_img_start"):
+            if not self.mrw_bulk_warned:
+                warn("difftest.get_img_start not found, memory access falls back to pmem_read (slow), update your difftest")
+                self.mrw_bulk_warned = True
+            return None
+        if hasattr(self.df, "Get_PMEM_BASE"):
+            pmem_base = self.df.Get_PMEM_BASE()
+        else:
+            pmem_base = self.mem_base
+        offset = address - pmem_base
+        if offset < 0 or offset + size > self.mem_size:
+            return None
+        host_base = self.df.get_img_start()
+        host_base = int(getattr(host_base, "this", host_base)) if host_base else 0
+        if not host_base:
+            return None
+        return host_base + offset
+
+    def api_pmem_view(self, address, size):
+        """Get a zero-copy view of physical memory
+
+        Args:
+            address (int): Memory address
+            size (int): Size of the view
+        Return:
+            memoryview: view of the memory (valid until memory is re-inited), None if not supported
+        """
+        host_address = self.api_pmem_host_address(address, size)
+        if host_address is None:
+            return None
+        return memoryview((ctypes.c_ubyte * size).from_address(host_address)).cast("B")
+
+    def api_read_bytes_bulk(self, address, size):
+        """Read physical memory data with one bulk copy
+
+        Args:
+            address (int): Memory address
+            size (int): Size of data to read
+        Return:
+            bytearray: data, None if bulk access is not supported
+        """
+        view = self.api_pmem_view(address, size)
+        if view is None:
+            return None
+        return bytearray(view)
+
     def api_read_bytes_from(self, address, size):
         """Read memory data
 
@@ -127,6 +278,8 @@ class CmdMRW:
         if not self.mem_inited:
             error(f"memory is not inited")
             return None
+        if self.mrw_write_pending:
+            self.api_mem_write_flush()
         end_address = address + size
         if ((self.api_is_flash_address(address) and not self.api_is_flash_address(end_address))) or \
            (not self.api_is_flash_address(address) and self.api_is_flash_address(end_address)):
@@ -136,8 +289,10 @@ class CmdMRW:
             def _flash_read(addr):
                 return self.df.FlashRead(max(0, addr - self.flash_base))
             return self.api_read_bytes_with_func(address, size, _flash_read)
-        else:
-            return self.api_read_bytes_with_func(address, size, self.df.pmem_read)
+        data = self.api_read_bytes_bulk(address, size)
+        if data is not None:
+            return data
+        return self.api_read_bytes_with_func(address, size, self.df.pmem_read)
 
     def do_xmem_copy(self, arg):
         """copy memory data from one address to another
@@ -257,33 +412,79 @@ class CmdMRW:
         except Exception as e:
             error(f"convert {args[0]} or {args[1]} to number fail: {str(e)}")
 
-    def api_get_call_stack(self, sp, pc, max_depth=10):
-        """[FIXME: this implementation is incorrect] Get call stack from address
+    def api_get_call_stack(self, sp, pc, max_depth=10, regs=None):
+        """Get call stack from address
+
+        Frames are unwound with the call frame information (.eh_frame/.debug_frame) of the loaded ELF,
+        functions without it are unwound through the frame pointer (s0 points to the CFA, ra and
+        the previous s0 are saved below it).
 
         Args:
             sp (int): Stack pointer address
             pc (int): Program counter address
             max_depth (int): Maximum depth of call stack
+            regs (list): Values of x0-x31, default is the current integer registers of the DUT
         Returns:
             list: List of call stack addresses
         """
         callstack = [(-1, pc, sp, self.api_address_to_symbol(pc))]
         if not self.mem_inited:
             return None
+        if regs is None:
+            regs = [self.xsp.GetFromU64Array(self.difftest_stat.regs_int.value, i) for i in range(32)]
+        regs = list(regs)
+        regs[2] = sp
+        cfi = self.api_get_elf_cfi_table()
         for depth in range(max_depth):
             try:
-                sp_bytes = self.api_read_bytes_from(sp, 8)
-                ra_bytes = self.api_read_bytes_from(sp + 8, 8)
-                if (sp_bytes is None or ra_bytes is None) or (len(sp_bytes) != 8 or len(ra_bytes) != 8):
-                    error("  [!] Failed to read memory at 0x{:x} or 0x{:x}".format(sp, sp + 8))
-                    break
-                next_sp = struct.unpack("<Q", sp_bytes)[0]
-                ra_val = struct.unpack("<Q", ra_bytes)[0]
-                if ra_val == 0 or ra_val == pc or next_sp == 0 or next_sp == sp:
+                # The return address points after the call, look up the call instruction itself
+                rule = cfi.lookup(pc if depth == 0 else pc - 1) if cfi else None
+                if rule is not None:
+                    (cfa_reg, cfa_off, saved), ra_reg = rule
+                    if cfa_reg is None or cfa_reg >= len(regs):
+                        break
+                    cfa = (regs[cfa_reg] + cfa_off) & 0xffffffffffffffff
+                    offsets = [v for _, kind, v in saved if kind == RULE_OFFSET]
+                    frame = b""
+                    if offsets:
+                        # All saved registers of a frame come from one read
+                        lo, hi = min(offsets), max(offsets) + 8
+                        frame = self.api_read_bytes_from(cfa + lo, hi - lo)
+                        if frame is None or len(frame) != hi - lo:
+                            error("  [!] Failed to read memory at 0x{:x}".format(cfa + lo))
+                            break
+                    next_regs = list(regs)
+                    for reg, kind, v in saved:
+                        if reg >= len(regs):
+                            continue
+                        if kind == RULE_OFFSET:
+                            next_regs[reg] = struct.unpack_from("<Q", frame, v - lo)[0]
+                        elif kind == RULE_VAL_OFFSET:
+                            next_regs[reg] = cfa + v
+                        elif kind == RULE_REGISTER and v < len(regs):
+                            next_regs[reg] = regs[v]
+                        elif kind == RULE_UNDEFINED and reg == ra_reg:
+                            next_regs[reg] = 0
+                    ra_val = next_regs[ra_reg] if ra_reg < len(regs) else 0
+                    next_sp = cfa
+                else:
+                    fp = regs[8]
+                    if fp <= regs[2] or fp % 8 != 0:
+                        break
+                    data = self.api_read_bytes_from(fp - 16, 16)
+                    if data is None or len(data) != 16:
+                        error("  [!] Failed to read memory at 0x{:x}".format(fp - 16))
+                        break
+                    prev_fp, ra_val = struct.unpack("<QQ", data)
+                    next_regs = list(regs)
+                    next_regs[8] = prev_fp
+                    next_sp = fp
+                if ra_val == 0 or (ra_val == pc and next_sp == regs[2]):
                     break
+                next_regs[2] = next_sp
                 callstack.append((depth, ra_val, next_sp, self.api_address_to_symbol(ra_val)))
                 pc = ra_val
-                sp = next_sp
+                regs = next_regs
             except Exception as e:
                 error(f"  [!] Exception: {e}")
                 break
@@ -332,9 +533,12 @@ class CmdMRW:
                 error("get call stack fail")
                 return
             _, pc, sp, name = callstack[0]
-            message(f"Backtrace from (pc: {hex(pc)}, sp: {hex(sp)}) location: {name}")
+            source = self.api_address_to_line(pc)
+            message(f"Backtrace from (pc: {hex(pc)}, sp: {hex(sp)}) location: {name}" + (f" {source}" if source else ""))
             message("Call Stack:")
             for depth, ra, sp, name in callstack[1:]:
-                message(f"> depth {depth}: ra: {hex(ra)}, sp: {hex(sp)}, at: {name}")
+                # ra is after the call, look up the call instruction
+                source = self.api_address_to_line(ra - 2)
+                message(f"> depth {depth}: ra: {hex(ra)}, sp: {hex(sp)}, at: {name}" + (f" {source}" if source else ""))
         except Exception as e:
             error(f"convert args{arg} to pc or sp number fail: {str(e)}")
@@ -0,0 +1,227 @@
+#coding=utf-8
+
+import os
+from array import array
+from XSPdb.cmd.util import info, error, message
+from XSPdb.cmd.xelf import ElfFile, is_elf_file
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class PCHistogram:
+    """Sample counts of PCs in a text range (2-byte granularity)
+
+    Samples are buffered in an array and folded into the histogram in batches, PCs outside the
+    text range are counted apart. The counts are a dense array for ranges up to max_dense
+    slots, a dict of the sampled PCs for larger ranges (e.g. no image, or text in Flash and DRAM).
+    """
+
+    def __init__(self, start, end, buffer_size=4096, max_dense=1 << 24):
+        self.start = start
+        self.end = max(end, start + 2)
+        self.buffer = array('Q')
+        self.buffer_size = buffer_size
+        self.outside = 0
+        self.total = 0
+        self.dense = np is not None and (self.end - self.start + 1)//2 <= max_dense
+        if self.dense:
+            self.counts = np.zeros((self.end - self.start + 1)//2, dtype=np.uint64)
+        else:
+            self.counts = {}
+
+    def add(self, pc):
+        self.buffer.append(pc)
+        if len(self.buffer) >= self.buffer_size:
+            self.fold()
+
+    def fold(self):
+        """Fold the buffered samples into the histogram"""
+        if not self.buffer:
+            return
+        self.total += len(self.buffer)
+        if np is not None:
+            pcs = np.frombuffer(self.buffer, dtype=np.uint64)
+            inside = (pcs >= self.start) & (pcs < self.end)
+            self.outside += int(len(pcs) - np.count_nonzero(inside))
+            if self.dense:
+                index = ((pcs[inside] - np.uint64(self.start)) >> np.uint64(1)).astype(np.int64)
+                self.counts += np.bincount(index, minlength=len(self.counts)).astype(np.uint64)
+            else:
+                for pc, c in zip(*np.unique(pcs[inside] & ~np.uint64(1), return_counts=True)):
+                    self.counts[int(pc)] = self.counts.get(int(pc), 0) + int(c)
+        else:
+            for pc in self.buffer:
+                if self.start <= pc < self.end:
+                    self.counts[pc & ~1] = self.counts.get(pc & ~1, 0) + 1
+                else:
+                    self.outside += 1
+        self.buffer = array('Q')
+
+    def samples(self):
+        """Get the sampled PCs and their counts
+
+        Returns:
+            (pcs, counts): PCs with at least one sample and the number of samples of each
+        """
+        self.fold()
+        if self.dense:
+            index = np.nonzero(self.counts)[0]
+            return (index.astype(np.uint64)*np.uint64(2) + np.uint64(self.start)), self.counts[index]
+        pcs = sorted(self.counts)
+        return pcs, [self.counts[pc] for pc in pcs]
+
+
+class CmdProfile:
+    """Statistical PC sampling profiler
+
+    The max commit PC is sampled every N cycles by the step loop (a cycle counter compare per
+    stepped batch, the batch is shortened to N cycles), the samples are aggregated into a
+    histogram over the text range of the loaded image and reported per symbol.
+    """
+
+    def __init__(self):
+        assert hasattr(self, "dut"), "this class must be used in XSPdb, canot be used alone"
+        self.profile = None
+        self.profile_period = 0
+        self.profile_running = False
+        self.profile_next = 0
+        self.profile_last_pc = 0
+        self.profile_commits = []
+
+    def api_profile_text_range(self):
+        """Get the address range to profile: the executable sections of an ELF image, the bin file otherwise"""
+        if self.exec_bin_file and is_elf_file(self.exec_bin_file):
+            elf = ElfFile(self.exec_bin_file)
+            sections = elf.exec_sections()
+            if sections:
+                return min(sec.addr for sec in sections), max(sec.addr + sec.size for sec in sections)
+        size = os.path.getsize(self.exec_bin_file) if self.exec_bin_file and os.path.isfile(self.exec_bin_file) else self.mem_size
+        return self.mem_base, self.mem_base + min(size, self.mem_size)
+
+    def api_profile_start(self, period):
+        """Start sampling the max commit PC every period cycles
+
+        Args:
+            period (int): Sample period in cycles
+        """
+        if period <= 0:
+            error("sample period need > 0")
+            return False
+        start, end = self.api_profile_text_range()
+        self.profile = PCHistogram(start, end)
+        self.profile_period = period
+        self.profile_running = True
+        self.profile_next = self.dut.xclock.clk + period
+        self.profile_commits = [self.difftest_stat.get_commit(i) for i in range(len(self.api_commit_pc_list()))]
+        self.profile_last_pc = max((c.pc for c in self.profile_commits if c.valid), default=0)
+        info(f"profile 0x{start:x} - 0x{end:x} every {period} cycles")
+        return True
+
+    def api_profile_stop(self):
+        """Stop sampling (the samples are kept for the report)"""
+        if self.profile is None:
+            return
+        self.profile.fold()
+        self.profile_running = False
+
+    def api_profile_sample(self):
+        """Take the samples due at the current cycle (called by the step loop)"""
+        clk = self.dut.xclock.clk
+        if clk < self.profile_next:
+            return
+        # Stale slots keep the PC of an old commit, only the valid ones are current;
+        # with no commit in this cycle the core is still at the last sampled PC
+        pc = max((c.pc for c in self.profile_commits if c.valid), default=self.profile_last_pc)
+        self.profile_last_pc = pc
+        # A batch longer than the period counts once per period it covers
+        n = (clk - self.profile_next)//self.profile_period + 1
+        for _ in range(n):
+            self.profile.add(pc)
+        self.profile_next += n*self.profile_period
+
+    def api_profile_report(self, top=30):
+        """Get the flat profile per symbol
+
+        Args:
+            top (int): Max number of lines, 0 for all
+        Returns:
+            list((samples, percent, name)): Sorted by samples
+        """
+        if self.profile is None:
+            return []
+        pcs, counts = self.profile.samples()
+        total = self.profile.total
+        if total == 0:
+            return []
+        by_name = {}
+        if self.api_elf_symbols_loaded() and len(pcs) > 0:
+            for u, c in zip(self.api_addresses_to_symbols(pcs), counts):
+                name = self.api_symbol_interval_info(int(u))[0] if u >= 0 else "??"
+                by_name[name] = by_name.get(name, 0) + int(c)
+        else:
+            for pc, c in zip(pcs, counts):
+                by_name[f"0x{int(pc):x}"] = int(c)
+        if self.profile.outside:
+            by_name["<outside text>"] = self.profile.outside
+        report = sorted(((c, 100.0*c/total, name) for name, c in by_name.items()), reverse=True)
+        return report[:top] if top > 0 else report
+
+    def api_profile_write_report(self, report_file, top=0):
+        """Write the flat profile to a file
+
+        Args:
+            report_file (string): Path to the report file
+            top (int): Max number of lines, 0 for all
+        """
+        report = self.api_profile_report(top)
+        with open(report_file, "w") as f:
+            f.write(f"# samples: {self.profile.total if self.profile else 0}, period: {self.profile_period} cycles\n")
+            for c, p, name in report:
+                f.write(f"{p:7.2f}% {c:10d}  {name}\n")
+        info(f"write profile report ({len(report)} symbols) to {report_file}")
+
+    def do_xprofile(self, arg):
+        """Statistical PC sampling profiler
+
+        Args:
+            start <N> (string): Sample the max commit PC every N cycles
+            stop (string): Stop sampling
+            report [file] [top] (string): Show (or write to file) the flat profile per symbol
+        """
+        args = arg.strip().split()
+        usage = "usage: xprofile [start <every N cycles>|stop|report [file] [top]]"
+        try:
+            if not args:
+                if self.profile is None:
+                    message("profile is off")
+                else:
+                    self.profile.fold()
+                    message(f"profile is {'on' if self.profile_running else 'stopped'}, {self.profile.total} samples")
+                message(usage)
+            elif args[0] == "start" and len(args) > 1:
+                self.api_profile_start(int(args[1], 0))
+            elif args[0] == "stop":
+                self.api_profile_stop()
+            elif args[0] == "report":
+                rest = args[1:]
+                top = int(rest.pop(), 0) if rest and rest[-1].isdigit() else 30
+                if rest:
+                    self.api_profile_write_report(rest[0], 0)
+                    return
+                report = self.api_profile_report(top)
+                if not report:
+                    message("no samples")
+                for c, p, name in report:
+                    message(f"{p:7.2f}% {c:10d}  {name}")
+            else:
+                message(usage)
+        except ValueError as e:
+            error(f"{str(e)}\n{usage}")
+
+    def complete_xprofile(self, text, line, begidx, endidx):
+        if line[:begidx].split()[1:2] == ["report"]:
+            return self.api_complite_localfile(text)
+        return [x for x in ["start", "stop", "report"] if x.startswith(text)]
@@ -13,27 +13,24 @@ class CmdTrap:
 
     def api_init_good_trap(self):
         """Initialize the good trap"""
-        checker = self.condition_good_trap.get("checker")
-        if checker:
+        if "good_trap" in self.cond_registry:
             return
         if hasattr(self.difftest_stat.trap, "get_code_address"):
-            checker = self.xsp.ComUseCondCheck(self.dut.xclock)
             target_trap_vali = self.xsp.ComUseDataArray(1)
             target_trap_code = self.xsp.ComUseDataArray(8)
             target_trap_vali.FromBytes(int(0).to_bytes(1, byteorder='little', signed=False))
             target_trap_code.FromBytes(int(0).to_bytes(8, byteorder='little', signed=False)) #FIXME: is the good trap code zero ?
             source_trap_code = self.xsp.ComUseDataArray(self.difftest_stat.trap.get_code_address(), 8)
             source_trap_vali = self.xsp.ComUseDataArray(self.difftest_stat.trap.get_hasTrap_address(), 1)
-            checker.SetCondition("good_trap", source_trap_code.BaseAddr(), target_trap_code.BaseAddr(), self.xsp.ComUseCondCmp_EQ, 8,
-                                 source_trap_vali.BaseAddr(), target_trap_vali.BaseAddr(), 1)
-            checker.SetValidCmpMode("good_trap", self.xsp.ComUseCondCmp_NE)
+            self.cond_registry.add("good_trap", "good_trap",
+                                   source_trap_code.BaseAddr(), target_trap_code.BaseAddr(), self.xsp.ComUseCondCmp_EQ, 8,
+                                   source_trap_vali.BaseAddr(), target_trap_vali.BaseAddr(), 1,
+                                   keep=(target_trap_vali, target_trap_code, source_trap_code, source_trap_vali))
+            self.cond_registry.checker.SetValidCmpMode("good_trap", self.xsp.ComUseCondCmp_NE)
         else:
             warn("trap.get_code_address not found, please build the latest difftest-python")
             return
-        trap_key = "good_trap"
-        self.dut.xclock.RemoveStepRisCbByDesc(trap_key)
-        self.dut.xclock.StepRis(checker.GetCb(), checker.CSelf(), trap_key)
-        self.condition_good_trap["checker"] = checker
+        self.condition_good_trap["checker"] = self.cond_registry.checker
 
     def api_disable_good_trap(self, disable):
         """disable good trap
@@ -41,9 +38,7 @@ class CmdTrap:
             disable (bool): Whether to disable good trap
         """
         if disable:
-            checker = self.condition_good_trap.get("checker")
-            if checker:
-                self.dut.xclock.RemoveStepRisCbByDesc("good_trap")
+            if self.cond_registry.remove("good_trap"):
                 self.condition_good_trap.clear()
         else:
             self.api_init_good_trap()
@@ -78,27 +73,58 @@ class CmdTrap:
                     return True
         return False
 
+    def api_break_on_good_loop(self, on):
+        """Stop the clock natively when a commit is the good loop (j .)
+
+        Needs the instr/valid addresses of the commits (get_instr_address, get_valid_address),
+        otherwise the good loop is only found by api_is_hit_good_loop after a step.
+
+        Args:
+            on (bool): Whether to break on the good loop
+        Returns:
+            bool: True if the native condition is available
+        """
+        if not on:
+            self.cond_registry.remove_group("good_loop")
+            return True
+        cmt = self.difftest_stat.get_commit(0)
+        if not (hasattr(cmt, "get_instr_address") and hasattr(cmt, "get_valid_address")):
+            return False
+        if self.cond_registry.has_group("good_loop"):
+            return True
+        target_instr = self.xsp.ComUseDataArray(4)
+        target_instr.FromBytes(int(0x6f).to_bytes(4, byteorder='little', signed=False))
+        target_valid = self.xsp.ComUseDataArray(1)
+        target_valid.SetZero()
+        for i in range(8):
+            cmt = self.difftest_stat.get_commit(i)
+            source_instr = self.xsp.ComUseDataArray(cmt.get_instr_address(), 4)
+            source_valid = self.xsp.ComUseDataArray(cmt.get_valid_address(), 1)
+            key = "good_loop_%d" % i
+            self.cond_registry.add(key, "good_loop", source_instr.BaseAddr(), target_instr.BaseAddr(), self.xsp.ComUseCondCmp_EQ, 4,
+                                   source_valid.BaseAddr(), target_valid.BaseAddr(), 1,
+                                   keep=(source_instr, source_valid, target_instr, target_valid))
+            self.cond_registry.checker.SetValidCmpMode(key, self.xsp.ComUseCondCmp_NE)
+        return True
+
     def api_break_on_trap(self, on):
         """Set breakpoint on trap
 
         Args:
             on (bool): Whether to set breakpoint on trap
         """
-        check = self.break_on_trap.get("checker")
-        if not check:
-            check = self.xsp.ComUseCondCheck(self.dut.xclock)
-            target_trap_vali = self.xsp.ComUseDataArray(1)
-            target_trap_vali.SetZero()
-            source_trap_vali = self.xsp.ComUseDataArray(self.difftest_stat.trap.get_hasTrap_address(), 1)
-            check.SetCondition("break_on_trap", source_trap_vali.BaseAddr(), target_trap_vali.BaseAddr(), self.xsp.ComUseCondCmp_EQ, 1)
-            self.break_on_trap["checker"] = check
         trap_key = "break_on_trap"
         self.break_on_trap["on"] = on
         if on:
-            self.dut.xclock.RemoveStepRisCbByDesc(trap_key)
-            self.dut.xclock.StepRis(check.GetCb(), check.CSelf(), trap_key)
+            if trap_key in self.cond_registry:
+                return
+            target_trap_vali = self.xsp.ComUseDataArray(1)
+            target_trap_vali.SetZero()
+            source_trap_vali = self.xsp.ComUseDataArray(self.difftest_stat.trap.get_hasTrap_address(), 1)
+            self.cond_registry.add(trap_key, trap_key, source_trap_vali.BaseAddr(), target_trap_vali.BaseAddr(), self.xsp.ComUseCondCmp_EQ, 1,
+                                   keep=(target_trap_vali, source_trap_vali))
         else:
-            self.dut.xclock.RemoveStepRisCbByDesc(trap_key)
+            self.cond_registry.remove(trap_key)
 
     def api_is_trap_break_on(self):
         """Check if the trap is break on
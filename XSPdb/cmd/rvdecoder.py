@@ -0,0 +1,473 @@
+#coding=utf-8
+"""Table-driven RISC-V disassembler (RV64GC + Zicsr/Zifencei + Zba/Zbb/Zbs)
+
+Every instruction is an entry (name, mask, match, format) checked in table order,
+the tables are indexed by opcode (32-bit) or by quadrant/funct3 (16-bit).
+PC-relative targets are printed as "pc + offset", so a result only depends on
+the instruction word and can be cached.
+"""
+
+from functools import lru_cache
+
+IREG_NAMES = ["zero", "ra", "sp", "gp",  "tp", "t0", "t1", "t2",
+              "s0",   "s1", "a0", "a1",  "a2", "a3", "a4", "a5",
+              "a6",   "a7", "s2", "s3",  "s4", "s5", "s6", "s7",
+              "s8",   "s9", "s10","s11", "t3", "t4", "t5", "t6"]
+
+FREG_NAMES = ["ft0", "ft1", "ft2",  "ft3", "ft4", "ft5", "ft6",  "ft7",
+              "fs0", "fs1", "fa0",  "fa1", "fa2", "fa3", "fa4",  "fa5",
+              "fa6", "fa7", "fs2",  "fs3", "fs4", "fs5", "fs6",  "fs7",
+              "fs8", "fs9", "fs10", "fs11","ft8", "ft9", "ft10", "ft11"]
+
+CSR_NAMES = {
+    0x001: "fflags", 0x002: "frm", 0x003: "fcsr",
+    0x100: "sstatus", 0x104: "sie", 0x105: "stvec", 0x106: "scounteren", 0x10a: "senvcfg",
+    0x140: "sscratch", 0x141: "sepc", 0x142: "scause", 0x143: "stval", 0x144: "sip", 0x180: "satp",
+    0x300: "mstatus", 0x301: "misa", 0x302: "medeleg", 0x303: "mideleg", 0x304: "mie",
+    0x305: "mtvec", 0x306: "mcounteren", 0x30a: "menvcfg", 0x320: "mcountinhibit",
+    0x340: "mscratch", 0x341: "mepc", 0x342: "mcause", 0x343: "mtval", 0x344: "mip",
+    0x3a0: "pmpcfg0", 0x3a2: "pmpcfg2", 0x3b0: "pmpaddr0",
+    0x7a0: "tselect", 0x7a1: "tdata1", 0x7a2: "tdata2",
+    0x7b0: "dcsr", 0x7b1: "dpc", 0x7b2: "dscratch0", 0x7b3: "dscratch1",
+    0xb00: "mcycle", 0xb02: "minstret", 0xc00: "cycle", 0xc01: "time", 0xc02: "instret",
+    0xf11: "mvendorid", 0xf12: "marchid", 0xf13: "mimpid", 0xf14: "mhartid",
+}
+
+ROUND_MODES = ["rne", "rtz", "rdn", "rup", "rmm", "rm5", "rm6", "dyn"]
+
+FP_OPCODES = (0x43, 0x47, 0x4b, 0x4f, 0x53)
+
+# Format of 32-bit entries -> instruction type of api_decode_instr32
+FORMAT_TYPES = {
+    "R": "R", "UN": "R", "SFENCE": "R", "AMO": "R", "LR": "R",
+    "FR": "R", "FUN": "R", "FCMP": "R", "F2I": "R", "I2F": "R", "FR4": "R4",
+    "I": "I", "SH": "I", "SHW": "I", "LD": "I", "JALR": "I", "CSR": "I", "CSRI": "I",
+    "NONE": "I", "FENCE": "I", "FLD": "I",
+    "ST": "S", "FST": "S", "BR": "B", "U": "U", "JAL": "J",
+}
+
+
+def _bits(value, hi, lo):
+    return (value >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+
+def _sext(value, bits):
+    return value - (1 << bits) if (value >> (bits - 1)) & 1 else value
+
+
+def _target(offset):
+    return "pc + %d" % offset if offset >= 0 else "pc - %d" % -offset
+
+
+def _op(name, fmt, opcode, f3=None, f7=None, rs2=None, f6=None, f5=None, f12=None, rs1=None, rd=None, fp_fmt=None):
+    """Build a 32-bit table entry: (name, mask, match, format, has_rm)"""
+    mask, match = 0x7f, opcode
+    for value, lo, width in ((f3, 12, 3), (f7, 25, 7), (rs2, 20, 5), (f6, 26, 6), (f5, 27, 5),
+                             (f12, 20, 12), (rs1, 15, 5), (rd, 7, 5), (fp_fmt, 25, 2)):
+        if value is not None:
+            mask |= ((1 << width) - 1) << lo
+            match |= value << lo
+    return (name, mask, match, fmt, opcode in FP_OPCODES and f3 is None)
+
+
+def _build_table32():
+    t = [
+        _op("lui", "U", 0x37), _op("auipc", "U", 0x17), _op("jal", "JAL", 0x6f), _op("jalr", "JALR", 0x67, f3=0),
+        _op("fence", "FENCE", 0x0f, f3=0), _op("fence.i", "NONE", 0x0f, f3=1),
+        _op("ecall", "NONE", 0x73, f3=0, f12=0x000, rs1=0, rd=0), _op("ebreak", "NONE", 0x73, f3=0, f12=0x001, rs1=0, rd=0),
+        _op("sret", "NONE", 0x73, f3=0, f12=0x102, rs1=0, rd=0), _op("mret", "NONE", 0x73, f3=0, f12=0x302, rs1=0, rd=0),
+        _op("dret", "NONE", 0x73, f3=0, f12=0x7b2, rs1=0, rd=0), _op("wfi", "NONE", 0x73, f3=0, f12=0x105, rs1=0, rd=0),
+        _op("sfence.vma", "SFENCE", 0x73, f3=0, f7=0x09, rd=0),
+        # Zbb/Zbs immediate forms before the generic shifts
+        _op("clz", "UN", 0x13, f3=1, f12=0x600), _op("ctz", "UN", 0x13, f3=1, f12=0x601),
+        _op("cpop", "UN", 0x13, f3=1, f12=0x602), _op("sext.b", "UN", 0x13, f3=1, f12=0x604),
+        _op("sext.h", "UN", 0x13, f3=1, f12=0x605), _op("orc.b", "UN", 0x13, f3=5, f12=0x287),
+        _op("rev8", "UN", 0x13, f3=5, f12=0x6b8),
+        _op("slli", "SH", 0x13, f3=1, f6=0x00), _op("srli", "SH", 0x13, f3=5, f6=0x00), _op("srai", "SH", 0x13, f3=5, f6=0x10),
+        _op("rori", "SH", 0x13, f3=5, f6=0x18), _op("bclri", "SH", 0x13, f3=1, f6=0x12), _op("bexti", "SH", 0x13, f3=5, f6=0x12),
+        _op("binvi", "SH", 0x13, f3=1, f6=0x1a), _op("bseti", "SH", 0x13, f3=1, f6=0x0a),
+        _op("addiw", "I", 0x1b, f3=0), _op("clzw", "UN", 0x1b, f3=1, f12=0x600), _op("ctzw", "UN", 0x1b, f3=1, f12=0x601),
+        _op("cpopw", "UN", 0x1b, f3=1, f12=0x602), _op("slliw", "SHW", 0x1b, f3=1, f7=0x00), _op("srliw", "SHW", 0x1b, f3=5, f7=0x00),
+        _op("sraiw", "SHW", 0x1b, f3=5, f7=0x20), _op("roriw", "SHW", 0x1b, f3=5, f7=0x30), _op("slli.uw", "SH", 0x1b, f3=1, f6=0x02),
+        _op("zext.h", "UN", 0x3b, f3=4, f7=0x04, rs2=0),
+    ]
+    for name, f3 in (("beq", 0), ("bne", 1), ("blt", 4), ("bge", 5), ("bltu", 6), ("bgeu", 7)):
+        t.append(_op(name, "BR", 0x63, f3=f3))
+    for name, f3 in (("lb", 0), ("lh", 1), ("lw", 2), ("ld", 3), ("lbu", 4), ("lhu", 5), ("lwu", 6)):
+        t.append(_op(name, "LD", 0x03, f3=f3))
+    for name, f3 in (("sb", 0), ("sh", 1), ("sw", 2), ("sd", 3)):
+        t.append(_op(name, "ST", 0x23, f3=f3))
+    for name, f3 in (("addi", 0), ("slti", 2), ("sltiu", 3), ("xori", 4), ("ori", 6), ("andi", 7)):
+        t.append(_op(name, "I", 0x13, f3=f3))
+    for name, f3, f7 in (("add", 0, 0x00), ("sub", 0, 0x20), ("sll", 1, 0x00), ("slt", 2, 0x00), ("sltu", 3, 0x00),
+                         ("xor", 4, 0x00), ("srl", 5, 0x00), ("sra", 5, 0x20), ("or", 6, 0x00), ("and", 7, 0x00),
+                         ("mul", 0, 0x01), ("mulh", 1, 0x01), ("mulhsu", 2, 0x01), ("mulhu", 3, 0x01),
+                         ("div", 4, 0x01), ("divu", 5, 0x01), ("rem", 6, 0x01), ("remu", 7, 0x01),
+                         ("sh1add", 2, 0x10), ("sh2add", 4, 0x10), ("sh3add", 6, 0x10),
+                         ("andn", 7, 0x20), ("orn", 6, 0x20), ("xnor", 4, 0x20), ("max", 6, 0x05), ("maxu", 7, 0x05),
+                         ("min", 4, 0x05), ("minu", 5, 0x05), ("rol", 1, 0x30), ("ror", 5, 0x30),
+                         ("bclr", 1, 0x24), ("bext", 5, 0x24), ("binv", 1, 0x34), ("bset", 1, 0x14)):
+        t.append(_op(name, "R", 0x33, f3=f3, f7=f7))
+    for name, f3, f7 in (("addw", 0, 0x00), ("subw", 0, 0x20), ("sllw", 1, 0x00), ("srlw", 5, 0x00), ("sraw", 5, 0x20),
+                         ("mulw", 0, 0x01), ("divw", 4, 0x01), ("divuw", 5, 0x01), ("remw", 6, 0x01), ("remuw", 7, 0x01),
+                         ("add.uw", 0, 0x04), ("sh1add.uw", 2, 0x10), ("sh2add.uw", 4, 0x10), ("sh3add.uw", 6, 0x10),
+                         ("rolw", 1, 0x30), ("rorw", 5, 0x30)):
+        t.append(_op(name, "R", 0x3b, f3=f3, f7=f7))
+    for name, f3 in (("csrrw", 1), ("csrrs", 2), ("csrrc", 3)):
+        t.append(_op(name, "CSR", 0x73, f3=f3))
+    for name, f3 in (("csrrwi", 5), ("csrrsi", 6), ("csrrci", 7)):
+        t.append(_op(name, "CSRI", 0x73, f3=f3))
+    # A
+    for suffix, f3 in ((".w", 2), (".d", 3)):
+        t.append(_op("lr" + suffix, "LR", 0x2f, f3=f3, f5=0x02, rs2=0))
+        for name, f5 in (("sc", 0x03), ("amoswap", 0x01), ("amoadd", 0x00), ("amoxor", 0x04), ("amoand", 0x0c),
+                         ("amoor", 0x08), ("amomin", 0x10), ("amomax", 0x14), ("amominu", 0x18), ("amomaxu", 0x1c)):
+            t.append(_op(name + suffix, "AMO", 0x2f, f3=f3, f5=f5))
+    # F/D
+    t += [_op("flw", "FLD", 0x07, f3=2), _op("fld", "FLD", 0x07, f3=3),
+          _op("fsw", "FST", 0x27, f3=2), _op("fsd", "FST", 0x27, f3=3)]
+    for s, fmt in ((".s", 0), (".d", 1)):
+        for name, opcode in (("fmadd", 0x43), ("fmsub", 0x47), ("fnmsub", 0x4b), ("fnmadd", 0x4f)):
+            t.append(_op(name + s, "FR4", opcode, fp_fmt=fmt))
+        for name, f7 in (("fadd", 0x00), ("fsub", 0x04), ("fmul", 0x08), ("fdiv", 0x0c)):
+            t.append(_op(name + s, "FR", 0x53, f7=f7 | fmt))
+        t.append(_op("fsqrt" + s, "FUN", 0x53, f7=0x2c | fmt, rs2=0))
+        for name, f7, f3 in (("fsgnj", 0x10, 0), ("fsgnjn", 0x10, 1), ("fsgnjx", 0x10, 2), ("fmin", 0x14, 0), ("fmax", 0x14, 1)):
+            t.append(_op(name + s, "FR", 0x53, f7=f7 | fmt, f3=f3))
+        for name, f3 in (("feq", 2), ("flt", 1), ("fle", 0)):
+            t.append(_op(name + s, "FCMP", 0x53, f7=0x50 | fmt, f3=f3))
+        for i, t_int in enumerate((".w", ".wu", ".l", ".lu")):
+            t.append(_op("fcvt" + t_int + s, "F2I", 0x53, f7=0x60 | fmt, rs2=i))
+            t.append(_op("fcvt" + s + t_int, "I2F", 0x53, f7=0x68 | fmt, rs2=i))
+        t.append(_op("fclass" + s, "F2I", 0x53, f7=0x70 | fmt, f3=1, rs2=0))
+    t += [_op("fmv.x.w", "F2I", 0x53, f7=0x70, f3=0, rs2=0), _op("fmv.x.d", "F2I", 0x53, f7=0x71, f3=0, rs2=0),
+          _op("fmv.w.x", "I2F", 0x53, f7=0x78, f3=0, rs2=0), _op("fmv.d.x", "I2F", 0x53, f7=0x79, f3=0, rs2=0),
+          _op("fcvt.s.d", "FUN", 0x53, f7=0x20, rs2=1), _op("fcvt.d.s", "FUN", 0x53, f7=0x21, rs2=0)]
+    table = {}
+    for entry in t:
+        table.setdefault(entry[2] & 0x7f, []).append(entry)
+    return table
+
+
+def _c(name, fmt, ctype, mask, match):
+    """Build a 16-bit table entry: (name, mask, match, format, type)"""
+    return (name, mask, match, fmt, ctype)
+
+
+def _build_table16():
+    t = [
+        # Quadrant 0
+        _c("c.illegal", "NONE", "CIW", 0xffff, 0x0000), _c("c.addi4spn", "ADDI4SPN", "CIW", 0xe003, 0x0000),
+        _c("c.fld", "FLD", "CL", 0xe003, 0x2000), _c("c.lw", "LW", "CL", 0xe003, 0x4000), _c("c.ld", "LD", "CL", 0xe003, 0x6000),
+        _c("c.fsd", "FSD", "CS", 0xe003, 0xa000), _c("c.sw", "SW", "CS", 0xe003, 0xc000), _c("c.sd", "SD", "CS", 0xe003, 0xe000),
+        # Quadrant 1
+        _c("c.nop", "NONE", "CI", 0xffff, 0x0001), _c("c.addi", "CI", "CI", 0xe003, 0x0001),
+        _c("c.addiw", "CI", "CI", 0xe003, 0x2001), _c("c.li", "CI", "CI", 0xe003, 0x4001),
+        _c("c.addi16sp", "ADDI16SP", "CI", 0xef83, 0x6101), _c("c.lui", "LUI", "CI", 0xe003, 0x6001),
+        _c("c.srli", "CBSH", "CB", 0xec03, 0x8001), _c("c.srai", "CBSH", "CB", 0xec03, 0x8401),
+        _c("c.andi", "CBI", "CB", 0xec03, 0x8801),
+        _c("c.sub", "CA", "CA", 0xfc63, 0x8c01), _c("c.xor", "CA", "CA", 0xfc63, 0x8c21),
+        _c("c.or", "CA", "CA", 0xfc63, 0x8c41), _c("c.and", "CA", "CA", 0xfc63, 0x8c61),
+        _c("c.subw", "CA", "CA", 0xfc63, 0x9c01), _c("c.addw", "CA", "CA", 0xfc63, 0x9c21),
+        _c("c.j", "CJ", "CJ", 0xe003, 0xa001),
+        _c("c.beqz", "CB", "CB", 0xe003, 0xc001), _c("c.bnez", "CB", "CB", 0xe003, 0xe001),
+        # Quadrant 2
+        _c("c.slli", "CISH", "CI", 0xe003, 0x0002), _c("c.fldsp", "FLDSP", "CI", 0xe003, 0x2002),
+        _c("c.lwsp", "LWSP", "CI", 0xe003, 0x4002), _c("c.ldsp", "LDSP", "CI", 0xe003, 0x6002),
+        _c("c.jr", "CR1", "CR", 0xf07f, 0x8002), _c("c.mv", "CR", "CR", 0xf003, 0x8002),
+        _c("c.ebreak", "NONE", "CR", 0xffff, 0x9002), _c("c.jalr", "CR1", "CR", 0xf07f, 0x9002),
+        _c("c.add", "CR", "CR", 0xf003, 0x9002),
+        _c("c.fsdsp", "FSDSP", "CSS", 0xe003, 0xa002), _c("c.swsp", "SWSP", "CSS", 0xe003, 0xc002),
+        _c("c.sdsp", "SDSP", "CSS", 0xe003, 0xe002),
+    ]
+    table = {}
+    for entry in t:
+        table.setdefault((entry[2] & 0x3) | ((entry[2] >> 13) & 0x7) << 2, []).append(entry)
+    return table
+
+
+RV_TABLE32 = _build_table32()
+RV_TABLE16 = _build_table16()
+
+
+def lookup32(word):
+    """Find the table entry of a 32-bit instruction, None if unknown"""
+    for entry in RV_TABLE32.get(word & 0x7f, ()):
+        if word & entry[1] == entry[2]:
+            return entry
+    return None
+
+
+def lookup16(half):
+    """Find the table entry of a 16-bit instruction, None if unknown"""
+    for entry in RV_TABLE16.get((half & 0x3) | ((half >> 13) & 0x7) << 2, ()):
+        if half & entry[1] == entry[2]:
+            return entry
+    return None
+
+
+def _imm32(word, fmt):
+    if fmt in ("I", "LD", "JALR", "FLD"):
+        return _sext(word >> 20, 12)
+    if fmt in ("ST", "FST"):
+        return _sext(_bits(word, 31, 25) << 5 | _bits(word, 11, 7), 12)
+    if fmt == "BR":
+        return _sext(_bits(word, 31, 31) << 12 | _bits(word, 7, 7) << 11 | _bits(word, 30, 25) << 5 | _bits(word, 11, 8) << 1, 13)
+    if fmt == "U":
+        return _sext(word & 0xfffff000, 32)
+    if fmt == "JAL":
+        return _sext(_bits(word, 31, 31) << 20 | _bits(word, 19, 12) << 12 | _bits(word, 20, 20) << 11 | _bits(word, 30, 21) << 1, 21)
+    if fmt == "SH":
+        return _bits(word, 25, 20)
+    if fmt == "SHW":
+        return _bits(word, 24, 20)
+    if fmt in ("CSR", "CSRI"):
+        return _bits(word, 31, 20)
+    return 0
+
+
+def decode32(word):
+    """Decode a 32-bit instruction
+
+    Args:
+        word (int): Instruction
+    Returns:
+        dict: {name, type, rd, rs1, rs2, imm, asm (with pseudo instructions)}, None if unknown
+    """
+    entry = lookup32(word)
+    if entry is None:
+        return None
+    name, _, _, fmt, has_rm = entry
+    if has_rm and _bits(word, 14, 12) in (5, 6):
+        return None  # reserved rounding mode
+    rd, rs1, rs2 = _bits(word, 11, 7), _bits(word, 19, 15), _bits(word, 24, 20)
+    imm = _imm32(word, fmt)
+    x, f = IREG_NAMES, FREG_NAMES
+    if fmt == "R":
+        ops = [x[rd], x[rs1], x[rs2]]
+    elif fmt in ("I", "SH", "SHW"):
+        ops = [x[rd], x[rs1], str(imm)]
+    elif fmt in ("LD", "JALR"):
+        ops = [x[rd], "%d(%s)" % (imm, x[rs1])]
+    elif fmt == "ST":
+        ops = [x[rs2], "%d(%s)" % (imm, x[rs1])]
+    elif fmt == "BR":
+        ops = [x[rs1], x[rs2], _target(imm)]
+    elif fmt == "U":
+        ops = [x[rd], "0x%x" % ((imm >> 12) & 0xfffff)]
+    elif fmt == "JAL":
+        ops = [x[rd], _target(imm)]
+    elif fmt == "UN":
+        ops = [x[rd], x[rs1]]
+    elif fmt == "CSR":
+        ops = [x[rd], CSR_NAMES.get(imm, "0x%x" % imm), x[rs1]]
+    elif fmt == "CSRI":
+        ops = [x[rd], CSR_NAMES.get(imm, "0x%x" % imm), str(rs1)]
+    elif fmt == "FENCE":
+        ops = ["".join(c for c, b in zip("iorw", (8, 4, 2, 1)) if _bits(word, 27, 24) & b) or "0",
+               "".join(c for c, b in zip("iorw", (8, 4, 2, 1)) if _bits(word, 23, 20) & b) or "0"]
+        if ops == ["iorw", "iorw"]:
+            ops = []
+    elif fmt == "SFENCE":
+        ops = [x[rs1], x[rs2]]
+    elif fmt == "AMO":
+        ops = [x[rd], x[rs2], "(%s)" % x[rs1]]
+    elif fmt == "LR":
+        ops = [x[rd], "(%s)" % x[rs1]]
+    elif fmt == "FLD":
+        ops = [f[rd], "%d(%s)" % (imm, x[rs1])]
+    elif fmt == "FST":
+        ops = [f[rs2], "%d(%s)" % (imm, x[rs1])]
+    elif fmt == "FR":
+        ops = [f[rd], f[rs1], f[rs2]]
+    elif fmt == "FR4":
+        ops = [f[rd], f[rs1], f[rs2], f[_bits(word, 31, 27)]]
+    elif fmt == "FUN":
+        ops = [f[rd], f[rs1]]
+    elif fmt == "FCMP":
+        ops = [x[rd], f[rs1], f[rs2]]
+    elif fmt == "F2I":
+        ops = [x[rd], f[rs1]]
+    elif fmt == "I2F":
+        ops = [f[rd], x[rs1]]
+    else:
+        ops = []
+    if fmt == "AMO" or fmt == "LR":
+        name += ("", ".rl", ".aq", ".aqrl")[_bits(word, 26, 25)]
+    if has_rm and _bits(word, 14, 12) != 7:
+        ops.append(ROUND_MODES[_bits(word, 14, 12)])
+    asm_name, ops = _pseudo32(name, rd, rs1, rs2, imm, ops)
+    return {"name": name, "type": FORMAT_TYPES.get(fmt, "unknown"), "rd": rd, "rs1": rs1, "rs2": rs2,
+            "imm": imm, "asm": (asm_name + " " + ", ".join(ops)).strip()}
+
+
+def _pseudo32(name, rd, rs1, rs2, imm, ops):
+    """Replace common instructions with their pseudo instructions"""
+    if name == "addi":
+        if rd == 0 and rs1 == 0 and imm == 0:
+            return "nop", []
+        if rs1 == 0:
+            return "li", [ops[0], ops[2]]
+        if imm == 0:
+            return "mv", ops[:2]
+    elif name == "addiw" and imm == 0:
+        return "sext.w", ops[:2]
+    elif name == "xori" and imm == -1:
+        return "not", ops[:2]
+    elif name == "sub" and rs1 == 0:
+        return "neg", [ops[0], ops[2]]
+    elif name == "jal" and rd in (0, 1):
+        return ("j" if rd == 0 else "jal"), ops[1:]
+    elif name == "jalr" and imm == 0 and rd in (0, 1):
+        if rd == 0 and rs1 == 1:
+            return "ret", []
+        return ("jr" if rd == 0 else "jalr"), [IREG_NAMES[rs1]]
+    elif name in ("beq", "bne") and rs2 == 0:
+        return name + "z", [ops[0], ops[2]]
+    elif name == "csrrs" and rs1 == 0:
+        return "csrr", ops[:2]
+    elif name == "csrrw" and rd == 0:
+        return "csrw", ops[1:]
+    return name, ops
+
+
+def decode16(half):
+    """Decode a 16-bit (compressed) instruction
+
+    Args:
+        half (int): Instruction
+    Returns:
+        dict: {name, type, rd, rs1, rs2, imm, asm}, None if unknown
+    """
+    entry = lookup16(half)
+    if entry is None:
+        return None
+    name, _, _, fmt, ctype = entry
+    x, f = IREG_NAMES, FREG_NAMES
+    b = lambda hi, lo: _bits(half, hi, lo)
+    rd = rs1 = rs2 = 0
+    imm = 0
+    rdp, rs1p, rs2p = 8 + b(4, 2), 8 + b(9, 7), 8 + b(4, 2)
+    ci_imm = _sext(b(12, 12) << 5 | b(6, 2), 6)
+    ops = []
+    if fmt == "ADDI4SPN":
+        rd, rs1, imm = rdp, 2, b(12, 11) << 4 | b(10, 7) << 6 | b(6, 6) << 2 | b(5, 5) << 3
+        ops = [x[rd], "sp", str(imm)]
+    elif fmt in ("LW", "SW"):
+        imm = b(12, 10) << 3 | b(6, 6) << 2 | b(5, 5) << 6
+    elif fmt in ("LD", "SD", "FLD", "FSD"):
+        imm = b(12, 10) << 3 | b(6, 5) << 6
+    if fmt in ("LW", "LD"):
+        rd, rs1 = rdp, rs1p
+        ops = [x[rd], "%d(%s)" % (imm, x[rs1])]
+    elif fmt == "FLD":
+        rd, rs1 = rdp, rs1p
+        ops = [f[rd], "%d(%s)" % (imm, x[rs1])]
+    elif fmt in ("SW", "SD"):
+        rs1, rs2 = rs1p, rs2p
+        ops = [x[rs2], "%d(%s)" % (imm, x[rs1])]
+    elif fmt == "FSD":
+        rs1, rs2 = rs1p, rs2p
+        ops = [f[rs2], "%d(%s)" % (imm, x[rs1])]
+    elif fmt == "CI":
+        rd = rs1 = b(11, 7)
+        imm = ci_imm
+        ops = [x[rd], str(imm)]
+    elif fmt == "ADDI16SP":
+        rd = rs1 = 2
+        imm = _sext(b(12, 12) << 9 | b(6, 6) << 4 | b(5, 5) << 6 | b(4, 3) << 7 | b(2, 2) << 5, 10)
+        ops = ["sp", str(imm)]
+    elif fmt == "LUI":
+        rd = b(11, 7)
+        imm = ci_imm << 12
+        ops = [x[rd], "0x%x" % (ci_imm & 0xfffff)]
+    elif fmt in ("CBSH", "CBI"):
+        rd = rs1 = rs1p
+        imm = b(12, 12) << 5 | b(6, 2) if fmt == "CBSH" else ci_imm
+        ops = [x[rd], str(imm)]
+    elif fmt == "CA":
+        rd = rs1 = rs1p
+        rs2 = rs2p
+        ops = [x[rd], x[rs2]]
+    elif fmt == "CJ":
+        imm = _sext(b(12, 12) << 11 | b(11, 11) << 4 | b(10, 9) << 8 | b(8, 8) << 10 |
+                    b(7, 7) << 6 | b(6, 6) << 7 | b(5, 3) << 1 | b(2, 2) << 5, 12)
+        ops = [_target(imm)]
+    elif fmt == "CB":
+        rs1 = rs1p
+        imm = _sext(b(12, 12) << 8 | b(11, 10) << 3 | b(6, 5) << 6 | b(4, 3) << 1 | b(2, 2) << 5, 9)
+        ops = [x[rs1], _target(imm)]
+    elif fmt == "CISH":
+        rd = rs1 = b(11, 7)
+        imm = b(12, 12) << 5 | b(6, 2)
+        ops = [x[rd], str(imm)]
+    elif fmt in ("LWSP", "LDSP", "FLDSP"):
+        rd, rs1 = b(11, 7), 2
+        if fmt == "LWSP":
+            imm = b(12, 12) << 5 | b(6, 4) << 2 | b(3, 2) << 6
+        else:
+            imm = b(12, 12) << 5 | b(6, 5) << 3 | b(4, 2) << 6
+        ops = [(f if fmt == "FLDSP" else x)[rd], "%d(sp)" % imm]
+    elif fmt in ("SWSP", "SDSP", "FSDSP"):
+        rs1, rs2 = 2, b(6, 2)
+        if fmt == "SWSP":
+            imm = b(12, 9) << 2 | b(8, 7) << 6
+        else:
+            imm = b(12, 10) << 3 | b(9, 7) << 6
+        ops = [(f if fmt == "FSDSP" else x)[rs2], "%d(sp)" % imm]
+    elif fmt == "CR1":
+        rs1 = b(11, 7)
+        ops = [x[rs1]]
+    elif fmt == "CR":
+        rd = rs1 = b(11, 7)
+        rs2 = b(6, 2)
+        ops = [x[rd], x[rs2]]
+    # Reserved encodings are illegal instructions, not the operation with a zero operand
+    if (imm == 0 and name in ("c.addi4spn", "c.addi16sp", "c.lui")) or \
+       (rd == 0 and name in ("c.addiw", "c.lwsp", "c.ldsp")) or (rs1 == 0 and name == "c.jr"):
+        return None
+    return {"name": name, "type": ctype, "rd": rd, "rs1": rs1, "rs2": rs2,
+            "imm": imm, "asm": (name + " " + ", ".join(ops)).strip()}
+
+
+@lru_cache(maxsize=64*1024)
+def dasm_word(word):
+    """Disassemble an instruction word (16-bit if word[1:0] != 3), results are cached
+
+    Returns:
+        (mnemonic, op_str)
+    """
+    info = decode32(word) if word & 0x3 == 0x3 else decode16(word)
+    if info is None:
+        return "unknown", "0x%x" % word
+    name, _, ops = info["asm"].partition(" ")
+    return name, ops
+
+
+def rv_dasm_bytes(bytes_data, address):
+    """Disassemble binary data with the built-in decoder
+
+    Args:
+        bytes_data (bytes): Binary data
+        address (int): Starting address
+
+    Returns:
+        list: List of disassembled results (address, hex, mnemonic, op_str)
+    """
+    result = []
+    i = 0
+    size = len(bytes_data) - 1
+    while i < size:
+        half = bytes_data[i] | bytes_data[i + 1] << 8
+        if half & 0x3 == 0x3:
+            if i + 3 >= len(bytes_data):
+                break
+            word = half | bytes_data[i + 2] << 16 | bytes_data[i + 3] << 24
+            mnemonic, op_str = dasm_word(word)
+            result.append((address + i, "%08x" % word, mnemonic, op_str))
+            i += 4
+        else:
+            mnemonic, op_str = dasm_word(half)
+            result.append((address + i, "%04x" % half, mnemonic, op_str))
+            i += 2
+    return result
@@ -5,6 +5,10 @@ import inspect
 import importlib.util
 import sys
 import logging
+import threading
+import atexit
+
+from XSPdb.cmd.rvdecoder import rv_dasm_bytes
 
 RESET = "\033[0m"
 GREEN = "\033[32m"
@@ -169,9 +173,243 @@ def find_executable_in_dirs(executable_name, search_dirs="./ready-to-run"):
     return shutil.which(executable_name)
 
 
+def get_cache_dir(sub_dir=""):
+    """Get (and create) the directory for persistent caches: $XSPDB_CACHE_DIR or ~/.cache/xspdb
+
+    Args:
+        sub_dir (str): Sub directory in the cache directory
+
+    Returns:
+        str: Path to the directory, None if it cannot be created
+    """
+    cache_dir = os.environ.get("XSPDB_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "xspdb")
+    cache_dir = os.path.join(cache_dir, sub_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        warn(f"cannot create cache dir {cache_dir}: {str(e)}")
+        return None
+    return cache_dir
+
+
 spike_dasm_path = find_executable_in_dirs("spike-dasm", search_dirs=["./ready-to-run"])
 if not spike_dasm_path:
     info(f"spike-dasm found, use captone to disassemble, this may cannot work for some instructions")
+
+DASM_BACKENDS = ["spike-dasm", "capstone", "builtin"]
+dasm_backend = "spike-dasm" if spike_dasm_path else "capstone"
+_capstone_local = threading.local()
+
+
+def set_dasm_backend(name):
+    """Select the disassembler used by dasm_bytes
+
+    Args:
+        name (string): spike-dasm, capstone or builtin
+    Returns:
+        bool: True if the backend is selected
+    """
+    global dasm_backend
+    if name not in DASM_BACKENDS:
+        error(f"unknown disassembler backend: {name}, supported: {', '.join(DASM_BACKENDS)}")
+        return False
+    if name == "spike-dasm" and spike_dasm_path is None:
+        error("spike-dasm not found")
+        return False
+    dasm_backend = name
+    return True
+
+
+def get_dasm_backend():
+    """Get the disassembler used by dasm_bytes"""
+    return dasm_backend
+
+
+def get_capstone_md():
+    """Get the (cached) capstone disassembler of the calling thread"""
+    md = getattr(_capstone_local, "md", None)
+    if md is None:
+        try:
+            import capstone
+        except ImportError:
+            raise ImportError("Please install capstone library: pip install capstone")
+        md = capstone.Cs(capstone.CS_ARCH_RISCV, capstone.CS_MODE_RISCV32|capstone.CS_MODE_RISCV64|capstone.CS_MODE_RISCVC)
+        md.detail = False
+        md.skipdata = True
+        md.skipdata_setup = (".byte", None, None)
+        _capstone_local.md = md
+    return md
+
+class SpikeDasm:
+    """A long-lived spike-dasm co-process
+
+    Requests are written to stdin as "DASM(hex)" lines followed by a sync line, spike-dasm
+    echoes the sync line back after the results, so the answers can be framed without
+    closing the pipe. The process is restarted if it crashes, and None is returned if it
+    does not answer in time (the caller then falls back to one-shot spike-dasm runs).
+    """
+
+    sync_line = "XSPDB_DASM_SYNC_"
+
+    def __init__(self, path, max_inflight=1024, timeout=3.0):
+        self.path = path
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.proc = None
+        self.seq = 0
+        self.rbuf = b""
+        self.broken = False
+
+    def start(self):
+        import shutil
+        import subprocess
+        cmd = [self.path]
+        stdbuf = shutil.which("stdbuf")
+        if stdbuf:
+            # Make spike-dasm flush every line, otherwise its output stays in the stdio buffer
+            cmd = [stdbuf, "-oL", self.path]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, bufsize=0)
+        self.rbuf = b""
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.wait()
+        except Exception:
+            pass
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except Exception:
+                pass
+        self.proc = None
+
+    def _write_all(self, data):
+        fd = self.proc.stdin.fileno()
+        while data:
+            data = data[os.write(fd, data):]
+
+    def _read_until(self, sync):
+        import select
+        import time
+        fd = self.proc.stdout.fileno()
+        deadline = time.time() + self.timeout
+        while True:
+            index = self.rbuf.find(sync)
+            if index >= 0:
+                lines = self.rbuf[:index].decode(errors="replace").split("\n")
+                self.rbuf = self.rbuf[index + len(sync):]
+                return lines
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise TimeoutError("spike-dasm no response")
+            data = os.read(fd, 65536)
+            if not data:
+                raise EOFError("spike-dasm exited")
+            self.rbuf += data
+
+    def _dasm(self, instrs):
+        if self.proc is None or self.proc.poll() is not None:
+            self.close()
+            self.start()
+        ret = []
+        for i in range(0, len(instrs), self.max_inflight):
+            chunk = instrs[i:i+self.max_inflight]
+            self.seq += 1
+            sync = "%s%d" % (self.sync_line, self.seq)
+            self._write_all(("".join("DASM(%016lx)\n" % v for v in chunk) + sync + "\n").encode())
+            lines = self._read_until(("\n%s\n" % sync).encode())
+            if len(lines) != len(chunk):
+                raise ValueError("spike-dasm answer count mismatch: %d != %d" % (len(lines), len(chunk)))
+            ret += [l.strip() for l in lines]
+        return ret
+
+    def dasm(self, instrs):
+        """Disassemble instructions
+
+        Args:
+            instrs (list): Instruction values
+        Returns:
+            list: Disassembled strings, None if spike-dasm is not usable
+        """
+        if self.broken:
+            return None
+        for retry in range(2):
+            try:
+                return self._dasm(instrs)
+            except TimeoutError as e:
+                warn(f"{e}, use one-shot spike-dasm instead")
+                self.broken = True
+                break
+            except (OSError, EOFError, ValueError) as e:
+                warn(f"spike-dasm co-process error: {e}, restart it")
+            self.close()
+        self.close()
+        return None
+
+
+_spike_dasm_local = threading.local()
+_spike_dasm_procs = []
+
+
+def get_spike_dasm():
+    """Get the spike-dasm co-process of the current thread"""
+    proc = getattr(_spike_dasm_local, "proc", None)
+    if proc is None or proc.path != spike_dasm_path:
+        proc = SpikeDasm(spike_dasm_path)
+        _spike_dasm_local.proc = proc
+        _spike_dasm_procs.append(proc)
+    return proc
+
+
+def init_dasm_worker(backend, spike_path):
+    """Set up the disassembler of a worker process
+
+    A worker must not share the spike-dasm co-processes of its parent, they are dropped (not
+    closed, the parent still owns them) and the backend of the parent is selected.
+
+    Args:
+        backend (string): Disassembler backend
+        spike_path (string): Path to spike-dasm
+    """
+    global _spike_dasm_local, _spike_dasm_procs, spike_dasm_path, dasm_backend
+    _spike_dasm_local = threading.local()
+    _spike_dasm_procs = []
+    spike_dasm_path = spike_path
+    dasm_backend = backend
+
+
+@atexit.register
+def close_spike_dasm():
+    """Close all spike-dasm co-processes"""
+    while _spike_dasm_procs:
+        _spike_dasm_procs.pop().close()
+
+
+def spike_dasm_oneshot(instrs):
+    """Disassemble instructions with a new spike-dasm process
+
+    Args:
+        instrs (list): Instruction values
+    Returns:
+        list: Disassembled strings
+    """
+    import subprocess
+    ins_dm = "\n".join(["DASM(%016lx)" % v for v in instrs])
+    result = subprocess.run([spike_dasm_path],
+                            input=ins_dm,
+                            text=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    assert result.returncode == 0, f"Error({spike_dasm_path}): " + str(result.stderr)
+    ins_dm = result.stdout.strip().split("\n")
+    assert len(ins_dm) == len(instrs), "Error(%s): %d != %d\n%s vs %s" % (spike_dasm_path, len(ins_dm), len(instrs), ins_dm, instrs)
+    return ins_dm
+
+
 def dasm_bytes(bytes_data, address):
     """Disassemble binary data
 
@@ -182,7 +420,9 @@ def dasm_bytes(bytes_data, address):
     Returns:
         list: List of disassembled results
     """
-    if spike_dasm_path is not None:
+    if dasm_backend == "builtin":
+        return rv_dasm_bytes(bytes_data, address)
+    if dasm_backend == "spike-dasm" and spike_dasm_path is not None:
         # iterate over bytes_data in chunks of 2 bytes (c.instr. 16 bits)
         instrs_todecode = []
         full_instr = None
@@ -201,36 +441,21 @@ def dasm_bytes(bytes_data, address):
             # Is compressed 16 instr
             instrs_todecode.append((int.from_bytes(c_instr, byteorder='little', signed=False),
                                     c_instr[::-1].hex(), i + address))
-        import subprocess
+        instrs = [v[0] for v in instrs_todecode]
+        ins_dm = get_spike_dasm().dasm(instrs) if instrs else []
+        if ins_dm is None:
+            # For every 1000 instrs, call spike-dasm
+            ins_dm = []
+            for i in range(0, len(instrs), 1000):
+                ins_dm += spike_dasm_oneshot(instrs[i:i+1000])
         result_asm = []
-        # For every 1000 instrs, call spike-dasm
-        for i in range(0, len(instrs_todecode), 1000):
-            instrs = instrs_todecode[i:i+1000]
-            ins_dm = "\\n".join(["DASM(%016lx)" % i[0] for i in instrs])
-            # Call spike-dasm
-            bash_cmd = 'echo "%s"|%s' % (ins_dm, spike_dasm_path)
-            result = subprocess.run(bash_cmd,
-                                    shell=True,
-                                    text=True,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            assert result.returncode == 0, f"Error({bash_cmd}): " + str(result.stderr)
-            ins_dm = result.stdout.strip().split("\n")
-            assert len(ins_dm) == len(instrs), "Error(%s): %d != %d\n%s vs %s" % (bash_cmd, len(ins_dm), len(instrs), ins_dm, instrs)
-            for i, v in enumerate(instrs):
-                result_asm.append((v[2], v[1], ins_dm[i] if "unknown" not in ins_dm[i] else "unknown.bytes %s" % v[1], ""))
+        for i, v in enumerate(instrs_todecode):
+            result_asm.append((v[2], v[1], ins_dm[i] if "unknown" not in ins_dm[i] else "unknown.bytes %s" % v[1], ""))
         return result_asm
-    try:
-        import capstone
-    except ImportError:
-        raise ImportError("Please install capstone library: pip install capstone")
-    md = capstone.Cs(capstone.CS_ARCH_RISCV, capstone.CS_MODE_RISCV32|capstone.CS_MODE_RISCV64|capstone.CS_MODE_RISCVC)
-    md.detail = True
-    md.skipdata = True
-    md.skipdata_setup = (".byte", None, None)
     asm_data = []
-    for instr in md.disasm(bytes_data, address):
-        asm_data.append((instr.address, instr.bytes[::-1].hex(), instr.mnemonic, instr.op_str))
+    for instr_address, size, mnemonic, op_str in get_capstone_md().disasm_lite(bytes_data, address):
+        offset = instr_address - address
+        asm_data.append((instr_address, bytes(bytes_data[offset:offset+size])[::-1].hex(), mnemonic, op_str))
     return asm_data
 
 
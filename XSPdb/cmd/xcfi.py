@@ -0,0 +1,313 @@
+#coding=utf-8
+"""DWARF call frame information (.eh_frame / .debug_frame) compiled into a PC-indexed rule table
+
+Every FDE is executed once when the table is built, each row of the result becomes a
+range [start, end) with an interned unwind rule:
+    (cfa_reg, cfa_offset, ((reg, kind, value), ...))
+kind is RULE_OFFSET (saved at CFA + value), RULE_VAL_OFFSET (value is CFA + value),
+RULE_REGISTER (value is in register value) or RULE_UNDEFINED. cfa_reg is None if the
+CFA is given by an expression, which is not supported.
+"""
+
+import bisect
+import struct
+from array import array
+from XSPdb.cmd.xelf import ElfFile
+from XSPdb.cmd.xdwarf import _uleb, _sleb, _cstr
+
+RULE_OFFSET = 0
+RULE_VAL_OFFSET = 1
+RULE_REGISTER = 2
+RULE_UNDEFINED = 3
+
+DW_EH_PE_omit = 0xff
+DW_EH_PE_pcrel = 0x10
+DW_EH_PE_datarel = 0x30
+
+
+class CFITable:
+    """Unwind rules sorted by PC"""
+
+    def __init__(self):
+        self.start = array('Q')
+        self.end = array('Q')
+        self.rule = array('I')
+        self.rules = []
+        self.ra_reg = array('B')
+
+    def __len__(self):
+        return len(self.start)
+
+    def lookup(self, pc):
+        """Get (rule, return address register) for a pc, None if not covered"""
+        i = bisect.bisect_right(self.start, pc) - 1
+        if i < 0 or pc >= self.end[i]:
+            return None
+        return self.rules[self.rule[i]], self.ra_reg[i]
+
+
+class _CIE:
+    pass
+
+
+def _read_encoded(data, pos, enc, addr_size, sec_addr):
+    """Read a pointer with a DW_EH_PE encoding, returns (value, pos)"""
+    if enc == DW_EH_PE_omit:
+        return None, pos
+    fmt = enc & 0x0f
+    field = pos
+    if fmt == 0x00:
+        value = int.from_bytes(data[pos:pos + addr_size], "little")
+        pos += addr_size
+    elif fmt == 0x01:
+        value, pos = _uleb(data, pos)
+    elif fmt == 0x09:
+        value, pos = _sleb(data, pos)
+    else:
+        size, signed = {0x02: (2, False), 0x03: (4, False), 0x04: (8, False),
+                        0x0a: (2, True), 0x0b: (4, True), 0x0c: (8, True)}[fmt]
+        value = int.from_bytes(data[pos:pos + size], "little", signed=signed)
+        pos += size
+    if enc & 0x70 == DW_EH_PE_pcrel:
+        value += sec_addr + field
+    return value & 0xffffffffffffffff, pos
+
+
+def _parse_cie(data, pos, end, is_eh, addr_size, sec_addr):
+    cie = _CIE()
+    cie.version = data[pos]
+    pos += 1
+    aug, pos = _cstr(data, pos)
+    cie.addr_size = addr_size
+    if not is_eh and cie.version >= 4:
+        cie.addr_size = data[pos]
+        pos += 2
+    if aug.startswith("eh"):
+        pos += addr_size
+    cie.code_align, pos = _uleb(data, pos)
+    cie.data_align, pos = _sleb(data, pos)
+    if cie.version == 1:
+        cie.ra_reg = data[pos]
+        pos += 1
+    else:
+        cie.ra_reg, pos = _uleb(data, pos)
+    cie.fde_enc = 0
+    cie.has_aug_data = aug.startswith("z")
+    if cie.has_aug_data:
+        length, pos = _uleb(data, pos)
+        aug_end = pos + length
+        for c in aug[1:]:
+            if c == "R":
+                cie.fde_enc = data[pos]
+                pos += 1
+            elif c == "P":
+                enc = data[pos]
+                _, pos = _read_encoded(data, pos + 1, enc, addr_size, sec_addr)
+            elif c == "L":
+                pos += 1
+            elif c not in ("S", "B"):
+                break
+        pos = aug_end
+    cie.instructions = (pos, end)
+    return cie
+
+
+def _run_cfa(data, start, end, cie, loc, state, initial, rows):
+    """Execute call frame instructions, rows (loc, state copy) are appended to rows"""
+    cfa_reg, cfa_off, regs = state
+    stack = []
+    pos = start
+    code_align, data_align = cie.code_align, cie.data_align
+    def emit(new_loc):
+        rows.append((loc, cfa_reg, cfa_off, dict(regs)))
+        return new_loc
+    while pos < end:
+        op = data[pos]
+        pos += 1
+        hi, lo = op >> 6, op & 0x3f
+        if hi == 1:      # advance_loc
+            loc = emit(loc + lo*code_align)
+            continue
+        if hi == 2:      # offset
+            v, pos = _uleb(data, pos)
+            regs[lo] = (RULE_OFFSET, v*data_align)
+            continue
+        if hi == 3:      # restore
+            if lo in initial[2]:
+                regs[lo] = initial[2][lo]
+            else:
+                regs.pop(lo, None)
+            continue
+        if op == 0x00:
+            pass
+        elif op == 0x01:
+            new_loc, pos = _read_encoded(data, pos, cie.fde_enc, cie.addr_size, cie.sec_addr)
+            loc = emit(new_loc)
+        elif op in (0x02, 0x03, 0x04):
+            size = {0x02: 1, 0x03: 2, 0x04: 4}[op]
+            delta = int.from_bytes(data[pos:pos + size], "little")
+            pos += size
+            loc = emit(loc + delta*code_align)
+        elif op in (0x05, 0x11, 0x14, 0x15):
+            reg, pos = _uleb(data, pos)
+            if op in (0x05, 0x14):
+                v, pos = _uleb(data, pos)
+            else:
+                v, pos = _sleb(data, pos)
+            regs[reg] = (RULE_OFFSET if op in (0x05, 0x11) else RULE_VAL_OFFSET, v*data_align)
+        elif op == 0x2f:  # GNU_negative_offset_extended
+            reg, pos = _uleb(data, pos)
+            v, pos = _uleb(data, pos)
+            regs[reg] = (RULE_OFFSET, -v*data_align)
+        elif op == 0x06:
+            reg, pos = _uleb(data, pos)
+            if reg in initial[2]:
+                regs[reg] = initial[2][reg]
+            else:
+                regs.pop(reg, None)
+        elif op == 0x07:
+            reg, pos = _uleb(data, pos)
+            regs[reg] = (RULE_UNDEFINED, 0)
+        elif op == 0x08:
+            reg, pos = _uleb(data, pos)
+            regs.pop(reg, None)
+        elif op == 0x09:
+            reg, pos = _uleb(data, pos)
+            reg2, pos = _uleb(data, pos)
+            regs[reg] = (RULE_REGISTER, reg2)
+        elif op == 0x0a:
+            stack.append((cfa_reg, cfa_off, dict(regs)))
+        elif op == 0x0b:
+            if stack:
+                cfa_reg, cfa_off, regs = stack.pop()
+        elif op == 0x0c:
+            cfa_reg, pos = _uleb(data, pos)
+            cfa_off, pos = _uleb(data, pos)
+        elif op == 0x12:
+            cfa_reg, pos = _uleb(data, pos)
+            cfa_off, pos = _sleb(data, pos)
+            cfa_off *= data_align
+        elif op == 0x0d:
+            cfa_reg, pos = _uleb(data, pos)
+        elif op == 0x0e:
+            cfa_off, pos = _uleb(data, pos)
+        elif op == 0x13:
+            cfa_off, pos = _sleb(data, pos)
+            cfa_off *= data_align
+        elif op == 0x0f:  # def_cfa_expression
+            length, pos = _uleb(data, pos)
+            pos += length
+            cfa_reg = None
+        elif op in (0x10, 0x16):  # expression, val_expression
+            reg, pos = _uleb(data, pos)
+            length, pos = _uleb(data, pos)
+            pos += length
+            regs[reg] = (RULE_UNDEFINED, 0)
+        elif op == 0x2e:  # GNU_args_size
+            _, pos = _uleb(data, pos)
+        else:
+            break
+    return loc, (cfa_reg, cfa_off, regs)
+
+
+def _parse_section(data, sec_addr, is_eh, addr_size, entries):
+    """Parse the CIEs and FDEs of a section, entries (pc_begin, pc_end, rows, ra_reg) are appended"""
+    cies = {}
+    pos = 0
+    while pos + 4 <= len(data):
+        entry = pos
+        length = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+        offset_size = 4
+        if length == 0xffffffff:
+            length = struct.unpack_from("<Q", data, pos)[0]
+            pos += 8
+            offset_size = 8
+        if length == 0:
+            if is_eh:
+                break
+            pos = entry + 4
+            continue
+        end = pos + length
+        id_pos = pos
+        cie_id = int.from_bytes(data[pos:pos + offset_size], "little")
+        pos += offset_size
+        is_cie = cie_id == 0 if is_eh else cie_id == (1 << (8*offset_size)) - 1
+        if is_cie:
+            cie = _parse_cie(data, pos, end, is_eh, addr_size, sec_addr)
+            cie.sec_addr = sec_addr
+            cies[entry] = cie
+        else:
+            cie_pos = id_pos - cie_id if is_eh else cie_id
+            cie = cies.get(cie_pos)
+            if cie is None and cie_pos < len(data):
+                # CIE after the FDE (allowed in .debug_frame)
+                cie_len = struct.unpack_from("<I", data, cie_pos)[0]
+                cie_off = 12 if cie_len == 0xffffffff else 4
+                cie_id_size = 8 if cie_len == 0xffffffff else 4
+                cie_end = cie_pos + cie_off + (struct.unpack_from("<Q", data, cie_pos + 4)[0] if cie_len == 0xffffffff else cie_len)
+                cie = _parse_cie(data, cie_pos + cie_off + cie_id_size, cie_end, is_eh, addr_size, sec_addr)
+                cie.sec_addr = sec_addr
+                cies[cie_pos] = cie
+            if cie is not None:
+                enc = cie.fde_enc if is_eh else 0
+                pc_begin, pos = _read_encoded(data, pos, enc, cie.addr_size, sec_addr)
+                pc_range, pos = _read_encoded(data, pos, enc & 0x0f, cie.addr_size, sec_addr)
+                if cie.has_aug_data:
+                    length, pos = _uleb(data, pos)
+                    pos += length
+                if pc_begin and pc_range:
+                    init_rows = []
+                    _, initial = _run_cfa(data, cie.instructions[0], cie.instructions[1], cie, pc_begin,
+                                          (None, 0, {}), (None, 0, {}), init_rows)
+                    initial = (initial[0], initial[1], dict(initial[2]))
+                    rows = []
+                    loc, state = _run_cfa(data, pos, end, cie, pc_begin,
+                                          (initial[0], initial[1], dict(initial[2])), initial, rows)
+                    rows.append((loc, state[0], state[1], dict(state[2])))
+                    entries.append((pc_begin, pc_begin + pc_range, rows, cie.ra_reg))
+        pos = end
+
+
+def read_cfi_table(elf_file):
+    """Compile .eh_frame and .debug_frame of an ELF file into a rule table
+
+    Args:
+        elf_file (string): Path to the ELF file
+    Returns:
+        CFITable: Unwind rules (empty if the file has no CFI)
+    """
+    elf = ElfFile(elf_file)
+    addr_size = 8 if elf.is_64 else 4
+    entries = []
+    for name, is_eh in ((".eh_frame", True), (".debug_frame", False)):
+        sec = elf.section(name)
+        if sec is not None:
+            _parse_section(elf.read_section(sec), sec.addr, is_eh, addr_size, entries)
+    table = CFITable()
+    interned = {}
+    covered = set()
+    ranges = []
+    for pc_begin, pc_end, rows, ra_reg in entries:
+        # .eh_frame and .debug_frame may describe the same function, keep the first
+        if pc_begin in covered:
+            continue
+        covered.add(pc_begin)
+        for i, (loc, cfa_reg, cfa_off, regs) in enumerate(rows):
+            loc_end = rows[i + 1][0] if i + 1 < len(rows) else pc_end
+            loc_end = min(loc_end, pc_end)
+            if loc_end <= loc:
+                continue
+            rule = (cfa_reg, cfa_off, tuple(sorted((r, k, v) for r, (k, v) in regs.items())))
+            index = interned.get(rule)
+            if index is None:
+                index = interned[rule] = len(table.rules)
+                table.rules.append(rule)
+            ranges.append((loc, loc_end, index, ra_reg & 0xff))
+    ranges.sort()
+    for loc, loc_end, index, ra_reg in ranges:
+        table.start.append(loc)
+        table.end.append(loc_end)
+        table.rule.append(index)
+        table.ra_reg.append(ra_reg)
+    return table
@@ -0,0 +1,140 @@
+#coding=utf-8
+"""One condition checker for all break sources
+
+The break sources (good trap, trap break, instruction step, instruction count, signal
+breakpoints, difftest check) put their conditions into one ComUseCondCheck registered as a
+single clock callback, instead of a checker and a callback each. Every condition gets a bit
+in a hit bitmap, the conditions are listed from the checker at most once per step (after
+the clock stops), and a source tests its hits with a mask.
+"""
+
+
+class CondRegistry:
+    """Conditions of a shared ComUseCondCheck, grouped by break source"""
+
+    CB_KEY = "xspdb_cond_check"
+
+    def __init__(self, xsp, xclock):
+        self.xsp = xsp
+        self.xclock = xclock
+        self.checker = None
+        self.bits = {}       # condition key -> bit
+        self.groups = {}     # condition key -> group
+        self.keep = {}       # condition key -> objects the native side points to
+        self.masks = {}      # group -> mask of its bits (cache)
+        self.free_bits = []
+        self.next_bit = 0
+        self.hit_bitmap = None
+
+    def __contains__(self, key):
+        return key in self.bits
+
+    def get_checker(self):
+        if self.checker is None:
+            self.checker = self.xsp.ComUseCondCheck(self.xclock)
+        return self.checker
+
+    def add(self, key, group, *args, keep=()):
+        """Add (or replace) a condition
+
+        Args:
+            key (string): Condition key
+            group (string): Break source of the condition
+            args: Arguments of ComUseCondCheck.SetCondition after the key
+            keep (tuple): Objects to keep alive while the condition is set
+        """
+        self.get_checker().SetCondition(key, *args)
+        if key not in self.bits:
+            if self.free_bits:
+                self.bits[key] = self.free_bits.pop()
+            else:
+                self.bits[key] = self.next_bit
+                self.next_bit += 1
+        self.groups[key] = group
+        self.keep[key] = keep
+        self.masks.clear()
+        self.hit_bitmap = None
+        if self.CB_KEY not in self.xclock.ListSteRisCbDesc():
+            self.xclock.StepRis(self.checker.GetCb(), self.checker.CSelf(), self.CB_KEY)
+
+    def remove(self, key):
+        """Remove a condition, the clock callback is removed with the last one"""
+        if key not in self.bits:
+            return False
+        self.checker.RemoveCondition(key)
+        self.free_bits.append(self.bits.pop(key))
+        del self.groups[key]
+        del self.keep[key]
+        self.masks.clear()
+        self.hit_bitmap = None
+        if not self.bits:
+            self.checker.ClearCondition()
+            self.xclock.RemoveStepRisCbByDesc(self.CB_KEY)
+            self.free_bits.clear()
+            self.next_bit = 0
+        return True
+
+    def remove_group(self, group):
+        """Remove all conditions of a break source
+
+        Returns:
+            int: Number of conditions removed
+        """
+        keys = self.keys(group)
+        for k in keys:
+            self.remove(k)
+        return len(keys)
+
+    def keys(self, group=None):
+        """Get the condition keys (of a break source)"""
+        return [k for k, g in self.groups.items() if group is None or g == group]
+
+    def has_group(self, group):
+        return self.mask(group) != 0
+
+    def mask(self, group):
+        """Get the bit mask of a break source"""
+        m = self.masks.get(group)
+        if m is None:
+            m = 0
+            for k, g in self.groups.items():
+                if g == group:
+                    m |= 1 << self.bits[k]
+            self.masks[group] = m
+        return m
+
+    def invalidate(self):
+        """Forget the hits (called before stepping)"""
+        self.hit_bitmap = None
+
+    def hits(self):
+        """Get the hit bitmap of the last step
+
+        Returns:
+            int: Bit i is set if the condition of bit i is hit
+        """
+        if self.hit_bitmap is None:
+            bitmap = 0
+            if self.bits:
+                bits = self.bits
+                for k, v in self.checker.ListCondition().items():
+                    if v and k in bits:
+                        bitmap |= 1 << bits[k]
+            self.hit_bitmap = bitmap
+        return self.hit_bitmap
+
+    def is_hit(self, key):
+        bit = self.bits.get(key)
+        return bit is not None and (self.hits() >> bit) & 1 == 1
+
+    def group_hit(self, group):
+        """Check if any condition of a break source is hit"""
+        mask = self.mask(group)
+        return mask != 0 and self.hits() & mask != 0
+
+    def hit_keys(self, group=None):
+        """Get the keys of the hit conditions (of a break source)"""
+        bitmap = self.hits()
+        if bitmap == 0:
+            return []
+        return [k for k, g in self.groups.items() if (group is None or g == group) and (bitmap >> self.bits[k]) & 1]
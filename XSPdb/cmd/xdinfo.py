@@ -0,0 +1,797 @@
+#coding=utf-8
+"""DWARF .debug_info reader for global variables and their type layouts (DWARF 2 - 5)
+
+Only what is needed to read variables from guest memory is decoded: the variables with a
+static address (DW_OP_addr/DW_OP_addrx locations), found with one scan of .debug_info, and
+the type DIEs, parsed on demand. The layout of a type is compiled once into a VarLayout:
+struct format strings covering the scalar leaves of the type and a tree rebuilding the value
+from the unpacked leaves.
+"""
+
+import bisect
+import re
+import struct
+from XSPdb.cmd.xelf import ElfFile
+from XSPdb.cmd.xdwarf import _uleb, _sleb, _cstr
+
+VAR_ARRAY_MAX = 1024
+
+DW_TAG_array_type = 0x01
+DW_TAG_class_type = 0x02
+DW_TAG_enumeration_type = 0x04
+DW_TAG_member = 0x0d
+DW_TAG_pointer_type = 0x0f
+DW_TAG_reference_type = 0x10
+DW_TAG_structure_type = 0x13
+DW_TAG_subroutine_type = 0x15
+DW_TAG_typedef = 0x16
+DW_TAG_union_type = 0x17
+DW_TAG_inheritance = 0x1c
+DW_TAG_subrange_type = 0x21
+DW_TAG_base_type = 0x24
+DW_TAG_const_type = 0x26
+DW_TAG_enumerator = 0x28
+DW_TAG_variable = 0x34
+DW_TAG_volatile_type = 0x35
+DW_TAG_restrict_type = 0x37
+DW_TAG_rvalue_reference_type = 0x42
+DW_TAG_atomic_type = 0x47
+
+DW_AT_sibling = 0x01
+DW_AT_location = 0x02
+DW_AT_name = 0x03
+DW_AT_byte_size = 0x0b
+DW_AT_bit_offset = 0x0c
+DW_AT_bit_size = 0x0d
+DW_AT_stmt_list = 0x10
+DW_AT_comp_dir = 0x1b
+DW_AT_const_value = 0x1c
+DW_AT_lower_bound = 0x22
+DW_AT_upper_bound = 0x2f
+DW_AT_abstract_origin = 0x31
+DW_AT_count = 0x37
+DW_AT_data_member_location = 0x38
+DW_AT_encoding = 0x3e
+DW_AT_specification = 0x47
+DW_AT_type = 0x49
+DW_AT_data_bit_offset = 0x6b
+DW_AT_str_offsets_base = 0x72
+DW_AT_addr_base = 0x73
+
+DW_ATE_boolean = 0x02
+DW_ATE_float = 0x04
+DW_ATE_signed = 0x05
+DW_ATE_signed_char = 0x06
+DW_ATE_unsigned_char = 0x08
+
+DW_OP_addr = 0x03
+DW_OP_plus_uconst = 0x23
+DW_OP_addrx = 0xa1
+DW_OP_GNU_addr_index = 0xfb
+
+# Forms of a fixed size: size, or "addr"/"offset" for the address/offset size of the unit
+_FORM_SIZE = {
+    0x01: "addr", 0x05: 2, 0x06: 4, 0x07: 8, 0x0b: 1, 0x0c: 1, 0x0e: "offset", 0x10: "ref_addr",
+    0x11: 1, 0x12: 2, 0x13: 4, 0x14: 8, 0x17: "offset", 0x19: 0, 0x1c: 4, 0x1d: "offset", 0x1e: 16,
+    0x1f: "offset", 0x20: 8, 0x21: 0, 0x24: 8, 0x25: 1, 0x26: 2, 0x27: 3, 0x28: 4, 0x29: 1, 0x2a: 2,
+    0x2b: 3, 0x2c: 4, 0x1f20: "offset", 0x1f21: "offset",
+}
+_FORM_ULEB = (0x0f, 0x15, 0x1a, 0x1b, 0x22, 0x23, 0x1f01, 0x1f02)
+_FORM_REF_UNIT = (0x11, 0x12, 0x13, 0x14, 0x15)
+_FORM_STRX = (0x1a, 0x25, 0x26, 0x27, 0x28, 0x1f02)
+_FORM_ADDRX = (0x1b, 0x29, 0x2a, 0x2b, 0x2c, 0x1f01)
+_FORM_BLOCK = {0x0a: 1, 0x03: 2, 0x04: 4}
+
+_INT_FMT = {1: "B", 2: "H", 4: "I", 8: "Q"}
+_FLOAT_FMT = {2: "e", 4: "f", 8: "d"}
+
+
+class _Unit:
+    pass
+
+
+class VarLayout:
+    """Compiled layout of a type
+
+    Leaves (offset, format, size, number of values) are the scalar parts of the type. They are
+    packed into as few struct formats as possible (members of unions overlap and go to another
+    pass), so decoding a value is one unpack_from per pass plus rebuilding the tree.
+    """
+
+    def __init__(self, type_name, size, root, leaves, read_size):
+        self.type_name = type_name
+        self.size = size
+        self.root = root
+        self.read_size = read_size
+        self.passes = []
+        ends = []
+        parts = []
+        for lid in sorted(range(len(leaves)), key=lambda i: leaves[i][0]):
+            offset, fmt, size, count = leaves[lid]
+            p = next((i for i, end in enumerate(ends) if end <= offset), None)
+            if p is None:
+                p = len(ends)
+                ends.append(0)
+                parts.append(([], []))
+            if offset > ends[p]:
+                parts[p][0].append("%dx" % (offset - ends[p]))
+            parts[p][0].append(fmt)
+            parts[p][1].append((lid, count))
+            ends[p] = offset + size
+        for fmt, slots in parts:
+            self.passes.append((struct.Struct("<" + "".join(fmt)), slots))
+        self.nleaves = len(leaves)
+
+    def decode(self, data):
+        """Decode the value from the data of the variable (at least read_size bytes)
+
+        Returns:
+            int/float/bool/str/bytes/list/dict: Value, structs are dicts, arrays are lists,
+            char arrays are bytes and known enum values are names
+        """
+        values = [None]*self.nleaves
+        for st, slots in self.passes:
+            raw = st.unpack_from(data)
+            i = 0
+            for lid, count in slots:
+                values[lid] = raw[i] if count == 1 else raw[i:i + count]
+                i += count
+        return _build(self.root, values, data)
+
+    def format(self, value, node=None):
+        """Format a decoded value like a C initializer"""
+        return _format(self.root if node is None else node, value)
+
+    def select(self, value, path):
+        """Select a part of a decoded value
+
+        Args:
+            value: Decoded value
+            path (string): Member and index accessors, eg: ".a.b[2]"
+        Returns:
+            (node, value): Layout node and value of the part
+        """
+        node = self.root
+        for member, index in re.findall(r"\.\s*(\w+)|\[\s*(\d+)\s*\]", path):
+            if member:
+                if node[0] != "struct" or member not in value:
+                    raise KeyError(f"no member named {member}")
+                node = next(n for name, n in node[2] if name == member)
+                value = value[member]
+            else:
+                index = int(index)
+                if node[0] not in ("list", "vec", "str") or index >= len(value):
+                    raise IndexError(f"index {index} out of range")
+                if node[0] == "list":
+                    node = node[1][index]
+                elif node[0] == "vec":
+                    node = node[2]
+                else:
+                    node = ("char", None)
+                value = value[index]
+        return node, value
+
+
+def _build(node, values, data):
+    kind = node[0]
+    if kind in ("num", "char", "ptr"):
+        return values[node[1]]
+    if kind == "bool":
+        return bool(values[node[1]])
+    if kind == "enum":
+        v = values[node[1]]
+        return node[2].get(v, v)
+    if kind == "big":
+        return int.from_bytes(values[node[1]], "little", signed=node[2])
+    if kind == "bits":
+        _, offset, nbytes, shift, width, signed, names = node
+        v = (int.from_bytes(data[offset:offset + nbytes], "little") >> shift) & ((1 << width) - 1)
+        if signed and v >> (width - 1):
+            v -= 1 << width
+        return names.get(v, v) if names else v
+    if kind == "struct":
+        return {name: _build(child, values, data) for name, child in node[2]}
+    if kind == "list":
+        return [_build(child, values, data) for child in node[1]]
+    if kind == "vec":
+        elem = node[2]
+        if elem[0] == "enum":
+            return [elem[2].get(v, v) for v in values[node[1]]]
+        if elem[0] == "bool":
+            return [bool(v) for v in values[node[1]]]
+        return list(values[node[1]])
+    if kind == "str":
+        return values[node[1]]
+    return None
+
+
+def _format(node, value):
+    kind = node[0]
+    if kind == "struct":
+        return "{" + ", ".join(f"{name} = {_format(child, value[name])}" for name, child in node[2]) + "}"
+    if kind in ("list", "vec"):
+        children = node[1] if kind == "list" else [node[2]]*len(value)
+        text = ", ".join(_format(child, v) for child, v in zip(children, value))
+        return "{" + text + (", ..." if node[-1] else "") + "}"
+    if kind == "str":
+        text = value.split(b"\0", 1)[0].decode("latin-1")
+        return '"' + text.encode("unicode_escape").decode().replace('"', '\\"') + '"' + ("..." if node[2] else "")
+    if kind == "ptr":
+        return f"({node[2]}) 0x{value:x}"
+    if kind == "char":
+        return f"{value} {repr(chr(value & 0xff))}"
+    if kind == "void":
+        return "void"
+    return str(value)
+
+
+class DebugInfo:
+    """Variables with a static address and their types, from the .debug_info of an ELF file"""
+
+    def __init__(self, elf_file, variables=True):
+        elf = ElfFile(elf_file)
+        self.elf = elf
+        def section(name):
+            sec = elf.section(name)
+            return elf.read_section(sec) if sec is not None else b""
+        self.info = section(".debug_info")
+        self.abbrev = section(".debug_abbrev")
+        self.str = section(".debug_str")
+        self.line_str = section(".debug_line_str")
+        self.str_offsets = section(".debug_str_offsets")
+        self.addr = section(".debug_addr")
+        self.units = []
+        self.unit_starts = []
+        self.abbrev_tables = {}
+        self.variables = {}
+        self.type_names = {}
+        self.layouts = {}
+        self.scan_variables = variables
+        self._scan()
+
+    def __len__(self):
+        return len(self.variables)
+
+    # DIE decoding
+
+    def _abbrevs(self, offset, unit):
+        key = (offset, unit.addr_size, unit.offset_size, unit.version)
+        table = self.abbrev_tables.get(key)
+        if table is not None:
+            return table
+        table = {}
+        data = self.abbrev
+        pos = offset
+        while True:
+            code, pos = _uleb(data, pos)
+            if code == 0:
+                break
+            tag, pos = _uleb(data, pos)
+            has_children = data[pos] != 0
+            pos += 1
+            specs = []
+            fixed = 0
+            while True:
+                attr, pos = _uleb(data, pos)
+                form, pos = _uleb(data, pos)
+                if attr == 0 and form == 0:
+                    break
+                const = None
+                if form == 0x21:
+                    const, pos = _sleb(data, pos)
+                specs.append((attr, form, const))
+                size = _FORM_SIZE.get(form)
+                if fixed is not None and size is not None:
+                    fixed += self._form_size(size, unit)
+                else:
+                    fixed = None
+            # fixed: total size of the attributes if all of them have a fixed size, to skip the DIE fast
+            table[code] = (tag, has_children, specs, fixed)
+        self.abbrev_tables[key] = table
+        return table
+
+    @staticmethod
+    def _form_size(size, unit):
+        if size == "addr":
+            return unit.addr_size
+        if size == "offset":
+            return unit.offset_size
+        if size == "ref_addr":
+            return unit.offset_size if unit.version >= 3 else unit.addr_size
+        return size
+
+    def _read_form(self, pos, form, const, unit):
+        """Read an attribute value, returns (value, pos)
+
+        Block forms give bytes, references give absolute .debug_info offsets, string forms give
+        the string except strx (kept as ("strx", index) until the unit base is known).
+        """
+        data = self.info
+        size = _FORM_SIZE.get(form)
+        if size is not None:
+            size = self._form_size(size, unit)
+            if form == 0x21:
+                return const, pos
+            if form == 0x19:
+                return True, pos
+            value = int.from_bytes(data[pos:pos + size], "little")
+            pos += size
+            if form in _FORM_REF_UNIT:
+                value += unit.start
+            elif form == 0x0e:
+                value = _cstr(self.str, value)[0]
+            elif form == 0x1f:
+                value = _cstr(self.line_str, value)[0]
+            elif form in _FORM_STRX:
+                value = ("strx", value)
+            elif form in _FORM_ADDRX:
+                value = ("addrx", value)
+            return value, pos
+        if form in _FORM_ULEB:
+            value, pos = _uleb(data, pos)
+            if form == 0x15:
+                value += unit.start
+            elif form in _FORM_STRX:
+                value = ("strx", value)
+            elif form in _FORM_ADDRX:
+                value = ("addrx", value)
+            return value, pos
+        if form == 0x0d:
+            return _sleb(data, pos)
+        if form == 0x08:
+            return _cstr(data, pos)
+        if form in (0x09, 0x18):
+            length, pos = _uleb(data, pos)
+            return bytes(data[pos:pos + length]), pos + length
+        if form in _FORM_BLOCK:
+            n = _FORM_BLOCK[form]
+            length = int.from_bytes(data[pos:pos + n], "little")
+            pos += n
+            return bytes(data[pos:pos + length]), pos + length
+        if form == 0x16:
+            form, pos = _uleb(data, pos)
+            return self._read_form(pos, form, None, unit)
+        raise ValueError(f"unsupported DWARF form 0x{form:x}")
+
+    def _resolve(self, value, unit):
+        """Resolve ("strx", i)/("addrx", i) values through the unit bases"""
+        if not isinstance(value, tuple):
+            return value
+        kind, index = value
+        if kind == "strx":
+            pos = unit.str_offsets_base + index*unit.offset_size
+            return _cstr(self.str, int.from_bytes(self.str_offsets[pos:pos + unit.offset_size], "little"))[0]
+        pos = unit.addr_base + index*unit.addr_size
+        return int.from_bytes(self.addr[pos:pos + unit.addr_size], "little")
+
+    def _die_at(self, pos, unit):
+        """Parse the DIE at pos, returns (tag, attrs, has_children, next pos), tag is 0 for a null entry"""
+        code, pos = _uleb(self.info, pos)
+        if code == 0:
+            return 0, None, False, pos
+        tag, has_children, specs, _ = unit.abbrevs[code]
+        attrs = {}
+        for attr, form, const in specs:
+            attrs[attr], pos = self._read_form(pos, form, const, unit)
+        return tag, attrs, has_children, pos
+
+    def _unit_of(self, offset):
+        return self.units[bisect.bisect_right(self.unit_starts, offset) - 1]
+
+    def die(self, offset):
+        """Get (tag, attrs) of the DIE at a .debug_info offset, strings and addresses are resolved"""
+        unit = self._unit_of(offset)
+        tag, attrs, _, _ = self._die_at(offset, unit)
+        return tag, {k: self._resolve(v, unit) for k, v in attrs.items()}
+
+    def children(self, offset):
+        """Get the offsets of the children of a DIE"""
+        unit = self._unit_of(offset)
+        _, _, has_children, pos = self._die_at(offset, unit)
+        result = []
+        depth = 1 if has_children else 0
+        while depth > 0 and pos < unit.end:
+            child = pos
+            tag, attrs, has_children, pos = self._die_at(pos, unit)
+            if tag == 0:
+                depth -= 1
+                continue
+            if depth == 1:
+                result.append(child)
+            if has_children:
+                sibling = attrs.get(DW_AT_sibling)
+                if depth == 1 and sibling is not None and sibling > pos:
+                    pos = sibling
+                else:
+                    depth += 1
+        return result
+
+    # Variables
+
+    def _location_addr(self, block, unit):
+        if not isinstance(block, bytes) or not block:
+            return None
+        if block[0] == DW_OP_addr and len(block) == 1 + unit.addr_size:
+            return int.from_bytes(block[1:], "little")
+        if block[0] in (DW_OP_addrx, DW_OP_GNU_addr_index):
+            index, pos = _uleb(block, 1)
+            if pos == len(block):
+                return self._resolve(("addrx", index), unit)
+        return None
+
+    def _scan(self):
+        data = self.info
+        pos = 0
+        pending = []
+        while pos + 11 <= len(data):
+            unit = _Unit()
+            unit.start = pos
+            length = int.from_bytes(data[pos:pos + 4], "little")
+            pos += 4
+            unit.offset_size = 4
+            if length == 0xffffffff:
+                length = int.from_bytes(data[pos:pos + 8], "little")
+                pos += 8
+                unit.offset_size = 8
+            unit.end = pos + length
+            unit.version = int.from_bytes(data[pos:pos + 2], "little")
+            pos += 2
+            if unit.version >= 5:
+                unit_type = data[pos]
+                unit.addr_size = data[pos + 1]
+                abbrev_offset = int.from_bytes(data[pos + 2:pos + 2 + unit.offset_size], "little")
+                pos += 2 + unit.offset_size
+                if unit_type in (4, 5):
+                    pos += 8
+                elif unit_type in (2, 6):
+                    pos += 8 + unit.offset_size
+            else:
+                abbrev_offset = int.from_bytes(data[pos:pos + unit.offset_size], "little")
+                unit.addr_size = data[pos + unit.offset_size]
+                pos += unit.offset_size + 1
+            unit.str_offsets_base = 8 if unit.offset_size == 4 else 16
+            unit.addr_base = 8
+            unit.stmt_list = None
+            unit.comp_dir = None
+            unit.abbrevs = self._abbrevs(abbrev_offset, unit)
+            self.units.append(unit)
+            self.unit_starts.append(unit.start)
+            self._scan_unit(pos, unit, pending)
+            pos = unit.end
+        # Definitions of declared variables get the name from the declaration
+        for addr, offset, depth in pending:
+            tag, attrs = self.die(offset)
+            for _ in range(4):
+                if DW_AT_name in attrs:
+                    break
+                ref = attrs.get(DW_AT_specification, attrs.get(DW_AT_abstract_origin))
+                if ref is None:
+                    break
+                tag, attrs = self.die(ref)
+            name = attrs.get(DW_AT_name)
+            if name and (name not in self.variables or self.variables[name][2] > depth):
+                self.variables[name] = (addr, offset, depth)
+
+    def _scan_unit(self, pos, unit, pending):
+        data = self.info
+        abbrevs = unit.abbrevs
+        depth = 0
+        first = True
+        while pos < unit.end:
+            offset = pos
+            code, pos = _uleb(data, pos)
+            if code == 0:
+                depth -= 1
+                if depth <= 0 and not first:
+                    break
+                continue
+            tag, has_children, specs, fixed = abbrevs[code]
+            if first or tag == DW_TAG_variable:
+                attrs = {}
+                for attr, form, const in specs:
+                    attrs[attr], pos = self._read_form(pos, form, const, unit)
+                if first:
+                    unit.str_offsets_base = attrs.get(DW_AT_str_offsets_base, unit.str_offsets_base)
+                    unit.addr_base = attrs.get(DW_AT_addr_base, unit.addr_base)
+                    unit.stmt_list = attrs.get(DW_AT_stmt_list)
+                    unit.comp_dir = self._resolve(attrs.get(DW_AT_comp_dir), unit)
+                    if not self.scan_variables:
+                        break
+                    first = False
+                else:
+                    addr = self._location_addr(attrs.get(DW_AT_location), unit)
+                    if addr is not None:
+                        name = self._resolve(attrs.get(DW_AT_name), unit)
+                        if name is None:
+                            pending.append((addr, offset, depth))
+                        elif name not in self.variables or self.variables[name][2] > depth:
+                            self.variables[name] = (addr, offset, depth)
+            elif fixed is not None:
+                pos += fixed
+            else:
+                for attr, form, const in specs:
+                    _, pos = self._read_form(pos, form, const, unit)
+            if has_children:
+                depth += 1
+
+    def comp_dirs(self):
+        """Get the compilation directory of the units by the offset of their line program
+
+        Returns:
+            dict: .debug_line offset -> DW_AT_comp_dir
+        """
+        return {u.stmt_list: u.comp_dir for u in self.units if u.stmt_list is not None and u.comp_dir}
+
+    def variable(self, name):
+        """Get (address, type offset) of a variable, None if not found"""
+        var = self.variables.get(name)
+        if var is None:
+            return None
+        tag, attrs = self.die(var[1])
+        for _ in range(4):
+            if DW_AT_type in attrs:
+                break
+            ref = attrs.get(DW_AT_specification, attrs.get(DW_AT_abstract_origin))
+            if ref is None:
+                break
+            tag, attrs = self.die(ref)
+        return var[0], attrs.get(DW_AT_type)
+
+    # Types
+
+    def _strip(self, offset):
+        """Skip typedefs and qualifiers, returns (offset, tag, attrs) of the real type"""
+        for _ in range(32):
+            if offset is None:
+                return None, None, None
+            tag, attrs = self.die(offset)
+            if tag not in (DW_TAG_typedef, DW_TAG_const_type, DW_TAG_volatile_type,
+                           DW_TAG_restrict_type, DW_TAG_atomic_type):
+                return offset, tag, attrs
+            offset = attrs.get(DW_AT_type)
+        return None, None, None
+
+    def _dims(self, offset):
+        dims = []
+        for child in self.children(offset):
+            tag, attrs = self.die(child)
+            if tag != DW_TAG_subrange_type:
+                continue
+            count = attrs.get(DW_AT_count)
+            if not isinstance(count, int) or isinstance(count, bool):
+                upper = attrs.get(DW_AT_upper_bound)
+                lower = attrs.get(DW_AT_lower_bound, 0)
+                count = upper - lower + 1 if isinstance(upper, int) and isinstance(lower, int) else 0
+            dims.append(max(count, 0))
+        return dims
+
+    def type_size(self, offset):
+        """Get the size in bytes of a type"""
+        offset, tag, attrs = self._strip(offset)
+        if offset is None:
+            return 0
+        if DW_AT_byte_size in attrs:
+            return attrs[DW_AT_byte_size]
+        if tag in (DW_TAG_pointer_type, DW_TAG_reference_type, DW_TAG_rvalue_reference_type):
+            return self._unit_of(offset).addr_size
+        if tag == DW_TAG_array_type:
+            size = self.type_size(attrs.get(DW_AT_type))
+            for n in self._dims(offset):
+                size *= n
+            return size
+        return 0
+
+    def type_name(self, offset):
+        """Get the C name of a type"""
+        if offset is None:
+            return "void"
+        name = self.type_names.get(offset)
+        if name is not None:
+            return name
+        self.type_names[offset] = "..."
+        tag, attrs = self.die(offset)
+        base = attrs.get(DW_AT_name)
+        if tag in (DW_TAG_pointer_type, DW_TAG_reference_type, DW_TAG_rvalue_reference_type):
+            name = self.type_name(attrs.get(DW_AT_type)) + (" *" if tag == DW_TAG_pointer_type else " &")
+        elif tag in (DW_TAG_const_type, DW_TAG_volatile_type, DW_TAG_restrict_type, DW_TAG_atomic_type):
+            qualifier = {DW_TAG_const_type: "const", DW_TAG_volatile_type: "volatile",
+                         DW_TAG_restrict_type: "restrict", DW_TAG_atomic_type: "_Atomic"}[tag]
+            name = self.type_name(attrs.get(DW_AT_type))
+            if not name.startswith(qualifier + " "):
+                name = f"{qualifier} {name}"
+        elif tag == DW_TAG_array_type:
+            name = self.type_name(attrs.get(DW_AT_type)) + "".join(f"[{n}]" for n in self._dims(offset))
+        elif tag in (DW_TAG_structure_type, DW_TAG_union_type, DW_TAG_class_type, DW_TAG_enumeration_type):
+            keyword = {DW_TAG_structure_type: "struct", DW_TAG_union_type: "union",
+                       DW_TAG_class_type: "class", DW_TAG_enumeration_type: "enum"}[tag]
+            name = f"{keyword} {base or '{...}'}"
+        elif tag == DW_TAG_subroutine_type:
+            name = "func"
+        else:
+            name = base or "?"
+        self.type_names[offset] = name
+        return name
+
+    def layout(self, type_offset):
+        """Get the compiled layout of a type (compiled once)
+
+        Args:
+            type_offset (int): .debug_info offset of the type DIE
+        Returns:
+            VarLayout: Layout of the type
+        """
+        layout = self.layouts.get(type_offset)
+        if layout is None:
+            leaves = []
+            extent = [0]
+            root = self._compile(type_offset, 0, leaves, extent)
+            layout = VarLayout(self.type_name(type_offset), self.type_size(type_offset), root, leaves, extent[0])
+            self.layouts[type_offset] = layout
+        return layout
+
+    def part_type(self, type_offset, path):
+        """Get the type and the offset of a part of a variable
+
+        Args:
+            type_offset (int): .debug_info offset of the type DIE of the variable
+            path (string): Member and index accessors, eg: ".a.b[2]"
+        Returns:
+            (type name, offset): Type of the part and its offset in the variable
+        """
+        offset = 0
+        dims = []    # dimensions left of the array being indexed
+        for member, index in re.findall(r"\.\s*(\w+)|\[\s*(\d+)\s*\]", path):
+            if dims:
+                index = int(index) if index else None
+            else:
+                real, tag, attrs = self._strip(type_offset)
+                if member:
+                    cattrs = None
+                    if tag in (DW_TAG_structure_type, DW_TAG_union_type, DW_TAG_class_type):
+                        cattrs = next((a for t, a in map(self.die, self.children(real))
+                                       if t == DW_TAG_member and a.get(DW_AT_name) == member), None)
+                    if cattrs is None:
+                        raise KeyError(f"no member named {member}")
+                    offset += self._member_location(cattrs)
+                    type_offset = cattrs.get(DW_AT_type)
+                    continue
+                if tag != DW_TAG_array_type:
+                    raise IndexError(f"index {index} out of range")
+                dims = self._dims(real) or [0]
+                type_offset = attrs.get(DW_AT_type)
+                index = int(index)
+            if index is None:
+                raise KeyError(f"no member named {member}")
+            stride = self.type_size(type_offset)
+            for d in dims[1:]:
+                stride *= d
+            offset += index*stride
+            dims = dims[1:]
+        return self.type_name(type_offset) + "".join(f"[{n}]" for n in dims), offset
+
+    def _member_location(self, attrs):
+        location = attrs.get(DW_AT_data_member_location, 0)
+        if isinstance(location, bytes):
+            location = _uleb(location, 1)[0] if location[:1] == bytes([DW_OP_plus_uconst]) else 0
+        return location
+
+    def _leaf(self, leaves, extent, offset, fmt, size, count=1):
+        leaves.append((offset, fmt, size, count))
+        extent[0] = max(extent[0], offset + size)
+        return len(leaves) - 1
+
+    def _scalar(self, offset, tag, attrs):
+        """Get (node kind, format, size, extra) of a scalar type, None if not a scalar"""
+        size = attrs.get(DW_AT_byte_size)
+        if tag == DW_TAG_base_type:
+            enc = attrs.get(DW_AT_encoding)
+            if enc == DW_ATE_float:
+                return ("num", _FLOAT_FMT[size], size, None) if size in _FLOAT_FMT else ("big", "%ds" % size, size, False)
+            signed = enc in (DW_ATE_signed, DW_ATE_signed_char)
+            if size not in _INT_FMT:
+                return "big", "%ds" % size, size, signed
+            fmt = _INT_FMT[size].lower() if signed else _INT_FMT[size]
+            if enc == DW_ATE_boolean:
+                return "bool", fmt, size, None
+            if enc in (DW_ATE_signed_char, DW_ATE_unsigned_char) and size == 1:
+                return "char", fmt, size, None
+            return "num", fmt, size, None
+        if tag in (DW_TAG_pointer_type, DW_TAG_reference_type, DW_TAG_rvalue_reference_type):
+            size = size or self._unit_of(offset).addr_size
+            return "ptr", _INT_FMT.get(size, "Q"), size, self.type_name(offset)
+        if tag == DW_TAG_enumeration_type:
+            size = size or 4
+            mask = (1 << (8*size)) - 1
+            names = {}
+            for child in self.children(offset):
+                ctag, cattrs = self.die(child)
+                value = cattrs.get(DW_AT_const_value)
+                if ctag == DW_TAG_enumerator and isinstance(value, int):
+                    names.setdefault(value & mask, cattrs.get(DW_AT_name))
+            return "enum", _INT_FMT.get(size, "Q"), size, names
+        return None
+
+    def _compile(self, type_offset, base, leaves, extent):
+        offset, tag, attrs = self._strip(type_offset)
+        if offset is None:
+            return ("void",)
+        scalar = self._scalar(offset, tag, attrs)
+        if scalar is not None:
+            kind, fmt, size, extra = scalar
+            lid = self._leaf(leaves, extent, base, fmt, size)
+            return (kind, lid, extra)
+        if tag in (DW_TAG_structure_type, DW_TAG_union_type, DW_TAG_class_type):
+            members = []
+            for child in self.children(offset):
+                ctag, cattrs = self.die(child)
+                if ctag not in (DW_TAG_member, DW_TAG_inheritance):
+                    continue
+                name = cattrs.get(DW_AT_name)
+                if ctag == DW_TAG_inheritance:
+                    name = "<%s>" % self.type_name(cattrs.get(DW_AT_type))
+                if not name:
+                    name = "<anon%d>" % len(members)
+                location = self._member_location(cattrs)
+                bit_size = cattrs.get(DW_AT_bit_size)
+                if bit_size:
+                    members.append((name, self._bits(cattrs, base + location, bit_size, extent)))
+                else:
+                    members.append((name, self._compile(cattrs.get(DW_AT_type), base + location, leaves, extent)))
+            return ("struct", self.type_name(offset), members)
+        if tag == DW_TAG_array_type:
+            return self._array(attrs.get(DW_AT_type), self._dims(offset) or [0], base, leaves, extent)
+        return ("void",)
+
+    def _bits(self, attrs, base, bit_size, extent):
+        """Compile a bit field member, base is the byte offset of its storage unit"""
+        elem, tag, tattrs = self._strip(attrs.get(DW_AT_type))
+        if DW_AT_data_bit_offset in attrs:
+            bit = 8*base + attrs[DW_AT_data_bit_offset]
+        else:
+            # DWARF 2/3: bit_offset counts from the most significant bit of the storage unit
+            unit_size = attrs.get(DW_AT_byte_size, (tattrs or {}).get(DW_AT_byte_size, 4))
+            bit = 8*base + 8*unit_size - attrs.get(DW_AT_bit_offset, 0) - bit_size
+        offset, shift = bit//8, bit % 8
+        nbytes = (shift + bit_size + 7)//8
+        extent[0] = max(extent[0], offset + nbytes)
+        signed = tag == DW_TAG_base_type and tattrs.get(DW_AT_encoding) in (DW_ATE_signed, DW_ATE_signed_char)
+        names = None
+        if tag == DW_TAG_enumeration_type:
+            mask = (1 << bit_size) - 1
+            names = {k & mask: v for k, v in self._scalar(elem, tag, tattrs)[3].items()}
+        return ("bits", offset, nbytes, shift, bit_size, signed, names)
+
+    def _array(self, elem_offset, dims, base, leaves, extent):
+        count = dims[0]
+        n = min(count, VAR_ARRAY_MAX)
+        truncated = n < count
+        stride = self.type_size(elem_offset)
+        for d in dims[1:]:
+            stride *= d
+        if len(dims) == 1:
+            offset, tag, attrs = self._strip(elem_offset)
+            scalar = self._scalar(offset, tag, attrs) if offset is not None else None
+            if scalar is not None and scalar[0] != "big":
+                kind, fmt, size, extra = scalar
+                if kind == "char":
+                    return ("str", self._leaf(leaves, extent, base, "%ds" % n, n), truncated)
+                lid = self._leaf(leaves, extent, base, "%d%s" % (n, fmt), n*size, n)
+                return ("vec", lid, (kind, None, extra), truncated)
+        children = []
+        for i in range(n):
+            if len(dims) > 1:
+                children.append(self._array(elem_offset, dims[1:], base + i*stride, leaves, extent))
+            else:
+                children.append(self._compile(elem_offset, base + i*stride, leaves, extent))
+        return ("list", children, truncated)
+
+
+def read_debug_info(elf_file):
+    """Scan the .debug_info section of an ELF file for variables
+
+    Args:
+        elf_file (string): Path to the ELF file
+    Returns:
+        DebugInfo: Variables and types (empty if the file has no debug info)
+    """
+    return DebugInfo(elf_file)
@@ -0,0 +1,358 @@
+#coding=utf-8
+"""DWARF .debug_line decoder (DWARF 2 - 5) and a compact PC -> file:line table
+
+The decoded rows are kept in flat sorted arrays. The table file written by LineTable.dump
+keeps every array 8-byte aligned, so LineTable.load can map it without copying.
+"""
+
+import bisect
+import mmap
+import struct
+from array import array
+from XSPdb.cmd.xelf import ElfFile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NO_FILE = 0xffffffff
+
+_LINE_CACHE_MAGIC = b"XSPLINE1"
+LINE_TABLE_VERSION = 2
+
+DW_LNS_copy = 1
+DW_LNS_advance_pc = 2
+DW_LNS_advance_line = 3
+DW_LNS_set_file = 4
+DW_LNS_set_column = 5
+DW_LNS_negate_stmt = 6
+DW_LNS_set_basic_block = 7
+DW_LNS_const_add_pc = 8
+DW_LNS_fixed_advance_pc = 9
+DW_LNE_end_sequence = 1
+DW_LNE_set_address = 2
+DW_LNE_define_file = 3
+
+DW_LNCT_path = 1
+DW_LNCT_directory_index = 2
+
+DW_FORM_block = 0x09
+DW_FORM_data1 = 0x0b
+DW_FORM_data2 = 0x05
+DW_FORM_data4 = 0x06
+DW_FORM_data8 = 0x07
+DW_FORM_data16 = 0x1e
+DW_FORM_string = 0x08
+DW_FORM_strp = 0x0e
+DW_FORM_udata = 0x0f
+DW_FORM_line_strp = 0x1f
+
+
+def _uleb(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _sleb(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        shift += 7
+        if b < 0x80:
+            if b & 0x40:
+                result -= 1 << shift
+            return result, pos
+
+
+def _cstr(data, pos):
+    end = data.index(b"\0", pos)
+    return bytes(data[pos:end]).decode(errors="replace"), end + 1
+
+
+class LineTable:
+    """Sorted rows of (address, file, line), a row with file NO_FILE ends a sequence"""
+
+    def __init__(self):
+        self.addr = array('Q')
+        self.file = array('I')
+        self.line = array('I')
+        self.files = []
+        self._mm = None
+
+    def __len__(self):
+        return len(self.addr)
+
+    def lookup(self, address):
+        """Get the row covering an address, -1 if not covered"""
+        i = bisect.bisect_right(self.addr, address) - 1
+        if i < 0 or self.file[i] == NO_FILE:
+            return -1
+        return i
+
+    def lookup_many(self, addresses):
+        """Vectorized lookup()
+
+        Args:
+            addresses (list/ndarray): Addresses
+        Returns:
+            ndarray/list: Row of each address, -1 if not covered
+        """
+        if np is None:
+            return [self.lookup(a) for a in addresses]
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        if len(self.addr) == 0:
+            return np.full(len(addresses), -1, dtype=np.int64)
+        rows = np.searchsorted(np.frombuffer(self.addr, dtype=np.uint64), addresses, side="right").astype(np.int64) - 1
+        files = np.frombuffer(self.file, dtype=np.uint32)[np.maximum(rows, 0)]
+        return np.where((rows >= 0) & (files != NO_FILE), rows, -1)
+
+    def location(self, row):
+        """Get (file, line) of a row"""
+        return self.files[self.file[row]], self.line[row]
+
+    def dump(self, f):
+        """Write the table to a binary file (arrays are 8-byte aligned)"""
+        names = "\0".join(self.files).encode()
+        count = len(self.addr)
+        f.write(_LINE_CACHE_MAGIC + struct.pack("<QQQ", count, len(self.files), len(names)))
+        f.write(self.addr.tobytes())
+        f.write(self.file.tobytes())
+        f.write(self.line.tobytes())
+        f.write(bytes((8 - count*8) % 8))
+        f.write(names)
+
+    @classmethod
+    def load(cls, path):
+        """Map a table written by dump()"""
+        self = cls()
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        head = len(_LINE_CACHE_MAGIC) + 24
+        assert mm[:len(_LINE_CACHE_MAGIC)] == _LINE_CACHE_MAGIC, "bad line table magic"
+        count, nfiles, names_size = struct.unpack_from("<QQQ", mm, len(_LINE_CACHE_MAGIC))
+        view = memoryview(mm)
+        pos = head
+        self.addr = view[pos:pos + count*8].cast("Q")
+        pos += count*8
+        self.file = view[pos:pos + count*4].cast("I")
+        pos += count*4
+        self.line = view[pos:pos + count*4].cast("I")
+        pos += count*4
+        names = bytes(view[pos:pos + names_size])
+        assert len(names) == names_size, "line table truncated"
+        self.files = names.decode(errors="replace").split("\0") if nfiles else []
+        self._mm = mm
+        return self
+
+
+class _LineProgram:
+    """Header of one line number program"""
+
+    def __init__(self, data, pos, is_64, str_sections, comp_dir=""):
+        unit_length = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+        self.offset_size = 4
+        if unit_length == 0xffffffff:
+            unit_length = struct.unpack_from("<Q", data, pos)[0]
+            pos += 8
+            self.offset_size = 8
+        self.end = pos + unit_length
+        self.version = struct.unpack_from("<H", data, pos)[0]
+        pos += 2
+        self.address_size = 8 if is_64 else 4
+        if self.version >= 5:
+            self.address_size = data[pos]
+            pos += 2
+        header_length = int.from_bytes(data[pos:pos + self.offset_size], "little")
+        pos += self.offset_size
+        self.program = pos + header_length
+        self.min_inst_length = data[pos]
+        pos += 1
+        if self.version >= 4:
+            pos += 1    # maximum_operations_per_instruction, VLIW only
+        self.default_is_stmt = data[pos]
+        self.line_base = struct.unpack_from("<b", data, pos + 1)[0]
+        self.line_range = data[pos + 2]
+        self.opcode_base = data[pos + 3]
+        pos += 4
+        self.opcode_lengths = list(data[pos:pos + self.opcode_base - 1])
+        pos += self.opcode_base - 1
+        self.str_sections = str_sections
+        if self.version >= 5:
+            self.dirs = [e.get(DW_LNCT_path, "") for e in self._read_entries(data, pos)]
+            pos = self._pos
+            # Directory 0 is the compilation directory, the others may be relative to it
+            if self.dirs:
+                self.dirs[1:] = [self._join(d, 0) for d in self.dirs[1:]]
+            self.file_names = [self._join(e.get(DW_LNCT_path, ""), e.get(DW_LNCT_directory_index, 0))
+                               for e in self._read_entries(data, pos)]
+        else:
+            # Directory 0 is the compilation directory (DW_AT_comp_dir of the unit)
+            self.dirs = [comp_dir]
+            while data[pos] != 0:
+                name, pos = _cstr(data, pos)
+                self.dirs.append(self._join(name, 0))
+            pos += 1
+            # File indexes start from 1 before DWARF 5
+            self.file_names = [""]
+            while data[pos] != 0:
+                name, pos = _cstr(data, pos)
+                dir_index, pos = _uleb(data, pos)
+                _, pos = _uleb(data, pos)
+                _, pos = _uleb(data, pos)
+                self.file_names.append(self._join(name, dir_index))
+
+    def _join(self, name, dir_index):
+        if name.startswith("/") or dir_index >= len(self.dirs) or not self.dirs[dir_index]:
+            return name
+        return self.dirs[dir_index].rstrip("/") + "/" + name
+
+    def _read_form(self, data, pos, form):
+        if form == DW_FORM_string:
+            return _cstr(data, pos)
+        if form in (DW_FORM_line_strp, DW_FORM_strp):
+            offset = int.from_bytes(data[pos:pos + self.offset_size], "little")
+            strs = self.str_sections.get(form, b"")
+            end = strs.find(b"\0", offset)
+            return strs[offset:end].decode(errors="replace"), pos + self.offset_size
+        if form == DW_FORM_udata:
+            return _uleb(data, pos)
+        size = {DW_FORM_data1: 1, DW_FORM_data2: 2, DW_FORM_data4: 4, DW_FORM_data8: 8, DW_FORM_data16: 16}.get(form)
+        if size is None and form == DW_FORM_block:
+            size, pos = _uleb(data, pos)
+        assert size is not None, f"unsupported DWARF form 0x{form:x} in line table header"
+        return int.from_bytes(data[pos:pos + size], "little"), pos + size
+
+    def _read_entries(self, data, pos):
+        format_count = data[pos]
+        pos += 1
+        formats = []
+        for _ in range(format_count):
+            content, pos = _uleb(data, pos)
+            form, pos = _uleb(data, pos)
+            formats.append((content, form))
+        count, pos = _uleb(data, pos)
+        entries = []
+        for _ in range(count):
+            entry = {}
+            for content, form in formats:
+                entry[content], pos = self._read_form(data, pos, form)
+            entries.append(entry)
+        self._pos = pos
+        return entries
+
+    def run(self, data, file_map, rows):
+        """Run the program, rows (address, is_end, file, line) are appended to rows"""
+        min_inst = self.min_inst_length
+        line_base = self.line_base
+        line_range = self.line_range
+        opcode_base = self.opcode_base
+        file_names = self.file_names
+        def gfile(index):
+            name = file_names[index] if index < len(file_names) else f"<file {index}>"
+            g = file_map.get(name)
+            if g is None:
+                g = file_map[name] = len(file_map)
+            return g
+        file_cache = {}
+        address, file, line = 0, 1, 1
+        pos, end = self.program, self.end
+        while pos < end:
+            op = data[pos]
+            pos += 1
+            if op >= opcode_base:
+                adj = op - opcode_base
+                address += (adj // line_range) * min_inst
+                line += line_base + adj % line_range
+                g = file_cache.get(file)
+                if g is None:
+                    g = file_cache[file] = gfile(file)
+                rows.append((address, 1, g, line))
+            elif op == DW_LNS_copy:
+                g = file_cache.get(file)
+                if g is None:
+                    g = file_cache[file] = gfile(file)
+                rows.append((address, 1, g, line))
+            elif op == DW_LNS_advance_pc:
+                v, pos = _uleb(data, pos)
+                address += v * min_inst
+            elif op == DW_LNS_advance_line:
+                v, pos = _sleb(data, pos)
+                line += v
+            elif op == DW_LNS_set_file:
+                file, pos = _uleb(data, pos)
+            elif op == DW_LNS_const_add_pc:
+                address += ((255 - opcode_base) // line_range) * min_inst
+            elif op == DW_LNS_fixed_advance_pc:
+                address += data[pos] | data[pos + 1] << 8
+                pos += 2
+            elif op == 0:
+                length, pos = _uleb(data, pos)
+                sub_op = data[pos]
+                if sub_op == DW_LNE_end_sequence:
+                    rows.append((address, 0, NO_FILE, 0))
+                    address, file, line = 0, 1, 1
+                elif sub_op == DW_LNE_set_address:
+                    address = int.from_bytes(data[pos + 1:pos + length], "little")
+                elif sub_op == DW_LNE_define_file:
+                    name, p = _cstr(data, pos + 1)
+                    dir_index, _ = _uleb(data, p)
+                    file_names.append(self._join(name, dir_index))
+                pos += length
+            elif op in (DW_LNS_set_column, DW_LNS_negate_stmt, DW_LNS_set_basic_block):
+                if op == DW_LNS_set_column:
+                    _, pos = _uleb(data, pos)
+            else:
+                # Unknown standard opcode: skip its ULEB operands
+                for _ in range(self.opcode_lengths[op - 1]):
+                    _, pos = _uleb(data, pos)
+
+
+def read_line_table(elf_file):
+    """Decode the .debug_line section of an ELF file
+
+    Args:
+        elf_file (string): Path to the ELF file
+    Returns:
+        LineTable: Rows sorted by address (empty if the file has no line info)
+    """
+    elf = ElfFile(elf_file)
+    table = LineTable()
+    sec = elf.section(".debug_line")
+    if sec is None:
+        return table
+    comp_dirs = {}
+    if elf.section(".debug_info") is not None:
+        from XSPdb.cmd.xdinfo import DebugInfo    # xdinfo imports this module
+        comp_dirs = DebugInfo(elf_file, variables=False).comp_dirs()
+    data = elf.read_section(sec)
+    str_sections = {}
+    for form, name in ((DW_FORM_line_strp, ".debug_line_str"), (DW_FORM_strp, ".debug_str")):
+        s = elf.section(name)
+        if s is not None:
+            str_sections[form] = elf.read_section(s)
+    file_map = {}
+    rows = []
+    pos = 0
+    while pos + 4 <= len(data):
+        prog = _LineProgram(data, pos, elf.is_64, str_sections, comp_dirs.get(pos, ""))
+        prog.run(data, file_map, rows)
+        pos = prog.end
+    # The end of a sequence sorts before a sequence starting at the same address
+    rows.sort(key=lambda r: (r[0], r[1]))
+    table.files = [None]*len(file_map)
+    for name, g in file_map.items():
+        table.files[g] = name
+    table.addr = array('Q', (r[0] for r in rows))
+    table.file = array('I', (r[2] for r in rows))
+    table.line = array('I', (r[3] & 0xffffffff for r in rows))
+    return table
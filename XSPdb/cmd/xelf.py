@@ -0,0 +1,381 @@
+#coding=utf-8
+"""A minimal ELF reader (ELF32/ELF64, little endian), no binutils needed
+
+Only the parts XSPdb uses are parsed: the file header, section headers, program headers
+and the symbol tables.
+"""
+
+import bisect
+import mmap
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ELF_MAGIC = b"\x7fELF"
+
+SHT_PROGBITS = 1
+SHT_NOBITS = 8
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+PT_LOAD = 1
+
+
+class ElfSection:
+    """A section header"""
+
+    def __init__(self, name_offset, sh_type, flags, addr, offset, size, link, info, addralign, entsize):
+        self.name_offset = name_offset
+        self.name = ""
+        self.type = sh_type
+        self.flags = flags
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.info = info
+        self.addralign = addralign
+        self.entsize = entsize
+
+    def is_exec(self):
+        return self.type == SHT_PROGBITS and self.flags & SHF_EXECINSTR != 0 and self.size > 0
+
+    def __repr__(self):
+        return f"ElfSection({self.name}, addr=0x{self.addr:x}, size=0x{self.size:x})"
+
+
+class ElfSegment:
+    """A program header"""
+
+    def __init__(self, p_type, flags, offset, vaddr, paddr, filesz, memsz):
+        self.type = p_type
+        self.flags = flags
+        self.offset = offset
+        self.vaddr = vaddr
+        self.paddr = paddr
+        self.filesz = filesz
+        self.memsz = memsz
+
+    def __repr__(self):
+        return f"ElfSegment(vaddr=0x{self.vaddr:x}, paddr=0x{self.paddr:x}, memsz=0x{self.memsz:x})"
+
+
+class ElfFile:
+    """Parsed headers of an ELF file, section data is read on demand"""
+
+    def __init__(self, file_path):
+        self.path = file_path
+        with open(file_path, "rb") as f:
+            ident = f.read(16)
+            assert len(ident) == 16 and ident[:4] == ELF_MAGIC, f"{file_path} is not an ELF file"
+            assert ident[5] == 1, "only little endian ELF is supported"
+            self.is_64 = ident[4] == 2
+            if self.is_64:
+                hdr = struct.unpack("<HHIQQQIHHHHHH", f.read(48))
+            else:
+                hdr = struct.unpack("<HHIIIIIHHHHHH", f.read(36))
+            (self.type, self.machine, _, self.entry, phoff, shoff, self.flags,
+             _, phentsize, phnum, shentsize, shnum, shstrndx) = hdr
+            self.sections = []
+            self.segments = []
+            if shoff and shnum:
+                f.seek(shoff)
+                raw = f.read(shentsize*shnum)
+                fmt = "<IIQQQQIIQQ" if self.is_64 else "<IIIIIIIIII"
+                for i in range(shnum):
+                    self.sections.append(ElfSection(*struct.unpack_from(fmt, raw, i*shentsize)))
+            if phoff and phnum:
+                f.seek(phoff)
+                raw = f.read(phentsize*phnum)
+                for i in range(phnum):
+                    if self.is_64:
+                        p_type, flags, offset, vaddr, paddr, filesz, memsz, _ = struct.unpack_from("<IIQQQQQQ", raw, i*phentsize)
+                    else:
+                        p_type, offset, vaddr, paddr, filesz, memsz, flags, _ = struct.unpack_from("<IIIIIIII", raw, i*phentsize)
+                    self.segments.append(ElfSegment(p_type, flags, offset, vaddr, paddr, filesz, memsz))
+            if 0 < shstrndx < len(self.sections):
+                names = self.read_section(self.sections[shstrndx])
+                for sec in self.sections:
+                    end = names.find(b"\0", sec.name_offset)
+                    sec.name = names[sec.name_offset:end if end >= 0 else None].decode(errors="replace")
+
+    def read_section(self, section):
+        """Read the data of a section (empty for NOBITS sections)"""
+        if section.type == SHT_NOBITS or section.size == 0:
+            return b""
+        with open(self.path, "rb") as f:
+            f.seek(section.offset)
+            return f.read(section.size)
+
+    def section(self, name):
+        """Find a section by name, None if not found"""
+        for sec in self.sections:
+            if sec.name == name:
+                return sec
+        return None
+
+    def exec_sections(self):
+        """Sections holding instructions"""
+        return [sec for sec in self.sections if sec.is_exec()]
+
+    def vaddr_to_paddr(self, vaddr):
+        """Map a virtual address to the physical (load) address through the PT_LOAD segments"""
+        for seg in self.segments:
+            if seg.type == PT_LOAD and seg.vaddr <= vaddr < seg.vaddr + max(seg.memsz, 1):
+                return seg.paddr + vaddr - seg.vaddr
+        return vaddr
+
+
+def is_elf_file(file_path):
+    """Check if a file starts with the ELF magic"""
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(4) == ELF_MAGIC
+    except OSError:
+        return False
+
+
+SHT_SYMTAB = 2
+SHT_DYNSYM = 11
+SHN_UNDEF = 0
+SHN_ABS = 0xfff1
+SHN_COMMON = 0xfff2
+
+STT_NAMES = {0: "NOTYPE", 1: "OBJECT", 2: "FUNC", 3: "SECTION", 4: "FILE", 5: "COMMON", 6: "TLS", 10: "GNU_IFUNC"}
+STB_NAMES = {0: "LOCAL", 1: "GLOBAL", 2: "WEAK", 10: "UNIQUE"}
+STV_NAMES = {0: "DEFAULT", 1: "INTERNAL", 2: "HIDDEN", 3: "PROTECTED"}
+
+_SYMTAB_CACHE_MAGIC = b"XSPSYM01"
+SYMTAB_VERSION = 2
+
+
+class ElfSymbolTable:
+    """Symbols of an ELF file in flat arrays, sorted by address
+
+    Names are kept as offsets into one string blob, the per-symbol dicts of readelf
+    style results are only built on demand (entry()).
+    """
+
+    def __init__(self):
+        self.addr = array('Q')
+        self.size = array('Q')
+        self.info = bytearray()
+        self.other = bytearray()
+        self.shndx = array('H')
+        self.name_off = array('I')
+        self.names = b""
+        self.by_name = array('I')    # symbol indexes sorted by name, then by order in the file
+        self.uaddr = array('Q')      # unique addresses
+        self.ustart = array('I')     # first symbol index of each unique address
+        self.iend = None             # end of the interval starting at each unique address
+
+    def __len__(self):
+        return len(self.addr)
+
+    def name(self, i):
+        off = self.name_off[i]
+        return self.names[off:self.names.index(b"\0", off)].decode(errors="replace")
+
+    def type(self, i):
+        return STT_NAMES.get(self.info[i] & 0xf, str(self.info[i] & 0xf))
+
+    def bind(self, i):
+        return STB_NAMES.get(self.info[i] >> 4, str(self.info[i] >> 4))
+
+    def vis(self, i):
+        return STV_NAMES.get(self.other[i] & 0x3, str(self.other[i] & 0x3))
+
+    def ndx(self, i):
+        n = self.shndx[i]
+        return {SHN_UNDEF: "UND", SHN_ABS: "ABS", SHN_COMMON: "COM"}.get(n, str(n))
+
+    def entry(self, i):
+        """Get a symbol as a dict (the format of readelf based results)"""
+        return {"addr": self.addr[i], "size": self.size[i], "type": self.type(i), "bind": self.bind(i),
+                "vis": self.vis(i), "ndx": self.ndx(i), "name": self.name(i)}
+
+    def at(self, address):
+        """Get the indexes of the symbols at an address"""
+        u = bisect.bisect_left(self.uaddr, address)
+        if u >= len(self.uaddr) or self.uaddr[u] != address:
+            return range(0)
+        return range(self.ustart[u], self.ustart[u + 1] if u + 1 < len(self.ustart) else len(self.addr))
+
+    def find(self, name):
+        """Get the index of a symbol by name, -1 if not found
+
+        Of symbols with the same name (e.g. static functions of several files), the last one
+        in the file is found, like the name dict of the readelf based parser.
+        """
+        lo, hi = 0, len(self.by_name)
+        while lo < hi:
+            mid = (lo + hi)//2
+            if self.name(self.by_name[mid]) <= name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo > 0 and self.name(self.by_name[lo - 1]) == name:
+            return self.by_name[lo - 1]
+        return -1
+
+    def build_index(self, order=None):
+        """Build the name and address indexes
+
+        Args:
+            order (list): Position of each symbol in the file, to sort symbols of the same name
+        """
+        if order is None:
+            self.by_name = array('I', sorted(range(len(self.addr)), key=self.name))
+        else:
+            self.by_name = array('I', sorted(range(len(self.addr)), key=lambda i: (self.name(i), order[i])))
+        self.uaddr = array('Q')
+        self.ustart = array('I')
+        for i, a in enumerate(self.addr):
+            if not self.uaddr or self.uaddr[-1] != a:
+                self.uaddr.append(a)
+                self.ustart.append(i)
+
+    def build_intervals(self):
+        """Build the address intervals: [unique address, end of the largest symbol there),
+        zero sized symbols (labels) reach the next symbol, SECTION/FILE symbols have no extent"""
+        count = len(self.uaddr)
+        if count == 0:
+            self.iend = array('Q')
+            return
+        if np is not None:
+            addr = np.frombuffer(self.addr, dtype=np.uint64)
+            size = np.frombuffer(self.size, dtype=np.uint64)
+            sym_type = np.frombuffer(bytes(self.info), dtype=np.uint8) & 0xf
+            size = np.where((sym_type == 3) | (sym_type == 4), np.uint64(0), size)
+            starts = np.frombuffer(self.uaddr, dtype=np.uint64)
+            ends = np.maximum.reduceat(addr + size, np.frombuffer(self.ustart, dtype=np.uint32).astype(np.intp))
+            next_starts = np.append(starts[1:], starts[-1] + np.uint64(1))
+            self.iend = np.where(ends == starts, next_starts, ends)
+            return
+        ends = array('Q', self.uaddr)
+        u = 0
+        for i, a in enumerate(self.addr):
+            if a != self.uaddr[u]:
+                u += 1
+            if self.info[i] & 0xf not in (3, 4):
+                ends[u] = max(ends[u], a + self.size[i])
+        for u in range(count):
+            if ends[u] == self.uaddr[u]:
+                ends[u] = self.uaddr[u + 1] if u + 1 < count else self.uaddr[u] + 1
+        self.iend = ends
+
+    def lookup(self, address):
+        """Get the interval (unique address index) containing an address, -1 if in a gap"""
+        if self.iend is None:
+            self.build_intervals()
+        u = bisect.bisect_right(self.uaddr, address) - 1
+        if u < 0 or address >= self.iend[u]:
+            return -1
+        return u
+
+    def lookup_many(self, addresses):
+        """Vectorized lookup()
+
+        Args:
+            addresses (list/ndarray): Addresses
+        Returns:
+            ndarray/list: Interval index of each address, -1 if in a gap
+        """
+        if self.iend is None:
+            self.build_intervals()
+        if np is None:
+            return [self.lookup(a) for a in addresses]
+        addresses = np.asarray(addresses, dtype=np.uint64)
+        if len(self.uaddr) == 0:
+            return np.full(len(addresses), -1, dtype=np.int64)
+        index = np.searchsorted(np.frombuffer(self.uaddr, dtype=np.uint64), addresses, side="right").astype(np.int64) - 1
+        valid = (index >= 0) & (addresses < self.iend[np.maximum(index, 0)])
+        return np.where(valid, index, -1)
+
+    def interval(self, u):
+        """Get (start, end) of an interval"""
+        if self.iend is None:
+            self.build_intervals()
+        return self.uaddr[u], int(self.iend[u])
+
+    def interval_names(self, u):
+        """Get the names of the symbols starting an interval"""
+        end = self.ustart[u + 1] if u + 1 < len(self.ustart) else len(self.addr)
+        return [self.name(i) for i in range(self.ustart[u], end)]
+
+    def dump(self, f):
+        """Write the table to a binary file"""
+        arrays = (self.addr, self.size, self.shndx, self.name_off, self.by_name, self.uaddr, self.ustart)
+        f.write(_SYMTAB_CACHE_MAGIC + struct.pack("<QQQ", len(self.addr), len(self.uaddr), len(self.names)))
+        f.write(bytes(self.info) + bytes(self.other) + self.names)
+        for a in arrays:
+            f.write(a.tobytes())
+
+    @classmethod
+    def load(cls, f):
+        """Read a table written by dump()"""
+        head = f.read(len(_SYMTAB_CACHE_MAGIC) + 24)
+        assert head[:len(_SYMTAB_CACHE_MAGIC)] == _SYMTAB_CACHE_MAGIC, "bad symbol cache magic"
+        count, ucount, names_size = struct.unpack_from("<QQQ", head, len(_SYMTAB_CACHE_MAGIC))
+        self = cls()
+        self.info = bytearray(f.read(count))
+        self.other = bytearray(f.read(count))
+        self.names = f.read(names_size)
+        for attr, n in (("addr", count), ("size", count), ("shndx", count), ("name_off", count),
+                        ("by_name", count), ("uaddr", ucount), ("ustart", ucount)):
+            a = getattr(self, attr)
+            a.frombytes(f.read(n*a.itemsize))
+            assert len(a) == n, "symbol cache truncated"
+        return self
+
+
+def read_elf_symbols(elf_file, keep=None):
+    """Read .symtab and .dynsym of an ELF file
+
+    Args:
+        elf_file (string): Path to the ELF file
+        keep (function): keep(info, shndx) -> bool, filter of the symbols; nameless symbols are always dropped
+    Returns:
+        ElfSymbolTable: Symbols sorted by address
+    """
+    elf = ElfFile(elf_file)
+    fmt = struct.Struct("<IBBHQQ" if elf.is_64 else "<IIIBBH")
+    entries = []
+    names = bytearray()
+    with open(elf_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for sec in elf.sections:
+            if sec.type not in (SHT_SYMTAB, SHT_DYNSYM) or not 0 < sec.link < len(elf.sections):
+                continue
+            strtab = elf.sections[sec.link]
+            base = len(names)
+            names += mm[strtab.offset:strtab.offset + strtab.size] + b"\0"
+            esize = sec.entsize or fmt.size
+            count = sec.size//esize
+            data = mm[sec.offset:sec.offset + count*esize]
+            if esize != fmt.size:
+                data = b"".join(data[i:i+fmt.size] for i in range(0, len(data), esize))
+            for sym in fmt.iter_unpack(data):
+                if elf.is_64:
+                    st_name, st_info, st_other, st_shndx, st_value, st_size = sym
+                else:
+                    st_name, st_value, st_size, st_info, st_other, st_shndx = sym
+                if st_name == 0 or names[base + st_name] == 0:
+                    continue
+                if keep is not None and not keep(st_info, st_shndx):
+                    continue
+                entries.append((st_value, st_size, st_info, st_other, st_shndx, base + st_name, len(entries)))
+    entries.sort(key=lambda e: e[0])
+    table = ElfSymbolTable()
+    table.names = bytes(names)
+    for value, size, info, other, shndx, name_off, _ in entries:
+        table.addr.append(value)
+        table.size.append(size)
+        table.info.append(info)
+        table.other.append(other)
+        table.shndx.append(shndx)
+        table.name_off.append(name_off)
+    table.build_index([e[6] for e in entries])
+    return table
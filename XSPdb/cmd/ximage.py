@@ -0,0 +1,155 @@
+#coding=utf-8
+"""Helpers for exporting memory images: zero page detection, sparse files and
+the indexed compressed image container (.xspz)
+
+Container layout (little endian):
+    header: magic(8) version(u32) block_size(u32)
+    blocks: zlib compressed data of each non-zero block
+    index:  (image_offset u64, data_size u32, file_offset u64, compressed_size u32) per block
+    footer: index_offset(u64) block_count(u64) image_size(u64) magic(8)
+Zero blocks are not stored, they read back as holes.
+"""
+
+import os
+import struct
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+XSPZ_MAGIC = b"XSPZIMG1"
+XSPZ_VERSION = 1
+_XSPZ_HEADER = struct.Struct("<8sII")
+_XSPZ_INDEX = struct.Struct("<QIQI")
+_XSPZ_FOOTER = struct.Struct("<QQQ8s")
+
+
+def nonzero_runs(data, page_size=4096):
+    """Find the runs of non-zero pages in data
+
+    Args:
+        data (bytes/memoryview): Data to check
+        page_size (int): Page size
+    Returns:
+        list: [(start, end), ...] byte offsets of non-zero runs
+    """
+    data = memoryview(data).cast("B")
+    size = len(data)
+    if np is not None and size % 8 == 0 and size >= page_size and page_size % 8 == 0:
+        body = size - size % page_size
+        pages = np.frombuffer(data[:body], dtype=np.uint64).reshape(-1, page_size//8).any(axis=1)
+        flags = pages.tolist()
+        if body < size:
+            flags.append(data[body:].tobytes().count(0) != size - body)
+    else:
+        if data.tobytes() == bytes(size):
+            return []
+        zero_page = bytes(page_size)
+        flags = []
+        for i in range(0, size, page_size):
+            page = data[i:i+page_size].tobytes()
+            flags.append(page != zero_page[:len(page)])
+    runs = []
+    for i, nz in enumerate(flags):
+        if not nz:
+            continue
+        start = i*page_size
+        end = min(size, start + page_size)
+        if runs and runs[-1][1] == start:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+    return [(s, e) for s, e in runs]
+
+
+class SparseImageWriter:
+    """Write image data into a raw file, holes are skipped by seeking"""
+
+    def __init__(self, file_path):
+        self.file = open(file_path, "wb")
+        self.data_size = 0
+
+    def write(self, offset, data):
+        self.file.seek(offset)
+        self.file.write(data)
+        self.data_size += len(data)
+
+    def close(self, image_size):
+        self.file.truncate(image_size)
+        self.file.close()
+
+
+class XSPZImageWriter:
+    """Write image data into an indexed compressed container"""
+
+    def __init__(self, file_path, block_size=64*1024, level=1):
+        self.file = open(file_path, "wb")
+        self.block_size = block_size
+        self.level = level
+        self.index = []
+        self.data_size = 0
+        self.file.write(_XSPZ_HEADER.pack(XSPZ_MAGIC, XSPZ_VERSION, block_size))
+
+    def write(self, offset, data):
+        data = memoryview(data).cast("B")
+        self.data_size += len(data)
+        i = 0
+        while i < len(data):
+            # Split at block boundaries of the image, so blocks can be located by offset
+            end = min(len(data), i + self.block_size - (offset + i) % self.block_size)
+            comp = zlib.compress(data[i:end], self.level)
+            self.index.append((offset + i, end - i, self.file.tell(), len(comp)))
+            self.file.write(comp)
+            i = end
+
+    def close(self, image_size):
+        index_offset = self.file.tell()
+        for item in self.index:
+            self.file.write(_XSPZ_INDEX.pack(*item))
+        self.file.write(_XSPZ_FOOTER.pack(index_offset, len(self.index), image_size, XSPZ_MAGIC))
+        self.file.close()
+
+
+def is_xspz_file(file_path):
+    """Check if a file is an indexed compressed image"""
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) < _XSPZ_HEADER.size + _XSPZ_FOOTER.size:
+        return False
+    with open(file_path, "rb") as f:
+        return f.read(len(XSPZ_MAGIC)) == XSPZ_MAGIC
+
+
+def read_xspz_index(f):
+    """Read the index of an opened .xspz file
+
+    Returns:
+        (image_size, [(image_offset, data_size, file_offset, compressed_size), ...])
+    """
+    f.seek(0)
+    magic, version, _ = _XSPZ_HEADER.unpack(f.read(_XSPZ_HEADER.size))
+    assert magic == XSPZ_MAGIC and version == XSPZ_VERSION, "not a xspz image (or unsupported version)"
+    f.seek(-_XSPZ_FOOTER.size, os.SEEK_END)
+    index_offset, count, image_size, magic = _XSPZ_FOOTER.unpack(f.read(_XSPZ_FOOTER.size))
+    assert magic == XSPZ_MAGIC, "xspz image footer broken"
+    f.seek(index_offset)
+    raw = f.read(count*_XSPZ_INDEX.size)
+    return image_size, [_XSPZ_INDEX.unpack_from(raw, i*_XSPZ_INDEX.size) for i in range(count)]
+
+
+def unpack_xspz_file(src_file, dst_file):
+    """Unpack a .xspz image into a (sparse) raw bin file
+
+    Returns:
+        int: Image size
+    """
+    writer = SparseImageWriter(dst_file)
+    with open(src_file, "rb") as f:
+        image_size, index = read_xspz_index(f)
+        for image_offset, data_size, file_offset, comp_size in index:
+            f.seek(file_offset)
+            data = zlib.decompress(f.read(comp_size))
+            assert len(data) == data_size, f"xspz block at 0x{image_offset:x} broken"
+            writer.write(image_offset, data)
+    writer.close(image_size)
+    return image_size
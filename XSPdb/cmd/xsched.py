@@ -0,0 +1,101 @@
+#coding=utf-8
+"""Cycle-deadline events
+
+Events are kept in a heap by the cycle (xclock.clk) they are due at. The step loops clip
+every dut.Step to the next deadline and fire the due events after it, so an event runs
+exactly on its cycle without any per-cycle condition in the clock callbacks.
+"""
+
+import heapq
+import itertools
+
+
+class CycleEvent:
+    """An event at a cycle, repeated every period cycles if period > 0"""
+
+    def __init__(self, eid, cycle, callback, name, period):
+        self.id = eid
+        self.cycle = cycle
+        self.callback = callback
+        self.name = name
+        self.period = period
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.cycle, self.id) < (other.cycle, other.id)
+
+    def __repr__(self):
+        return f"CycleEvent({self.id}, {self.name}, cycle={self.cycle}, period={self.period})"
+
+
+class CycleScheduler:
+    """Heap of cycle-deadline events"""
+
+    def __init__(self):
+        self.heap = []
+        self.events = {}
+        self.ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, cycle, callback, name=None, period=0):
+        """Add an event
+
+        Args:
+            cycle (int): Cycle to fire at
+            callback (function): cb(cycle), returns True to stop stepping
+            name (string): Name of the event
+            period (int): Repeat every period cycles, 0 for once
+        Returns:
+            CycleEvent: The event
+        """
+        eid = next(self.ids)
+        event = CycleEvent(eid, cycle, callback, name or f"event-{eid}", period)
+        self.events[eid] = event
+        heapq.heappush(self.heap, event)
+        return event
+
+    def cancel(self, eid):
+        """Cancel an event by id, True if found"""
+        event = self.events.pop(eid, None)
+        if event is None:
+            return False
+        event.cancelled = True
+        return True
+
+    def clear(self):
+        self.heap.clear()
+        self.events.clear()
+
+    def next_cycle(self):
+        """Get the cycle of the next event, None if no event"""
+        heap = self.heap
+        while heap and heap[0].cancelled:
+            heapq.heappop(heap)
+        return heap[0].cycle if heap else None
+
+    def fire(self, clk):
+        """Fire the events due at or before clk, periodic events are re-armed
+
+        Returns:
+            list(CycleEvent): The events whose callback asked to stop
+        """
+        stops = []
+        heap = self.heap
+        while heap and heap[0].cycle <= clk:
+            event = heapq.heappop(heap)
+            if event.cancelled:
+                continue
+            if event.period > 0:
+                event.cycle += event.period
+                heapq.heappush(heap, event)
+            else:
+                del self.events[event.id]
+            if event.callback(clk):
+                stops.append(event)
+        return stops
+
+    def list(self):
+        """Get the pending events sorted by cycle"""
+        return sorted(self.events.values())
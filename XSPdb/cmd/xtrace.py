@@ -0,0 +1,334 @@
+#coding=utf-8
+"""Function-level timeline tracer: an event ring buffer and its output writers
+
+Events are (cycle, kind, symbol) kept in flat arrays. kind is TRACE_ENTER or TRACE_LEAVE,
+symbol is an interval index of the ELF symbol table (-1 for addresses outside any symbol).
+Writers take the events in order:
+    ChromeTraceWriter: Chrome trace JSON (chrome://tracing, Perfetto), 1 us in the viewer is 1 cycle
+    FoldedStackWriter: folded stacks ("a;b;c cycles" per line) for flamegraph.pl/speedscope
+SymbolAccount counts the exact cycles and instructions of every symbol on the same shadow stack.
+"""
+
+import json
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TRACE_ENTER = 0
+TRACE_LEAVE = 1
+
+
+class EventRing:
+    """Fixed size ring of events, the oldest events are overwritten when it is full"""
+
+    def __init__(self, capacity):
+        assert capacity > 0, "capacity need > 0"
+        self.capacity = capacity
+        self.cycle = array('Q', bytes(8*capacity))
+        self.kind = array('B', bytes(capacity))
+        self.sym = array('i', bytes(4*capacity))
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, cycle, kind, sym):
+        i = self.head
+        self.cycle[i] = cycle
+        self.kind[i] = kind
+        self.sym[i] = sym
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.dropped += 1
+
+    def is_full(self):
+        return self.count == self.capacity
+
+    def events(self):
+        """Iterate the events from the oldest to the newest"""
+        start = (self.head - self.count) % self.capacity
+        for n in range(self.count):
+            i = (start + n) % self.capacity
+            yield self.cycle[i], self.kind[i], self.sym[i]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+class ChromeTraceWriter:
+    """Stream events as Chrome trace duration events (B/E)"""
+
+    def __init__(self, path, name_of, buffer_size=1 << 20):
+        self.f = open(path, "w", buffering=buffer_size)
+        self.f.write('{"displayTimeUnit": "ns", "otherData": {"ts_unit": "cycle"}, "traceEvents": [\n')
+        self.name_of = name_of
+        self.names = {}
+        self.sep = ""
+
+    def write(self, cycle, kind, sym):
+        name = self.names.get(sym)
+        if name is None:
+            name = self.names[sym] = json.dumps(self.name_of(sym))
+        self.f.write('%s{"name": %s, "ph": "%s", "ts": %d, "pid": 0, "tid": 0}' %
+                     (self.sep, name, "B" if kind == TRACE_ENTER else "E", cycle))
+        self.sep = ",\n"
+
+    def close(self):
+        self.f.write("\n]}\n")
+        self.f.close()
+
+
+class FoldedStackWriter:
+    """Aggregate the cycles spent in every call stack, written as folded stacks on close"""
+
+    def __init__(self, path, name_of):
+        self.path = path
+        self.name_of = name_of
+        self.stack = []
+        self.counts = {}
+        self.last_cycle = None
+
+    def write(self, cycle, kind, sym):
+        if self.stack and self.last_cycle is not None and cycle > self.last_cycle:
+            key = tuple(self.stack)
+            self.counts[key] = self.counts.get(key, 0) + cycle - self.last_cycle
+        self.last_cycle = cycle
+        if kind == TRACE_ENTER:
+            self.stack.append(sym)
+        elif self.stack:
+            self.stack.pop()
+
+    def close(self):
+        names = {}
+        def name(sym):
+            if sym not in names:
+                names[sym] = self.name_of(sym).replace(";", ":").replace(" ", "_")
+            return names[sym]
+        with open(self.path, "w", buffering=1 << 20) as f:
+            for key, count in sorted(self.counts.items()):
+                f.write("%s %d\n" % (";".join(name(s) for s in key), count))
+
+
+def open_trace_writer(path, name_of):
+    """Open a writer by the file suffix: .folded/.txt for folded stacks, Chrome trace JSON otherwise"""
+    if path.endswith(".folded") or path.endswith(".txt"):
+        return FoldedStackWriter(path, name_of)
+    return ChromeTraceWriter(path, name_of)
+
+
+class ShadowStack:
+    """Turn the symbol changes of the PC into enter/leave events with a shadow call stack
+
+    A PC at the start of a symbol is a call. A PC inside a symbol on the shadow stack is a
+    return to it, other changes (tail calls, jumps into the middle of a function) replace the
+    top of the stack. Subclasses take the events in record().
+    """
+
+    def __init__(self, max_depth=1024):
+        self.max_depth = max_depth
+        self.stack = []
+        self.last_pc = None
+
+    def record(self, cycle, kind, sym):
+        raise NotImplementedError
+
+    def switch(self, cycle, pc, sym, at_entry):
+        """Update the shadow stack with a new PC
+
+        Args:
+            cycle (int): Current cycle
+            pc (int): Current PC
+            sym (int): Symbol of the PC
+            at_entry (bool): The PC is the start of the symbol
+        """
+        if pc == self.last_pc:
+            return
+        self.last_pc = pc
+        stack = self.stack
+        if stack and stack[-1] == sym and not at_entry:
+            return
+        if not at_entry and sym in stack:
+            while stack[-1] != sym:
+                self.record(cycle, TRACE_LEAVE, stack.pop())
+            return
+        if stack and (not at_entry or len(stack) >= self.max_depth):
+            self.record(cycle, TRACE_LEAVE, stack.pop())
+        stack.append(sym)
+        self.record(cycle, TRACE_ENTER, sym)
+
+    def leave_all(self, cycle):
+        """Leave all functions on the shadow stack"""
+        while self.stack:
+            self.record(cycle, TRACE_LEAVE, self.stack.pop())
+
+
+class FuncTracer(ShadowStack):
+    """Record the enter/leave events of the shadow stack into a ring buffer"""
+
+    def __init__(self, capacity=1 << 20, writer=None, max_depth=1024):
+        super().__init__(max_depth)
+        self.ring = EventRing(capacity)
+        self.writer = writer
+        self.last_cycle = 0
+        self.events = 0
+
+    def record(self, cycle, kind, sym):
+        if self.writer is not None and self.ring.is_full():
+            self.flush()
+        self.ring.push(cycle, kind, sym)
+        self.last_cycle = cycle
+        self.events += 1
+
+    def flush(self):
+        """Write the buffered events to the writer"""
+        if self.writer is None:
+            return
+        write = self.writer.write
+        for event in self.ring.events():
+            write(*event)
+        self.ring.clear()
+
+    def dump(self, writer):
+        """Write the buffered events to another writer (the buffer is kept)"""
+        for event in self.ring.events():
+            writer.write(*event)
+        writer.close()
+
+    def close(self, cycle=None):
+        """Leave all functions on the shadow stack, flush and close the writer"""
+        self.leave_all(self.last_cycle if cycle is None else cycle)
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class SymbolAccount(ShadowStack):
+    """Exact cycles and committed instructions per symbol
+
+    The cycles from the previous commit to a commit and the instructions of the commit belong
+    to the symbol of the committed PC (self). The cycles and instructions between entering and
+    leaving a symbol on the shadow stack belong to it with its callees (total), recursive calls
+    are counted once by the outermost frame. Counters are indexed by symbol interval, the slot
+    after the last symbol collects the PCs outside any symbol. The per-commit updates are
+    buffered in arrays and added to the counters in batches.
+    """
+
+    SELF_CYCLES = 0
+    SELF_INSTRS = 1
+    TOTAL_CYCLES = 2
+    TOTAL_INSTRS = 3
+
+    def __init__(self, nsym, cycle=0, buffer_size=4096, max_depth=1024):
+        super().__init__(max_depth)
+        self.nsym = nsym
+        if np is not None:
+            self.counters = np.zeros((4, nsym + 1), dtype=np.int64)
+        else:
+            self.counters = [array('q', bytes(8*(nsym + 1))) for _ in range(4)]
+        self.active = array('I', bytes(4*(nsym + 1)))
+        self.frames = []
+        self.start_cycle = cycle
+        self.cycle = cycle
+        self.instrs = 0
+        self.buffer_size = buffer_size
+        self.self_buffer = (array('q'), array('q'), array('q'))
+        self.total_buffer = (array('q'), array('q'), array('q'))
+
+    def commit(self, cycle, pc, sym, at_entry, count=1):
+        """Account a commit
+
+        Args:
+            cycle (int): Cycle of the commit
+            pc (int): Committed PC
+            sym (int): Symbol of the PC, -1 if outside any symbol
+            at_entry (bool): The PC is the start of the symbol
+            count (int): Number of instructions committed
+        """
+        last = self.cycle
+        self.switch(last, pc, sym, at_entry)
+        syms, cycles, instrs = self.self_buffer
+        syms.append(sym if sym >= 0 else self.nsym)
+        cycles.append(max(cycle - last, 0))
+        instrs.append(count)
+        self.cycle = cycle
+        self.instrs += count
+        if len(syms) >= self.buffer_size:
+            self.fold()
+
+    def record(self, cycle, kind, sym):
+        s = sym if sym >= 0 else self.nsym
+        if kind == TRACE_ENTER:
+            self.frames.append((cycle, self.instrs))
+            self.active[s] += 1
+            return
+        enter_cycle, enter_instrs = self.frames.pop()
+        self.active[s] -= 1
+        if self.active[s] == 0:
+            syms, cycles, instrs = self.total_buffer
+            syms.append(s)
+            cycles.append(cycle - enter_cycle)
+            instrs.append(self.instrs - enter_instrs)
+
+    def _fold(self, buffer, cycles_row, instrs_row):
+        syms, cycles, instrs = buffer
+        if not syms:
+            return
+        if np is not None:
+            index = np.frombuffer(syms, dtype=np.int64)
+            np.add.at(self.counters[cycles_row], index, np.frombuffer(cycles, dtype=np.int64))
+            np.add.at(self.counters[instrs_row], index, np.frombuffer(instrs, dtype=np.int64))
+        else:
+            crow, irow = self.counters[cycles_row], self.counters[instrs_row]
+            for s, c, i in zip(syms, cycles, instrs):
+                crow[s] += c
+                irow[s] += i
+
+    def fold(self):
+        """Add the buffered updates to the counters"""
+        self._fold(self.self_buffer, self.SELF_CYCLES, self.SELF_INSTRS)
+        self._fold(self.total_buffer, self.TOTAL_CYCLES, self.TOTAL_INSTRS)
+        self.self_buffer = (array('q'), array('q'), array('q'))
+        self.total_buffer = (array('q'), array('q'), array('q'))
+
+    def close(self):
+        """Leave all functions on the shadow stack and fold the counters"""
+        self.leave_all(self.cycle)
+        self.fold()
+
+    def report(self):
+        """Get the counters of the symbols with commits
+
+        The frames still on the shadow stack are counted up to the last commit.
+
+        Returns:
+            list((sym, self_cycles, self_instrs, total_cycles, total_instrs)): sym is -1 for
+            the PCs outside any symbol, sorted by self cycles
+        """
+        self.fold()
+        pending = {}
+        counted = set()
+        for s, (enter_cycle, enter_instrs) in zip(self.stack, self.frames):
+            s = s if s >= 0 else self.nsym
+            if s not in counted:
+                counted.add(s)
+                pending[s] = (self.cycle - enter_cycle, self.instrs - enter_instrs)
+        rows = []
+        for s in range(self.nsym + 1):
+            self_cycles, self_instrs, total_cycles, total_instrs = (int(self.counters[r][s]) for r in range(4))
+            if s in pending:
+                total_cycles += pending[s][0]
+                total_instrs += pending[s][1]
+            if self_instrs == 0 and total_instrs == 0 and self_cycles == 0:
+                continue
+            rows.append((s if s < self.nsym else -1, self_cycles, self_instrs, total_cycles, total_instrs))
+        rows.sort(key=lambda r: (r[1], r[3]), reverse=True)
+        return rows
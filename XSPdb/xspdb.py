@@ -12,6 +12,7 @@ import sys
 
 from XSPdb.cmd.util import message, info, error, warn, build_prefix_tree, register_commands, YELLOW, RESET, xspdb_set_log, xspdb_set_log_file, log_message
 from XSPdb.cmd.util import load_module_from_file, load_package_from_dir, set_xspdb_log_level
+from XSPdb.cmd.xcond import CondRegistry
 from logging import DEBUG, INFO, WARNING, ERROR
 
 class XSPdb(pdb.Pdb):
@@ -56,6 +57,8 @@ class XSPdb(pdb.Pdb):
         self.dut.InitClock("clock")
         self.c_stderr_echo = xsp.ComUseEcho(dut.difftest_uart_out_valid.CSelf(), dut.difftest_uart_out_ch.CSelf())
         self.dut.StepRis(self.c_stderr_echo.GetCb(), self.c_stderr_echo.CSelf(), "uart_echo")
+        # All break conditions share one checker
+        self.cond_registry = CondRegistry(xsp, self.dut.xclock)
         # Init difftest
         self.exec_bin_file = default_file
         self.mem_size = default_mem_size
@@ -414,20 +417,28 @@ class XSPdb(pdb.Pdb):
         if exec is None:
             exec = self.onecmd
         self.batch_depth += 1
-        while len(self.batch_cmds_to_exec) > 0:
-            line, gap_time, callback = self.batch_cmds_to_exec.pop(0)
-            info(f"Batch exec: '{line}'")
-            self.api_dut_step_ready()
-            self.__last_batch_cmd_ret__ = exec(line, False)
-            if callback:
-                callback(self, line)
-            self.api_busy_sleep(gap_time)
-            if self.interrupt:
-                if callable(break_handler):
-                    self.batch_depth -= 1
-                    return break_handler(exec_count)
-            exec_count += 1
+        # Memory writes in one batch are merged and flushed at the end (or before reads/steps)
+        self.api_mem_write_batch_begin()
+        try:
+            while len(self.batch_cmds_to_exec) > 0:
+                line, gap_time, callback = self.batch_cmds_to_exec.pop(0)
+                info(f"Batch exec: '{line}'")
+                self.api_dut_step_ready()
+                self.__last_batch_cmd_ret__ = exec(line, False)
+                if callback:
+                    callback(self, line)
+                self.api_busy_sleep(gap_time)
+                if self.interrupt:
+                    if callable(break_handler):
+                        self.batch_depth -= 1
+                        self.api_mem_write_batch_end()
+                        return break_handler(exec_count)
+                exec_count += 1
+        except BaseException:
+            self.api_mem_write_batch_end()
+            raise
         self.batch_depth -= 1
+        self.api_mem_write_batch_end()
         return exec_count
 
     def interaction(self, frame, traceback):
@@ -96,6 +96,10 @@ def args_parser():
     parser.add_argument("--flash-base-address", type=address, default=0x10000000, help="base address of flash")
     parser.add_argument("--diff-first-inst_address", type=address, default=-1, help="first instruction address for difftest")
     parser.add_argument("--trace-pc-symbol-block-change", action="store_true", default=False, help="enable tracing of PC symbol block changes")
+    parser.add_argument("--trace-pc-symbol-file", type=str, default="", help="record a function timeline to a file (*.json Chrome trace, *.folded folded stacks)")
+    parser.add_argument("--profile-every", type=int, default=0, help="sample the commit PC every N cycles for a flat profile")
+    parser.add_argument("--profile-report", type=str, default="", help="profile report file (default: print the top symbols at exit)")
+    parser.add_argument("--func-stat-file", type=str, default="", help="write the exact cycles and instructions per symbol to a file at exit")
     parser.add_argument("--max-run-time", type=timesec, default=0, help="maximum run time (eg 10s, 1m, 1h)")
     return parser.parse_args()
 
@@ -140,13 +144,12 @@ def run_commits(xspdb, commits, max_run_time):
         commits = 0xFFFFFFFFFFFFFF
     batch_size = 100
     batch_count = commits // batch_size
-    batch_remain = commits % batch_size
     reach_max_time = False
     def run_delta(delta):
         nonlocal reach_max_time
         runc = 0
         while delta > 0 and not xspdb.api_dut_is_step_exit():
-            c = xspdb.api_xistep(delta)
+            c = step(delta)
             runc += c
             delta = delta - c
             check_is_need_trace(xspdb)
@@ -156,15 +159,26 @@ def run_commits(xspdb, commits, max_run_time):
                 reach_max_time = True
                 break
         return runc
+    if xspdb.api_xirun_is_native() and not xspdb.api_commit_hooks_on():
+        # count commits natively, Python only checks the run time every chunk
+        batch_size = 10000
+        batch_count = commits // batch_size
+        step = lambda n: xspdb.api_xirun(n, max_cycle=1000000)
+    else:
+        step = xspdb.api_xistep
     run_ins = 0
+    # A step can commit a few instructions past its target (several commits per cycle),
+    # the next step is shortened by the overshoot
     for _ in range(batch_count):
         if not reach_max_time and not xspdb.api_dut_is_step_exit():
-           run_ins += run_delta(batch_size)
+           run_ins += run_delta(min(batch_size, commits - run_ins))
         else:
             break
     if not reach_max_time:
-        run_ins += run_delta(batch_remain)
-    xspdb.message(f"Execute {run_ins} commits completed ({commits - run_ins} ignored)")
+        run_ins += run_delta(commits - run_ins)
+    done = min(run_ins, commits)
+    over = f", {run_ins - commits} more committed in the last cycle" if run_ins > commits else ""
+    xspdb.message(f"Execute {done} commits completed ({commits - done} ignored{over})")
 
 
 def create_xspdb():
@@ -219,38 +233,45 @@ def check_is_need_trace(xspdb):
 
 def main(args, xspdb):
     def emu_step(delta):
-        c = xspdb.api_step_dut(delta)
+        c = xspdb.api_run_native(delta, deadline)
         check_is_need_trace(xspdb)
         return c
     if args.wave_begin != args.wave_end:
         wave_file_path = args.wave_path if args.wave_path else ""
-        if args.wave_begin <= 0:
-            XSPdb.info(f"Waweform on at HW cycle = Zero")
+        if args.wave_begin <= xspdb.dut.xclock.clk:
+            XSPdb.info(f"Waweform on at HW cycle = {xspdb.dut.xclock.clk}")
             xspdb.api_waveform_on(wave_file_path)
         else:
-            def cb_on_log_begin(s, checker, k, clk, sig, target):
-                XSPdb.info(f"Waveform on at HW cycle = {target}")
+            def cb_on_log_begin(s, clk):
+                XSPdb.info(f"Waveform on at HW cycle = {clk}")
                 xspdb.api_waveform_on(wave_file_path)
-                s.interrupt = False
-            XSPdb.info(f"Set waveform on callback at HW cycle = {args.wave_begin}")
-            xspdb.api_xbreak("SimTop_top.SimTop.timer", "eq", args.wave_begin, callback=cb_on_log_begin, callback_once=True)
-        def cb_on_log_end(s, checker, k, clk, sig, target):
-            XSPdb.info(f"Waveform off at HW cycle = {target}")
+                return False
+            XSPdb.info(f"Set waveform on event at HW cycle = {args.wave_begin}")
+            xspdb.api_cycle_event(args.wave_begin, cb_on_log_begin, "wave-begin")
+        def cb_on_log_end(s, clk):
+            XSPdb.info(f"Waveform off at HW cycle = {clk}")
             xspdb.api_waveform_off()
-            s.interrupt = False
+            return False
         if args.wave_end > 0:
-            XSPdb.info(f"Set waveform off callback at HW cycle = {args.wave_end}")
-            xspdb.api_xbreak("SimTop_top.SimTop.timer", "eq", args.wave_end, callback=cb_on_log_end, callback_once=True)
+            XSPdb.info(f"Set waveform off event at HW cycle = {args.wave_end}")
+            xspdb.api_cycle_event(args.wave_end, cb_on_log_end, "wave-end")
     if args.interact_at > 0:
-        def cb_on_interact(s, checker, k, clk, sig, target):
-            XSPdb.info(f"Interact at HW cycle = {target}")
+        def cb_on_interact(s, clk):
+            XSPdb.info(f"Interact at HW cycle = {clk}")
             setattr(xspdb, "__xspdb_need_fast_trace__", True)
-        XSPdb.info(f"Set interact callback at HW cycle = {args.interact_at}")
-        xspdb.api_xbreak("SimTop_top.SimTop.timer", "eq", args.interact_at, callback=cb_on_interact, callback_once=True)
+            return True
+        XSPdb.info(f"Set interact event at HW cycle = {args.interact_at}")
+        xspdb.api_cycle_event(args.interact_at, cb_on_interact, "interact")
     if args.flash:
         xspdb.api_dut_flash_load(args.flash)
     if args.trace_pc_symbol_block_change:
         xspdb.api_turn_on_pc_symbol_block_change(True)
+    if args.trace_pc_symbol_file:
+        xspdb.api_ftrace_start(args.trace_pc_symbol_file)
+    if args.profile_every > 0:
+        xspdb.api_profile_start(args.profile_every)
+    if args.func_stat_file:
+        xspdb.api_funcstat_start()
     if args.cmds:
         for c in args.cmds.replace("\\n", "\n").split("\n"):
             xspdb.api_append_init_cmd(c.strip())
@@ -287,11 +308,12 @@ def main(args, xspdb):
     if not args.image:
         XSPdb.warn("No image to execute, Entering the interactive debug mode")
         xspdb.set_trace()
-    cycle_batch_size = 10000
+    cycle_batch_size = 1 << 32
     cycle_batch_count = args.max_cycles // cycle_batch_size
     cycle_batch_remain = args.max_cycles % cycle_batch_size
     cycle_reach_max_time = False
     time_start = time.time()
+    deadline = time_start + args.max_run_time if args.max_run_time > 0 else 0
     def run_cycle_deta(delta):
         nonlocal cycle_reach_max_time
         runc = 0
@@ -300,8 +322,8 @@ def main(args, xspdb):
             runc += c
             delta = delta - c
             check_is_need_trace(xspdb)
-            delta_time = time.time() - time_start
-            if delta_time > args.max_run_time and args.max_run_time > 0:
+            if xspdb.run_timeout:
+                delta_time = time.time() - time_start
                 cycle_reach_max_time = True
                 XSPdb.info(f"Max run time {timesec_to_str(args.max_run_time)} reached (runed {timesec_to_str(delta_time)}), exit cycle execution")
                 break
@@ -330,3 +352,14 @@ if __name__ == "__main__":
         XSPdb.info("Exit.")
     except bdb.BdbQuit:
         pass
+    finally:
+        xspdb.api_ftrace_stop()
+        if args.profile_every > 0:
+            xspdb.api_profile_stop()
+            if args.profile_report:
+                xspdb.api_profile_write_report(args.profile_report)
+            else:
+                xspdb.do_xprofile("report")
+        if xspdb.funcstat is not None and args.func_stat_file:
+            xspdb.api_funcstat_stop()
+            xspdb.api_funcstat_write_report(args.func_stat_file)
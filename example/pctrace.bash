@@ -11,7 +11,8 @@
 # The log files will be named after the ELF files, with a .all.log and
 # .exec.log extension.
 # The script will also generate a .exec.fst file for each ELF file, which
-# contains the execution trace of the ELF file.
+# contains the execution trace of the ELF file, and a .folded file with the
+# cycles spent in each call stack of the ELF symbols (input of flamegraph.pl).
 # The script will print the progress of the processing, including the
 # number of ELF files processed, the total number of ELF files, the
 # percentage of completion, the elapsed time, and the estimated finish
@@ -71,6 +72,7 @@ for elf in `find $TARGET_DIR -name *.elf`; do
     save_alg=${log_prefix}".all.log"
     save_log=${log_prefix}".exec.log"
     save_fst=${log_prefix}".exec.fst"
+    save_trc=${log_prefix}".folded"
     if [ -f "$save_log" ]; then
         debug "skip $elf, log file already exists"
         used_files=$((used_files + 1))
@@ -79,7 +81,7 @@ for elf in `find $TARGET_DIR -name *.elf`; do
     job_start_time=$(date +%s)
     debug "Processing ELF: $elf at $(date +%Y-%m-%d\ %H:%M:%S)"
     # construct the arguments for emu.py
-    ARGS="--no-interact -s $JPZ_SC_PATH -i $elf -pc -1 --trace-pc-symbol-block-change"
+    ARGS="--no-interact -s $JPZ_SC_PATH -i $elf -pc -1 --trace-pc-symbol-file $save_trc"
     ARGS="$ARGS --log-file $save_log --log-level warn --wave-path $save_fst -e -1 -C 1000000000 $CARGS"
     # run the emu.py
     stdbuf -oL -eL $EMU_PY_PATH $ARGS 2>&1|tee $save_alg